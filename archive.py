@@ -0,0 +1,369 @@
+## @namespace archive
+#  The archive module packs a whole run into one compressed, column oriented directory keyed by time
+
+"""
+Archive.py module
+
+A tipsy snapshot stores 44 bytes per star, a third of which (metals, tform, eps) are always zero, and
+mass and IDs are repeated in every snapshot. An archive directory stores:
+
+	index.json		format, chunk size, compression, and per frame the time and the location of each chunk
+	mass.bin		masses, once (in ID order)
+	IDs.bin			particle IDs, once (sorted)
+	pos.bin			positions of every frame (in ID order), optionally lossy (float16 or 16-bit quantized)
+	vel.bin			velocities of every frame (in ID order)
+
+Every column is cut into chunks of chunk_size stars that are byte shuffled and zlib compressed on their
+own, so a single column, frame or range of stars is read without decompressing anything else. Frames are
+appended one at a time (the index is rewritten atomically after each frame), so an archive can be filled
+while Bonsai is still running.
+
+Project: UC San Diego Physics 241, Winter 2014, Prof. J. Kuti
+"""
+
+import json, os, zlib, numbers
+import numpy as np
+import tipsy
+
+##\short	Position formats: stored dtype of each format
+POS_FORMATS = {'float32':np.float32, 'float16':np.float16, 'quantized':np.uint16}
+
+##\short	Version number written in index.json
+ARCHIVE_VERSION = 1
+
+def shuffle_bytes(array):
+	"""
+	Groups the bytes of an array by significance (all first bytes, then all second bytes, ...)
+
+	Floats of similar magnitude share their high bytes, so the shuffled data compresses much better.
+
+	@param[in]	array	contiguous numpy array
+
+	@returns	bytes
+	"""
+	itemsize = array.dtype.itemsize
+	return np.ascontiguousarray(array).view(np.uint8).reshape(-1, itemsize).T.tobytes()
+
+def unshuffle_bytes(data, dtype, shape):
+	"""
+	Inverse of shuffle_bytes()
+
+	@param[in]	data	bytes from shuffle_bytes()
+	@param[in]	dtype	numpy dtype of the array
+	@param[in]	shape	shape of the array
+
+	@returns	numpy array
+	"""
+	itemsize = np.dtype(dtype).itemsize
+	raw = np.frombuffer(data, dtype = np.uint8).reshape(itemsize, -1).T
+	return np.ascontiguousarray(raw).view(dtype).reshape(shape)
+
+class Archive(object):
+	"""
+	A column oriented, chunk compressed archive of the frames of one run
+
+	All frames hold the same particles. They are stored sorted by ID, so frames read from an archive
+	are in ID order no matter how Bonsai ordered the snapshot.
+	"""
+
+	## Path of the archive directory
+	path = None
+	## Contents of index.json
+	index = None
+	## Array of frame simulation times
+	times = None
+	## True if frames can be appended
+	writable = False
+	## Cached masses (ID order)
+	mass_cache = None
+	## Cached IDs (sorted)
+	IDs_cache = None
+
+	def __init__(self, path, mode = 'r', chunk_size = 65536, level = 6, pos_format = 'float32'):
+		"""
+		Opens (mode 'r' or 'a') or creates (mode 'w') an archive
+
+		chunk_size, level and pos_format are only used when the archive is created.
+
+		@param[in]	path		archive directory
+		@param[in]	mode		'r' read, 'a' read and append frames, 'w' create (an existing archive is replaced) (default: 'r')
+		@param[in]	chunk_size	stars per compressed chunk (default: 65536)
+		@param[in]	level		zlib compression level 0-9 (default: 6)
+		@param[in]	pos_format	'float32' (lossless), 'float16' or 'quantized' (16 bits per coordinate within the frame's bounding box) (default: 'float32')
+
+		@returns	an instance of the Archive object
+		"""
+		if mode not in ('r', 'a', 'w'):
+			raise Exception("Error: unknown archive mode '%s'" % mode)
+		if pos_format not in POS_FORMATS:
+			raise Exception("Error: unknown position format '%s' (one of %s)" % (pos_format, ', '.join(sorted(POS_FORMATS))))
+		self.path = path
+		self.writable = mode != 'r'
+
+		if mode == 'w':
+			if not os.path.isdir(path):
+				os.makedirs(path)
+			for column in ('mass', 'IDs', 'pos', 'vel'):
+				if os.path.exists(self.column_file(column)):
+					os.remove(self.column_file(column))
+			self.index = {'version':ARCHIVE_VERSION, 'nStars':None, 'chunk_size':chunk_size, 'level':level,
+						  'pos_format':pos_format, 'mass':None, 'IDs':None, 'frames':[]}
+			self.save_index()
+		else:
+			if not os.path.isfile(os.path.join(path, 'index.json')):
+				raise Exception("Error: '%s' is not an archive (no index.json)" % path)
+			self.index = json.load(open(os.path.join(path, 'index.json')))
+			if self.index['version'] > ARCHIVE_VERSION:
+				raise Exception("Error: archive version %i is newer than this module (%i)" % (self.index['version'], ARCHIVE_VERSION))
+		self.times = np.array([frame['time'] for frame in self.index['frames']])
+
+	def column_file(self, column):
+		"""
+		@param[in]	column	'mass', 'IDs', 'pos' or 'vel'
+
+		@returns	path of the column's data file
+		"""
+		return os.path.join(self.path, column + '.bin')
+
+	def save_index(self):
+		"""
+		Writes index.json (to a temporary file that is renamed, so a reader never sees a partial index)
+
+		@returns	None
+		"""
+		index_file = os.path.join(self.path, 'index.json')
+		json.dump(self.index, open(index_file + '.tmp', 'w'), indent = 1, sort_keys = True)
+		os.rename(index_file + '.tmp', index_file)
+
+	def write_column(self, column, array):
+		"""
+		Appends an array to a column file as compressed chunks
+
+		@param[in]	column	column name
+		@param[in]	array	(N or Nx3 array) data in its stored dtype
+
+		@returns	column entry for the index: {'dtype', 'shape', 'chunks':[[offset, length], ...]}
+		"""
+		chunk_size = self.index['chunk_size']
+		out = open(self.column_file(column), 'ab')
+		out.seek(0, os.SEEK_END)
+		chunks = []
+		for first in range(0, max(len(array), 1), chunk_size):
+			data = zlib.compress(shuffle_bytes(array[first:first + chunk_size]), self.index['level'])
+			chunks.append([out.tell(), len(data)])
+			out.write(data)
+		out.close()
+		return {'dtype':array.dtype.str, 'shape':list(array.shape), 'chunks':chunks}
+
+	def read_column(self, entry, column, start = 0, stop = None):
+		"""
+		Reads rows start..stop-1 of one stored array, decompressing only the chunks that hold them
+
+		@param[in]	entry	column entry from the index
+		@param[in]	column	column name
+		@param[in]	start	first row (default: 0)
+		@param[in]	stop	end row (default: None, all rows)
+
+		@returns	numpy array in its stored dtype
+		"""
+		chunk_size = self.index['chunk_size']
+		shape = entry['shape']
+		nRows = shape[0]
+		stop = nRows if stop is None else min(stop, nRows)
+		start = max(0, min(start, stop))
+		first_chunk, last_chunk = start//chunk_size, (stop - 1)//chunk_size
+		parts = []
+		tfile = open(self.column_file(column), 'rb')
+		for chunk in range(first_chunk, last_chunk + 1) if stop > start else []:
+			offset, length = entry['chunks'][chunk]
+			tfile.seek(offset)
+			data = zlib.decompress(tfile.read(length))
+			rows = min(chunk_size, nRows - chunk*chunk_size)
+			parts.append(unshuffle_bytes(data, np.dtype(entry['dtype']), [rows] + shape[1:]))
+		tfile.close()
+		if not parts:
+			return np.zeros([0] + shape[1:], dtype = np.dtype(entry['dtype']))
+		array = np.concatenate(parts)
+		first_row = first_chunk*chunk_size
+		return array[start - first_row:stop - first_row]
+
+	def append(self, stars):
+		"""
+		Adds a frame
+
+		The first frame fixes the particle set: its masses and IDs are stored once. Later frames must hold the same IDs.
+
+		@param[in]	stars	Stars object (any particle order)
+
+		@returns	None
+		"""
+		if not self.writable:
+			raise Exception("Error: archive '%s' is opened read-only" % self.path)
+		order = np.argsort(stars.IDs, kind = 'mergesort')
+		IDs = np.asarray(stars.IDs[order], dtype = np.int64)
+		if self.index['nStars'] is None:
+			self.index['nStars'] = len(IDs)
+			self.index['mass'] = self.write_column('mass', np.asarray(stars.mass[order], dtype = np.float32))
+			self.index['IDs'] = self.write_column('IDs', IDs)
+		elif len(IDs) != self.index['nStars'] or not np.array_equal(IDs, self.IDs()):
+			raise Exception("Error: frame at time %g does not hold the same particles as the archive" % stars.time)
+
+		pos = np.asarray(stars.pos[order], dtype = np.float32)
+		frame = {'time':float(stars.time)}
+		pos_format = self.index['pos_format']
+		if pos_format == 'quantized':
+			lo = pos.min(axis = 0) if len(pos) else np.zeros(3, dtype = np.float32)
+			hi = pos.max(axis = 0) if len(pos) else np.ones(3, dtype = np.float32)
+			scale = np.where(hi > lo, hi - lo, 1.0).astype(np.float64)
+			frame['pos_lo'] = lo.tolist()
+			frame['pos_scale'] = scale.tolist()
+			pos = np.round((pos - lo)/scale*65535).astype(np.uint16)
+		else:
+			pos = pos.astype(POS_FORMATS[pos_format])
+		frame['pos'] = self.write_column('pos', pos)
+		frame['vel'] = self.write_column('vel', np.asarray(stars.vel[order], dtype = np.float32))
+
+		self.index['frames'].append(frame)
+		self.save_index()
+		self.times = np.append(self.times, frame['time'])
+
+	def __len__(self):
+		return len(self.index['frames'])
+
+	def __iter__(self):
+		for index in range(len(self)):
+			yield self.frame(index)
+
+	def __getitem__(self, key):
+		if isinstance(key, numbers.Integral):
+			if key < 0:
+				key += len(self)
+			if not 0 <= key < len(self):
+				raise IndexError("frame index out of range")
+			return self.frame(key)
+		elif isinstance(key, numbers.Real):
+			return self.frame(self.index_of_time(key))
+		else:
+			raise TypeError("frames are selected by index or time")
+
+	def index_of_time(self, time):
+		"""
+		Index of the frame closest to a simulation time
+
+		@param[in]	time	simulation time
+
+		@returns	frame index (int)
+		"""
+		if len(self) == 0:
+			raise IndexError("no frames in archive")
+		return int(np.argmin(np.abs(self.times - time)))
+
+	def mass(self, start = 0, stop = None):
+		"""
+		@param[in]	start, stop		range of stars in ID order (default: all)
+
+		@returns	(float32 array) masses
+		"""
+		if start == 0 and stop is None:
+			if self.mass_cache is None:
+				self.mass_cache = self.read_column(self.index['mass'], 'mass')
+			return self.mass_cache
+		return self.read_column(self.index['mass'], 'mass', start, stop)
+
+	def IDs(self, start = 0, stop = None):
+		"""
+		@param[in]	start, stop		range of stars in ID order (default: all)
+
+		@returns	(int64 array) sorted particle IDs
+		"""
+		if start == 0 and stop is None:
+			if self.IDs_cache is None:
+				self.IDs_cache = self.read_column(self.index['IDs'], 'IDs')
+			return self.IDs_cache
+		return self.read_column(self.index['IDs'], 'IDs', start, stop)
+
+	def pos(self, index, start = 0, stop = None):
+		"""
+		Positions of one frame (lossy formats are converted back to float32)
+
+		@param[in]	index		frame index
+		@param[in]	start, stop	range of stars in ID order (default: all)
+
+		@returns	(Nx3 float32 array)
+		"""
+		frame = self.index['frames'][index]
+		pos = self.read_column(frame['pos'], 'pos', start, stop)
+		if self.index['pos_format'] == 'quantized':
+			return (pos/65535.*np.array(frame['pos_scale']) + np.array(frame['pos_lo'])).astype(np.float32)
+		return pos.astype(np.float32)
+
+	def vel(self, index, start = 0, stop = None):
+		"""
+		Velocities of one frame
+
+		@param[in]	index		frame index
+		@param[in]	start, stop	range of stars in ID order (default: all)
+
+		@returns	(Nx3 float32 array)
+		"""
+		return self.read_column(self.index['frames'][index]['vel'], 'vel', start, stop)
+
+	def frame(self, index):
+		"""
+		One frame as a Stars object (in ID order)
+
+		@param[in]	index	frame index
+
+		@returns	a Stars object
+		"""
+		stars = tipsy.Stars()
+		stars.add_stars(self.mass(), self.pos(index), self.vel(index), self.IDs())
+		stars.trim()
+		stars.time = float(self.times[index])
+		return stars
+
+	def sizes(self):
+		"""
+		@returns	dictionary of stored bytes per column file and in total
+		"""
+		sizes = {}
+		for column in ('mass', 'IDs', 'pos', 'vel'):
+			sizes[column] = os.path.getsize(self.column_file(column)) if os.path.exists(self.column_file(column)) else 0
+		sizes['total'] = sum(sizes.values())
+		return sizes
+
+def from_tipsy(tipsy_prefix, path, chunk_size = 65536, level = 6, pos_format = 'float32'):
+	"""
+	Packs every "[tipsy_prefix]{time}" snapshot into a new archive (in time order)
+
+	@param[in]	tipsy_prefix	prefix of tipsy files
+	@param[in]	path			archive directory
+	@param[in]	chunk_size		stars per compressed chunk (default: 65536)
+	@param[in]	level			zlib compression level (default: 6)
+	@param[in]	pos_format		'float32', 'float16' or 'quantized' (default: 'float32')
+
+	@returns	the Archive object
+	"""
+	archive = Archive(path, 'w', chunk_size, level, pos_format)
+	for stars in tipsy.SnapshotSeries(tipsy_prefix, cache_size = 1, prefetch = True, mmap = True):
+		archive.append(stars)
+	return archive
+
+def to_tipsy(path, tipsy_prefix):
+	"""
+	Writes every frame of an archive as "[tipsy_prefix]{time}" snapshots ({time} formatted like Bonsai, %010.4f)
+
+	Stars are written in ID order with the IDs in phi.
+
+	@param[in]	path			archive directory
+	@param[in]	tipsy_prefix	prefix of the tipsy files
+
+	@returns	list of tipsy file paths
+	"""
+	archive = Archive(path)
+	paths = []
+	for index in range(len(archive)):
+		tipsy_file = tipsy_prefix + '%010.4f' % archive.times[index]
+		tipsy.write_stars(tipsy_file, archive.times[index], archive.mass(), archive.pos(index), archive.vel(index), archive.IDs())
+		paths.append(tipsy_file)
+	return paths
@@ -0,0 +1,203 @@
+## @namespace suite
+#  Reproducible benchmarks of the tipsy I/O, transform, ID selection and rendering hot paths
+
+"""
+suite.py benchmark
+
+Generates synthetic tipsy files (seeded, so every run uses the same data) and measures, for each size:
+read/write throughput (MB/s), memory-mapped open, rotate_euler/boost/translate and composed Transform,
+ID index build and selection, rendering time per frame and peak memory. Each size runs in its own
+process so the peak memory belongs to that size only. Needs numpy and matplotlib, no GPU or Bonsai.
+
+Usage (from the repo folder):
+
+    python benchmarks/suite.py --out results.json
+    python benchmarks/suite.py --sizes 1e3,1e4,1e5,1e6,1e7 --compare results.json
+
+With --compare the results are printed next to the baseline and the exit status is 1 if any
+timing got slower by more than --threshold (default 10%).
+"""
+
+import os, sys, json, time, platform, tempfile, argparse, resource
+from multiprocessing import Process, Queue
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+import tipsy
+
+##\short	Particle counts benchmarked by default
+DEFAULT_SIZES = [10**3, 10**4, 10**5, 10**6]
+
+def best_of(repeat, func, *args):
+	"""
+	Runs func repeat times
+
+	@returns	shortest wall clock time in seconds
+	"""
+	best = None
+	for i in range(repeat):
+		start = time.time()
+		func(*args)
+		elapsed = time.time() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return best
+
+def make_stars(nStars, seed = 241):
+	"""
+	Synthetic flattened Gaussian galaxy with shuffled IDs (like a Bonsai snapshot)
+
+	@returns	a Stars object
+	"""
+	rng = np.random.RandomState(seed)
+	pos = rng.normal(scale = .2, size = (nStars,3))
+	pos[:,2] *= .1
+	stars = tipsy.Stars()
+	stars.add_stars(np.full(nStars, 1./nStars), pos, rng.normal(scale = .1, size = (nStars,3)), rng.permutation(nStars))
+	stars.trim()
+	return stars
+
+def run_size(nStars, repeat, tmpdir, mplot3d_max):
+	"""
+	All benchmarks for one particle count
+
+	@returns	dictionary of metric name to value
+	"""
+	tipsy.TIMER.enabled = False
+	result = {}
+	stars = make_stars(nStars)
+	path = os.path.join(tmpdir, 'bench_%i.tipsy' % nStars)
+
+	result['write_s'] = best_of(repeat, tipsy.write_stars, path, 0.0, stars.mass, stars.pos, stars.vel, stars.IDs)
+	size_MB = os.path.getsize(path)/1e6
+	result['file_MB'] = size_MB
+	result['write_MBps'] = size_MB/result['write_s']
+
+	quiet = open(os.devnull, 'w')
+	stdout = sys.stdout
+	sys.stdout = quiet #Stars() prints a line per file
+	try:
+		result['read_s'] = best_of(repeat, tipsy.Stars, path)
+		result['read_MBps'] = size_MB/result['read_s']
+		result['mmap_open_s'] = best_of(repeat, tipsy.Stars, path, True)
+		mapped = tipsy.Stars(path, mmap = True)
+		result['mmap_sum_pos_s'] = best_of(repeat, lambda: mapped.pos.sum(axis=0))
+	finally:
+		sys.stdout = stdout
+
+	result['rotate_euler_s'] = best_of(repeat, stars.rotate_euler, .1, .2, .3)
+	result['boost_s'] = best_of(repeat, stars.boost, (.1, 0, 0))
+	result['translate_s'] = best_of(repeat, stars.translate, (.1, 0, 0))
+	transform = tipsy.Transform().rotate_euler(.1, .2, .3).translate((.1, 0, 0)).boost((.1, 0, 0))
+	result['transform_s'] = best_of(repeat, stars.transform, transform)
+
+	ids = np.arange(0, nStars, max(1, nStars//1000))
+	def build_and_select():
+		stars.id_index = None
+		stars.indices_of(ids)
+	result['id_index_build_s'] = best_of(repeat, build_and_select)
+	result['id_select_cached_s'] = best_of(repeat, stars.indices_of, ids)
+
+	figure = os.path.join(tmpdir, 'bench_%i' % nStars)
+	result['rasterize_s'] = best_of(repeat, stars.rasterize)
+	result['render_raster_s'] = best_of(repeat, stars.save_image, figure)
+	if nStars <= mplot3d_max:
+		result['render_mplot3d_s'] = best_of(1, stars.save_figure, figure)
+
+	#sort_spatial() reorders the stars in place, so it runs after the generation order benchmarks
+	result['sort_spatial_s'] = best_of(repeat, stars.sort_spatial)
+	result['rasterize_sorted_s'] = best_of(repeat, stars.rasterize)
+
+	os.remove(path)
+	for ext in ('.png',):
+		if os.path.exists(figure + ext):
+			os.remove(figure + ext)
+
+	#Linux reports kilobytes
+	result['peak_memory_MB'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.
+	return result
+
+def run_size_process(nStars, repeat, tmpdir, mplot3d_max, queue):
+	"""
+	Process target: runs run_size() and sends the result (or the error) back
+	"""
+	try:
+		queue.put(run_size(nStars, repeat, tmpdir, mplot3d_max))
+	except Exception as e:
+		queue.put({'error':repr(e)})
+
+def run_suite(sizes, repeat = 3, mplot3d_max = 10**5):
+	"""
+	Runs all sizes, each in a fresh process
+
+	@returns	results dictionary (meta data and per-size metrics)
+	"""
+	tmpdir = tempfile.mkdtemp()
+	results = {}
+	for nStars in sizes:
+		queue = Queue()
+		process = Process(target = run_size_process, args = (nStars, repeat, tmpdir, mplot3d_max, queue))
+		process.start()
+		results[str(nStars)] = queue.get()
+		process.join()
+		print 'nStars %-9i done' % nStars
+	os.rmdir(tmpdir)
+
+	return {'meta':{'date':time.strftime('%Y-%m-%d %H:%M:%S'), 'python':platform.python_version(),
+					'numpy':np.__version__, 'platform':platform.platform(), 'repeat':repeat},
+			'results':results}
+
+def print_results(results, baseline = None, threshold = .1, min_time = 1e-3):
+	"""
+	Prints a table per size, with the baseline value and ratio when given
+
+	Timings shorter than min_time seconds (in both runs) are too noisy to be reported as regressions.
+
+	@returns	list of (size, metric, ratio) of timings slower than the baseline by more than threshold
+	"""
+	regressions = []
+	for size in sorted(results['results'], key = int):
+		metrics = results['results'][size]
+		base = (baseline or {}).get('results', {}).get(size, {})
+		print '\nnStars = %s' % size
+		for name in sorted(metrics):
+			value = metrics[name]
+			if not isinstance(value, float):
+				print '  %-22s %s' % (name, value)
+				continue
+			line = '  %-22s %12.5g' % (name, value)
+			if name in base:
+				ratio = value/base[name] if base[name] else float('inf')
+				line += '   baseline %12.5g   ratio %6.2f' % (base[name], ratio)
+				if name.endswith('_s') and ratio > 1. + threshold and max(value, base[name]) >= min_time:
+					line += '   SLOWER'
+					regressions.append((size, name, ratio))
+			print line
+	return regressions
+
+def main():
+	parser = argparse.ArgumentParser(description = 'tipsy benchmark suite')
+	parser.add_argument('--sizes', default = ','.join(str(n) for n in DEFAULT_SIZES), help = 'comma separated particle counts, e.g. 1e3,1e5')
+	parser.add_argument('--repeat', type = int, default = 3, help = 'repetitions per timing (the best is kept)')
+	parser.add_argument('--mplot3d-max', type = float, default = 1e5, help = 'largest size rendered with mplot3d')
+	parser.add_argument('--out', help = 'save results as JSON')
+	parser.add_argument('--compare', help = 'baseline JSON to compare with')
+	parser.add_argument('--threshold', type = float, default = .1, help = 'relative slowdown reported as a regression')
+	parser.add_argument('--min-time', type = float, default = 1e-3, help = 'timings below this many seconds are not compared')
+	args = parser.parse_args()
+
+	sizes = [int(float(size)) for size in args.sizes.split(',')]
+	results = run_suite(sizes, args.repeat, int(args.mplot3d_max))
+
+	if args.out:
+		json.dump(results, open(args.out, 'w'), indent = 1, sort_keys = True)
+		print 'Saved: ' + args.out
+
+	baseline = json.load(open(args.compare)) if args.compare else None
+	regressions = print_results(results, baseline, args.threshold, args.min_time)
+	if regressions:
+		print '\n%i timing(s) slower than baseline by more than %i%%' % (len(regressions), 100*args.threshold)
+		sys.exit(1)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,95 @@
+## @namespace tipsy_io
+#  Benchmark of the vectorized tipsy codec against the original per-particle struct loops
+
+"""
+tipsy_io.py benchmark
+
+Writes and reads a synthetic tipsy file with the bulk numpy codec in tipsy.py and with the
+per-particle struct.pack/struct.unpack loops it replaced, checks that both produce identical
+bytes and prints the timings.
+
+Usage (from the repo folder):
+
+    python benchmarks/tipsy_io.py [nStars]
+"""
+
+import os, sys, struct, time, tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+import tipsy
+
+
+def loop_write(tipsyFilePath, t, mass, pos, vel):
+	"""
+	Original per-particle writer (reference for byte-identical output)
+	"""
+	tfile = open(tipsyFilePath,'wb')
+	tfile.write(struct.pack('d',t))
+	tfile.write(struct.pack('iiiiii',len(mass),3,0,0,len(mass),0))
+	for i in range(len(mass)):
+		tfile.write(struct.pack('f3f3f3fi',mass[i],pos[i,0],pos[i,1],pos[i,2],vel[i,0],vel[i,1],vel[i,2],0.0,0.0,0.0,i))
+	tfile.close()
+
+def loop_read(tipsyFilePath):
+	"""
+	Original per-particle reader
+	"""
+	tfile = open(tipsyFilePath,'rb')
+	t, = struct.unpack('d',tfile.read(8))
+	nTot,dim,nGas,nDark,nStars,temp = struct.unpack('iiiiii',tfile.read(24))
+	mass = np.zeros((nStars),dtype=np.float32)
+	pos = np.zeros((nStars,dim),dtype=np.float32)
+	vel = np.zeros((nStars,dim),dtype=np.float32)
+	IDs = np.zeros((nStars),dtype=np.float32)
+	for i in range(nStars):
+		m,x1,x2,x3,v1,v2,v3,metals,tform,eps,phi = struct.unpack('f3f3f3fi',tfile.read(44))
+		pos[i,:] = (x1,x2,x3)
+		vel[i,:] = (v1,v2,v3)
+		mass[i] = m
+		IDs[i] = phi
+	tfile.close()
+	return mass, pos, vel, IDs
+
+def timed(func, *args):
+	start = time.time()
+	result = func(*args)
+	return time.time() - start, result
+
+def main(nStars):
+	rng = np.random.RandomState(241)
+	mass = np.full(nStars, 1./nStars, dtype=np.float32)
+	pos = rng.normal(size=(nStars,3)).astype(np.float32)
+	vel = rng.normal(size=(nStars,3)).astype(np.float32)
+
+	tmpdir = tempfile.mkdtemp()
+	loop_path = os.path.join(tmpdir,'loop.tipsy')
+	bulk_path = os.path.join(tmpdir,'bulk.tipsy')
+
+	t_loop_write, _ = timed(loop_write, loop_path, 0.5, mass, pos, vel)
+	t_bulk_write, _ = timed(tipsy.write_stars, bulk_path, 0.5, mass, pos, vel)
+
+	identical = open(loop_path,'rb').read() == open(bulk_path,'rb').read()
+
+	t_loop_read, loop_result = timed(loop_read, loop_path)
+	t_bulk_read, (header, records) = timed(tipsy.read_stars, bulk_path)
+
+	same_values = (np.array_equal(loop_result[1], records['pos']) and np.array_equal(loop_result[2], records['vel']))
+
+	size_MB = os.path.getsize(bulk_path)/1e6
+	print 'nStars: %i (%.1f MB)' % (nStars, size_MB)
+	print 'byte-identical output: %s, identical decoded values: %s' % (identical, same_values)
+	print '%-6s %12s %12s %10s' % ('', 'loop (s)', 'bulk (s)', 'speedup')
+	print '%-6s %12.4f %12.4f %9.1fx' % ('write', t_loop_write, t_bulk_write, t_loop_write/max(t_bulk_write,1e-9))
+	print '%-6s %12.4f %12.4f %9.1fx' % ('read', t_loop_read, t_bulk_read, t_loop_read/max(t_bulk_read,1e-9))
+
+	os.remove(loop_path)
+	os.remove(bulk_path)
+	os.rmdir(tmpdir)
+
+	if not (identical and same_values):
+		sys.exit(1)
+
+if __name__ == '__main__':
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -15,16 +15,36 @@ Project: UC San Diego Physics 241, Winter 2014, Prof. J. Kuti
 
 
 
-from subprocess import call
+import glob, os, re, sys, time, threading
+from subprocess import Popen, STDOUT
+from Queue import Queue
+
+import numpy as np
+import tipsy, timing
 
 ##\short	Path to Bonsai binary
 ##\details 	Default path, assuming bonsai_phys241 and Bonsai share parent folders
 BONSAI_BIN = "../Bonsai/runtime/bonsai2_slowdust"
 
-def run_tipsy(tipsy_file,snap_prefix,T,dt, dSnap, eps, bonsai_bin=None, mpi_n=0,mpi_log_file="mpiout.log"):
+##\short	Simulation backends: 'bonsai' runs the Bonsai binary, 'cpu' the nbody module's CPU Barnes-Hut leapfrog
+BACKENDS = ('bonsai', 'cpu')
+
+##\short	Script run by the 'cpu' backend (accepts Bonsai's command line)
+NBODY_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nbody.py')
+
+def run_tipsy(tipsy_file,snap_prefix,T,dt, dSnap, eps, bonsai_bin=None, mpi_n=0,mpi_log_file="mpiout.log", wait=True, callback=None, resume=False, backend='bonsai', presort=False, log=False):
 	"""
 	Runs Bonsai with initial conditions defined by tipsy file
 
+	With wait = False the run is started in the background and a BonsaiRun handle is returned.
+
+	With resume = True an interrupted run is continued from the latest complete snapshot under snap_prefix
+	(see latest_snapshot() and resume_run()), or started from tipsy_file if there is none.
+
+	With presort = True the initial conditions are first reordered along a Hilbert curve into
+	"[tipsy_file without extension].sorted.tipsy" (see tipsy.sort_tipsy()), so each MPI rank starts with
+	spatially compact particles instead of redistributing them in its first domain decomposition.
+
 	@param[in]	tipsy_file		containing initial conditions
 	@param[in]	snap_prefix		path prefix for snapshot files (time will be appended)
 	@param[in]	T				total simulation time
@@ -33,19 +53,218 @@ def run_tipsy(tipsy_file,snap_prefix,T,dt, dSnap, eps, bonsai_bin=None, mpi_n=0,
 	@param[in]	bonsai_bin		path to bonsai exe
 	@param[in]	mpi_n			specifies the number of mpi processes (0 = mpi not used)
 	@param[in]	mpi_log_file	single log file for mpi output (when mpi_n > 0)
+	@param[in]	wait			block until Bonsai finishes (default: True)
+	@param[in]	callback		called with the path of each new complete snapshot
+	@param[in]	resume			continue from the last complete snapshot if there is one (default: False)
+	@param[in]	backend			'bonsai' or 'cpu' (see run_mode()) (default: 'bonsai')
+	@param[in]	log				pass --log to Bonsai (default: False)
+	@param[in]	presort			start from a space-filling-curve ordered copy of tipsy_file (default: False)
+
+	@returns "Done" or "Error", or a BonsaiRun if wait = False
+	"""
+	if resume:
+		tfile = open(tipsy_file,'rb')
+		header, byteorder = tipsy.read_header(tfile)
+		tfile.close()
+		restart = latest_snapshot(snap_prefix, int(header['nTot']))
+		if restart is not None:
+			return resume_run(restart[0], restart[1], snap_prefix,T,dt, dSnap, eps, bonsai_bin, mpi_n,mpi_log_file, wait, callback, backend, log)
+
+	if presort:
+		tipsy_file = tipsy.sort_tipsy(tipsy_file, os.path.splitext(tipsy_file)[0] + '.sorted.tipsy')
+
+	return run_mode('infile',tipsy_file,snap_prefix,T,dt, dSnap, eps, bonsai_bin, mpi_n,mpi_log_file, wait, callback, log, backend)
+
+##\short	Snapshots written by a resumed run go to "[snap_prefix][RESUME_SUFFIX]" before being renamed
+RESUME_SUFFIX = ".resume_"
+
+def latest_snapshot(snap_prefix, nTot = None):
+	"""
+	Finds the latest complete snapshot of a run
+
+	A snapshot is complete if its tipsy header can be read, the file size matches the header and
+	(if given) the total particle count matches nTot. Incomplete files (e.g. truncated when the run died)
+	are reported and skipped.
+
+	@param[in]	snap_prefix		path prefix of the snapshot files
+	@param[in]	nTot			expected total number of particles (default: None, not checked)
+
+	@returns	(path, simulation time) of the latest complete snapshot, or None
+	"""
+	latest = None
+	for path in glob.glob(snap_prefix + '*'):
+		if RESUME_SUFFIX in path[len(snap_prefix):]:
+			continue
+		try:
+			tfile = open(path,'rb')
+			try:
+				header, byteorder = tipsy.read_header(tfile)
+			finally:
+				tfile.close()
+		except Exception:
+			continue #not a snapshot (e.g. a log file)
+
+		if os.path.getsize(path) != tipsy.file_size(header) or (nTot is not None and int(header['nTot']) != nTot):
+			print 'Skipping incomplete snapshot: %s' % path
+			continue
+
+		if latest is None or float(header['time']) > latest[1]:
+			latest = (path, float(header['time']))
+	return latest
+
+def log_path(snap_prefix, suffix = '.log'):
+	"""
+	Path of the file that captures a run's output, next to its snapshots but not matching "[snap_prefix]*"
+
+	SnapshotSeries, latest_snapshot() and BonsaiRun glob "[snap_prefix]*", so a log named after the prefix
+	would be read as a broken snapshot.
+
+	@param[in]	snap_prefix		path prefix of the snapshot files
+	@param[in]	suffix			end of the file name (default: '.log')
+
+	@returns	"[folder]/bonsai_[name]" + suffix for snap_prefix "[folder]/[name]"
+	"""
+	folder, name = os.path.split(snap_prefix)
+	for lead in ('bonsai_', 'output_'):
+		#a name like 'bon' is a prefix of 'bonsai_bon', the second lead cannot match as well
+		if not (lead + name).startswith(name):
+			break
+	return os.path.join(folder, lead + name + suffix)
+
+def snapshot_name(snap_prefix, template, snap_time):
+	"""
+	Names a snapshot for a simulation time the same way as an existing snapshot is named
+
+	@param[in]	snap_prefix		path prefix of the snapshot files
+	@param[in]	template		path of an existing snapshot, e.g. "[snap_prefix]_0000.0625"
+	@param[in]	snap_time		simulation time of the new snapshot
 
-	@returns None
+	@returns	path of the new snapshot
 	"""
-	run_mode('infile',tipsy_file,snap_prefix,T,dt, dSnap, eps, bonsai_bin, mpi_n,mpi_log_file)
+	match = re.match(r'^(.*?)(\d+)\.(\d+)(\D*)$', template[len(snap_prefix):])
+	if match is None:
+		raise Exception("Error: cannot find the time in snapshot name '%s'" % template)
+	separator, integer, decimals, tail = match.groups()
+	width = len(integer) + 1 + len(decimals)
+	return snap_prefix + separator + '%0*.*f' % (width, len(decimals), snap_time) + tail
 
+def resume_run(restart_file, t_snap, snap_prefix,T,dt, dSnap, eps, bonsai_bin, mpi_n,mpi_log_file, wait=True, callback=None, backend='bonsai', log=False):
+	"""
+	Continues a run from one of its snapshots for the remaining time T - t_snap
+
+	Bonsai writes to "[snap_prefix][RESUME_SUFFIX]...". Each complete snapshot is moved to the name it would
+	have had in the original run (see snapshot_name()), so the sequence continues without gaps. If Bonsai
+	restarted its clock at zero, t_snap is added to the snapshot times (file name and header).
+	The snapshot at the restart time itself is not duplicated.
+
+	@param[in]	restart_file	snapshot to continue from
+	@param[in]	t_snap			simulation time of restart_file
+	@param[in]	...				see run_tipsy()
+
+	@returns "Done" or "Error", or a BonsaiRun if wait = False (already finished if there is no time left)
+	"""
+	resume_prefix = snap_prefix + RESUME_SUFFIX
+	if T - t_snap <= 0:
+		print 'Run already complete (t = %f)' % t_snap
+		if wait:
+			return "Done"
+		#nothing left to run: an empty command gives a finished run without snapshots
+		run = BonsaiRun([sys.executable, '-c', ''], resume_prefix, log_file = log_path(snap_prefix, '.resume.log'))
+		return run.start()
+
+	print 'Resuming from %s (t = %f)' % (restart_file, t_snap)
+	tolerance = 1e-6*(1. + abs(t_snap))
+	clock = {}
+
+	def move_snapshot(path):
+		#returns the path the snapshot is reported as, None if it was removed
+		tfile = open(path,'r+b')
+		header, byteorder = tipsy.read_header(tfile)
+		snap_time = float(header['time'])
+		if 'offset' not in clock:
+			#first snapshot decides whether Bonsai continued the clock or restarted it
+			clock['offset'] = t_snap if snap_time < t_snap - tolerance else 0.
+		if clock['offset']:
+			snap_time += clock['offset']
+			tfile.seek(0)
+			np.array([snap_time], dtype=byteorder+'f8').tofile(tfile)
+		tfile.close()
+
+		if abs(snap_time - t_snap) <= tolerance:
+			os.remove(path)
+			return None
+		new_path = snapshot_name(snap_prefix, restart_file, snap_time)
+		os.rename(path, new_path)
+		return new_path
+
+	command = bonsai_command('infile',restart_file,resume_prefix,T - t_snap,dt, dSnap, eps, bonsai_bin, mpi_n,mpi_log_file, log, backend)
+	run = BonsaiRun(command, resume_prefix, log_file = log_path(snap_prefix, '.resume.log'), callback = callback, rename = move_snapshot)
+	run.start()
+	if wait:
+		return run.wait()
+	return run
+
+
+
+
+def bonsai_command(mode,nPart_or_file,snap_prefix,T,dt, dSnap, eps, bonsai_bin, mpi_n,mpi_log_file, log=False, backend='bonsai'):
+	"""
+	Builds the Bonsai (or mpirun) command line for run_mode()
+
+	With backend = 'cpu' the command runs NBODY_SCRIPT with the same options instead; mpi_n > 0 sets its
+	number of worker processes (default: all cores), and plummer/sphere models get nPart_or_file x mpi_n
+	particles like an MPI run of Bonsai.
 
+	@param[in]	log				add Bonsai's --log flag (default: False)
+	@param[in]	backend			'bonsai' or 'cpu' (default: 'bonsai')
+	@param[in]	...				see run_mode()
 
-def run_mode(mode,nPart_or_file,snap_prefix,T,dt, dSnap, eps, bonsai_bin, mpi_n,mpi_log_file):
+	@returns	list of command line arguments
+	"""
+
+	if mode != 'plummer' and mode != 'sphere' and mode != 'infile':
+		raise Exception("Error: model '%s' is not known." % mode)
+	if backend not in BACKENDS:
+		raise Exception("Error: backend '%s' is not known (one of %s)." % (backend, ', '.join(BACKENDS)))
+
+	if backend == 'cpu':
+		if mode != 'infile' and mpi_n > 0:
+			nPart_or_file = int(nPart_or_file)*mpi_n
+		cpu_args = ['--'+mode,str(nPart_or_file),
+					'--snapname',snap_prefix,'--snapiter',str(dSnap),
+					'-T',str(T),'-dt',str(dt),
+					'--eps',str(eps)]
+		if mpi_n > 0:
+			cpu_args += ['--procs',str(mpi_n)]
+		return [sys.executable, NBODY_SCRIPT] + cpu_args
+
+	if bonsai_bin is None:
+		#use default
+		bonsai_bin = BONSAI_BIN
+
+	bonsai_args = ['--'+mode,str(nPart_or_file),
+				   '--snapname',snap_prefix,'--snapiter',str(dSnap),
+				   '-T',str(T),'-dt',str(dt),
+				   '--eps',str(eps)]
+	if log:
+		bonsai_args = ['--log'] + bonsai_args
+
+	if mpi_n > 0:
+		#mpirun -n 2 --output-filename mpiout.txt ./bonsai2_slowdust -i model3_child_compact.tipsy -T1000 --logfile logfile.txt
+		return ['mpirun','-n',str(mpi_n),'--output-filename',mpi_log_file,bonsai_bin] + bonsai_args
+	else:
+		#single GPU mode
+		return [bonsai_bin] + bonsai_args
+
+def run_mode(mode,nPart_or_file,snap_prefix,T,dt, dSnap, eps, bonsai_bin, mpi_n,mpi_log_file, wait=True, callback=None, log=False, backend='bonsai'):
 	"""
 	Run Bonsai in mode "plummer", "sphere" or "infile"
 
 	This is an internal function, use the other interfaces instead.
 
+	Blocking or not, the run is a BonsaiRun: Bonsai's output goes to log_path(snap_prefix), where
+	timing.parse_bonsai_log() (or BonsaiRun.steps()) reads the per-step timings.
+
 	@param[in]	mode			"plummer" or "sphere" or "infile"
 	@param[in]	nPart_or_file	number of particles per mpi process, or path to tipsy file for "infile" mode
 	@param[in]	snap_prefix		path prefix for snapshot (tipsy) files (simulation time will be appended)
@@ -55,43 +274,307 @@ def run_mode(mode,nPart_or_file,snap_prefix,T,dt, dSnap, eps, bonsai_bin, mpi_n,
 	@param[in]	bonsai_bin		path to bonsai exe
 	@param[in]	mpi_n			specifies the number of mpi processes (0 = mpi not used)
 	@param[in] mpi_log_file		single log file for mpi output (when mpi_n > 0)
+	@param[in]	wait			block until Bonsai finishes (default: True)
+	@param[in]	callback		called with the path of each new complete snapshot
+	@param[in]	log				pass --log to Bonsai (default: False)
+	@param[in]	backend			'bonsai' runs bonsai_bin, 'cpu' runs the CPU Barnes-Hut leapfrog of the nbody module
+								(no GPU needed, same options and snapshot names) (default: 'bonsai')
 
-	@returns None
+	@returns "Done" or "Error", or a started BonsaiRun if wait = False
 	@sa run_tipsy(), run_plummer(), run_sphere()
 	"""
 
-	if mode != 'plummer' and mode != 'sphere' and mode != 'infile':
-		raise Exception("Error: model '%s' is not known." % mode)
+	command = bonsai_command(mode,nPart_or_file,snap_prefix,T,dt, dSnap, eps, bonsai_bin, mpi_n,mpi_log_file, log, backend)
 
-	if bonsai_bin is None:
-		#use default
-		bonsai_bin = BONSAI_BIN
+	run = BonsaiRun(command, snap_prefix, callback = callback)
+	run.start()
+	if not wait:
+		return run
+	return run.wait()
 
-	log = False
 
-	if mpi_n > 0:
-		#run mpi
-		#mpirun -n 2 --output-filename mpiout.txt ./bonsai2_slowdust -i model3_child_compact.tipsy -T1000 --logfile logfile.txt
-		if call(['mpirun','-n',str(mpi_n),
-				 '--output-filename',mpi_log_file,bonsai_bin,
-				 '--'+mode,str(nPart_or_file),
-				 '--snapname',snap_prefix,'--snapiter',str(dSnap),
-				 '-T',str(T),'-dt',str(dt),
-				 '--eps',str(eps),
-				]):
-			return "Error"
-		else:
-			return "Done"
+class BonsaiRun(object):
+	"""
+	A Bonsai run in the background whose snapshots can be processed while it is running
 
-	else:
-		#single GPU mode
-		if call([bonsai_bin,'--log' if log else '','--'+mode,str(nPart_or_file),'--snapname',snap_prefix,'--snapiter',str(dSnap),'-T',str(T),'-dt',str(dt),'--eps',str(eps),]):
-			return "Error"
+	Bonsai's output is captured in log_file. A watcher thread polls snap_prefix for new snapshot files
+	and reports each one once it is completely written (its size matches its tipsy header and has stopped
+	changing, see is_complete()), in simulation time order, to the callback and to snapshots().
+	Files already present when the run starts are only reported once the run has rewritten them
+	(their modification time or size changed), so a rerun into an existing snap_prefix reports its snapshots.
+	"""
+
+	## Command line that is run
+	command = None
+	## Path prefix of the snapshot files
+	snap_prefix = None
+	## File capturing Bonsai's stdout and stderr
+	log_file = None
+	## Called (from the watcher thread) with the path of each complete snapshot
+	callback = None
+	## Called (from the watcher thread) with each complete snapshot before it is reported, returns the path it is reported as
+	rename = None
+	## Seconds between checks for new snapshots
+	poll_interval = 1.0
+	## subprocess.Popen of the running command
+	process = None
+	## Paths of the complete snapshots reported so far
+	snapshot_files = None
+	## (modification time, size) of each file under snap_prefix when the run started
+	existing = None
+	## True if cancel() was called
+	cancelled = False
+	## Environment of the command (None: inherit this process' environment)
+	env = None
+	## Wall clock time at start() and when the process was seen to exit
+	start_time = None
+	end_time = None
+
+	def __init__(self, command, snap_prefix, log_file = None, callback = None, poll_interval = 1.0, env = None, rename = None):
+		"""
+		Prepares a run (call start() to launch it)
+
+		@param[in]	command			command line (list), see bonsai_command()
+		@param[in]	snap_prefix		path prefix of the snapshot files written by the command
+		@param[in]	log_file		file capturing stdout and stderr (default: log_path(snap_prefix))
+		@param[in]	callback		called with the path of each new complete snapshot (default: None)
+		@param[in]	poll_interval	seconds between checks for new snapshots (default: 1)
+		@param[in]	env				environment variables of the command (default: None, inherited)
+		@param[in]	rename			function(path) that moves a complete snapshot and returns its new path, or None if
+									the snapshot is not to be reported (default: None, snapshots stay where they are)
+
+		@returns	an instance of the BonsaiRun object
+		"""
+		self.command = command
+		self.snap_prefix = snap_prefix
+		self.log_file = log_path(snap_prefix) if log_file is None else log_file
+		self.callback = callback
+		self.rename = rename
+		self.poll_interval = poll_interval
+		self.env = env
+		self.snapshot_files = []
+		self.queue = Queue()
+		self.sizes = {}
+		self.existing = {}
+		self.reported = set()
+
+	def start(self):
+		"""
+		Launches the command without waiting for it
+
+		@returns	self
+		"""
+		self.existing = {}
+		for path in glob.glob(self.snap_prefix + '*'):
+			signature = self.file_signature(path)
+			if signature is not None:
+				self.existing[path] = signature
+		self.start_time = time.time()
+		self.log_handle = open(self.log_file,'w')
+		try:
+			self.process = Popen(self.command, stdout = self.log_handle, stderr = STDOUT, env = self.env)
+		except Exception:
+			self.log_handle.close()
+			raise
+		self.watcher = threading.Thread(target = self.watch)
+		self.watcher.daemon = True
+		self.watcher.start()
+		return self
+
+	def watch(self):
+		"""
+		Watcher thread: reports new complete snapshots until the process has exited
+
+		@returns	None
+		"""
+		while True:
+			running = self.process.poll() is None
+			self.check_snapshots(final = not running)
+			if not running:
+				break
+			time.sleep(self.poll_interval)
+		self.end_time = time.time()
+		timing.TIMER.add('bonsai run', self.end_time - self.start_time)
+		self.log_handle.close()
+		self.queue.put(None)
+
+	def check_snapshots(self, final = False):
+		"""
+		Reports snapshots that became complete since the last check
+
+		@param[in]	final	the process has exited, sizes no longer need to be stable
+
+		@returns	None
+		"""
+		complete = []
+		for path in glob.glob(self.snap_prefix + '*'):
+			if path in self.reported or path == self.log_file:
+				continue
+			if path in self.existing and self.file_signature(path) == self.existing[path]:
+				#left over from before the run and not rewritten (yet)
+				continue
+			snap_time = self.is_complete(path, final)
+			if snap_time is not None:
+				complete.append((snap_time, path))
+
+		for snap_time, path in sorted(complete):
+			self.reported.add(path)
+			if self.rename is not None:
+				try:
+					path = self.rename(path)
+				except Exception as e:
+					print 'Error moving snapshot (%s): %s' % (path, e)
+					continue
+				if path is None:
+					continue
+			self.snapshot_files.append(path)
+			self.queue.put(path)
+			if self.callback is not None:
+				try:
+					self.callback(path)
+				except Exception as e:
+					print 'Error in snapshot callback (%s): %s' % (path, e)
+
+	def file_signature(self, path):
+		"""
+		@param[in]	path	file
+
+		@returns	(modification time, size) of the file, or None if it does not exist
+		"""
+		try:
+			info = os.stat(path)
+		except OSError:
+			return None
+		return (info.st_mtime, info.st_size)
+
+	def is_complete(self, path, final = False):
+		"""
+		Checks whether a snapshot file has been completely written
+
+		@param[in]	path	snapshot file
+		@param[in]	final	do not require the size to be unchanged since the last check
+
+		@returns	simulation time of the snapshot, or None if it is not (yet) complete
+		"""
+		try:
+			size = os.path.getsize(path)
+			tfile = open(path,'rb')
+			try:
+				header, byteorder = tipsy.read_header(tfile)
+			finally:
+				tfile.close()
+		except Exception:
+			return None
+
+		stable = final or self.sizes.get(path) == size
+		self.sizes[path] = size
+		if stable and size >= tipsy.file_size(header):
+			return float(header['time'])
+		return None
+
+	def snapshots(self):
+		"""
+		Iterates over the snapshot paths as they are completed, until the run has finished
+
+		Only one consumer should iterate; use the callback for more.
+
+		@returns	generator of snapshot paths
+		"""
+		while True:
+			path = self.queue.get()
+			if path is None:
+				self.queue.put(None) #let later calls finish too
+				return
+			yield path
+
+	__iter__ = snapshots
+
+	def status(self):
+		"""
+		@returns	"not started", "running", "cancelled", "done" or "error"
+		"""
+		if self.process is None:
+			return "not started"
+		returncode = self.process.poll()
+		if returncode is None:
+			return "running"
+		elif self.cancelled:
+			return "cancelled"
+		elif returncode == 0:
+			return "done"
 		else:
-			return "Done"
+			return "error"
+
+	def returncode(self):
+		"""
+		@returns	exit code of the command, None while it is running
+		"""
+		return None if self.process is None else self.process.poll()
+
+	def read_log(self):
+		"""
+		@returns	the output captured so far (string)
+		"""
+		if not os.path.exists(self.log_file):
+			return ''
+		return open(self.log_file).read()
+
+	def steps(self, nParticles = None):
+		"""
+		Per-step records parsed from the captured output (see timing.parse_bonsai_log())
+
+		@param[in]	nParticles	number of particles, for particles_per_second (default: None)
+
+		@returns	list of dictionaries
+		"""
+		return timing.parse_bonsai_log(self.read_log(), nParticles)
+
+	def wait(self):
+		"""
+		Blocks until the command has exited and all its snapshots have been reported
+
+		Called from the snapshot callback it only waits for the command (the remaining snapshots are
+		reported after the callback returns).
+
+		@returns	"Done" or "Error" (like run_mode())
+		"""
+		if self.process is None:
+			raise Exception("Error: the run has not been started (call start() first)")
+		self.process.wait()
+		self.join_watcher()
+		return "Done" if self.status() == "done" else "Error"
+
+	def cancel(self, timeout = 10.0):
+		"""
+		Stops the run: terminates the command, and kills it if it has not exited after timeout seconds
+
+		@param[in]	timeout		seconds to wait after terminating (default: 10)
+
+		@returns	None
+		"""
+		if self.process is None or self.process.poll() is not None:
+			return
+		self.cancelled = True
+		self.process.terminate()
+		deadline = time.time() + timeout
+		while self.process.poll() is None and time.time() < deadline:
+			time.sleep(0.05)
+		if self.process.poll() is None:
+			self.process.kill()
+		self.process.wait()
+		self.join_watcher()
+
+	def join_watcher(self):
+		"""
+		Waits for the watcher thread, unless called from it (e.g. by the snapshot callback)
+
+		@returns	None
+		"""
+		if threading.current_thread() is not self.watcher:
+			self.watcher.join()
 
 
-def run_plummer(nParticles,snap_prefix,T=2,dt=0.0625, dSnap = 0.0625, eps=0.05, bonsai_bin = None, mpi_n = 0, mpi_log_file = "mpiout.log"):
+def run_plummer(nParticles,snap_prefix,T=2,dt=0.0625, dSnap = 0.0625, eps=0.05, bonsai_bin = None, mpi_n = 0, mpi_log_file = "mpiout.log", wait = True, callback = None, backend = 'bonsai', log = False):
 	"""
 	Run a Bonsai's built in plummer model
 
@@ -103,13 +586,17 @@ def run_plummer(nParticles,snap_prefix,T=2,dt=0.0625, dSnap = 0.0625, eps=0.05,
 	@param[in]	bonsai_bin		path to bonsai exe
 	@param[in]	mpi_n			specifies the number of mpi processes (0 = mpi not used)
 	@param[in]	mpi_log_file	single log file for mpi output (when mpi_n > 0)
+	@param[in]	wait			block until Bonsai finishes (default: True)
+	@param[in]	callback		called with the path of each new complete snapshot
+	@param[in]	backend			'bonsai' or 'cpu' (see run_mode()) (default: 'bonsai')
+	@param[in]	log				pass --log to Bonsai (default: False)
 
-	@returns	None
+	@returns	"Done" or "Error", or a BonsaiRun if wait = False
 	"""
-	run_mode("plummer",nParticles,snap_prefix,T,dt, dSnap, eps, bonsai_bin, mpi_n,mpi_log_file)
+	return run_mode("plummer",nParticles,snap_prefix,T,dt, dSnap, eps, bonsai_bin, mpi_n,mpi_log_file, wait, callback, log, backend)
 
 
-def run_sphere(nParticles,snap_prefix,T=2,dt=0.0625, dSnap = 0.0625, eps=0.05, bonsai_bin = None, mpi_n = 0, mpi_log_file = "mpiout.log"):
+def run_sphere(nParticles,snap_prefix,T=2,dt=0.0625, dSnap = 0.0625, eps=0.05, bonsai_bin = None, mpi_n = 0, mpi_log_file = "mpiout.log", wait = True, callback = None, backend = 'bonsai', log = False):
 	"""
 	Run a Bonsai's built in plummer model
 
@@ -121,7 +608,11 @@ def run_sphere(nParticles,snap_prefix,T=2,dt=0.0625, dSnap = 0.0625, eps=0.05, b
 	@param[in]	bonsai_bin		path to bonsai exe
 	@param[in]	mpi_n			specifies the number of mpi processes (0 = mpi not used)
 	@param[in]	mpi_log_file	single log file for mpi output (when mpi_n > 0)
+	@param[in]	wait			block until Bonsai finishes (default: True)
+	@param[in]	callback		called with the path of each new complete snapshot
+	@param[in]	backend			'bonsai' or 'cpu' (see run_mode()) (default: 'bonsai')
+	@param[in]	log				pass --log to Bonsai (default: False)
 
-	@returns	None
+	@returns	"Done" or "Error", or a BonsaiRun if wait = False
 	"""
-	run_mode("sphere",nParticles,snap_prefix,T,dt, dSnap, eps, bonsai_bin, mpi_n,mpi_log_file)
\ No newline at end of file
+	return run_mode("sphere",nParticles,snap_prefix,T,dt, dSnap, eps, bonsai_bin, mpi_n,mpi_log_file, wait, callback, log, backend)
\ No newline at end of file
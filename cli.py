@@ -0,0 +1,227 @@
+## @namespace cli
+#  The cli module is a command line front end to the tipsy and bonsai modules for batch jobs
+
+"""
+Cli.py module
+
+One command for the everyday jobs of a run, without opening a notebook:
+
+	python cli.py inspect snaps/snap_*					headers (time, particle counts, complete or truncated)
+	python cli.py convert galaxy.txt galaxy.tipsy		nbody text to tipsy (several inputs are converted in parallel)
+	python cli.py render snaps/snap_ figs/frame --backend raster --camera 90,0 --camera 0,0
+	python cli.py mp4 figs/frame movie					PNG sequence to MP4 (--tipsy streams from snapshots instead)
+	python cli.py run snaps/snap --infile galaxy.tipsy -T 2 -dt 0.0625 --snapiter 0.0625 --eps 0.05
+
+matplotlib is only imported by the commands that draw (see tipsy.pyplot()) and the bonsai module only
+by run, so inspect and convert start in about a third of the time it took to import matplotlib with tipsy.
+
+Project: UC San Diego Physics 241, Winter 2014, Prof. J. Kuti
+"""
+
+import argparse, os, sys
+import numpy as np
+import tipsy
+
+def inspect(args):
+	"""
+	Prints the header of each tipsy file and whether the file is complete
+
+	@param[in]	args	parsed arguments (files, stats)
+
+	@returns	exit code (1 if a file is not a complete tipsy file)
+	"""
+	status = 0
+	for path in args.files:
+		try:
+			tfile = open(path,'rb')
+			try:
+				header, byteorder = tipsy.read_header(tfile)
+			finally:
+				tfile.close()
+		except Exception as e:
+			print '%s: %s' % (path, e)
+			status = 1
+			continue
+		size = os.path.getsize(path)
+		complete = size == tipsy.file_size(header)
+		print '%s: time %f  nTot %i  nGas %i  nDark %i  nStar %i  byteorder %s  %s' % (path, header['time'], header['nTot'],
+			header['nGas'], header['nDark'], header['nStar'], byteorder, 'complete' if complete else 'INCOMPLETE (%i of %i bytes)' % (size, tipsy.file_size(header)))
+		if not complete:
+			status = 1
+		elif args.stats and header['nStar'] > 0:
+			header, records = tipsy.map_stars(path)
+			pos = records['pos']
+			print '\tmass %g  IDs %i..%i  pos min %s max %s' % (records['mass'].sum(dtype = np.float64), records['phi'].min(), records['phi'].max(),
+																 pos.min(axis = 0), pos.max(axis = 0))
+	return status
+
+def convert(args):
+	"""
+	Converts nbody text files to one tipsy file (see tipsy.txt2tipsy() and tipsy.txt2tipsy_shards())
+
+	@param[in]	args	parsed arguments (inputs, output, procs, chunk_size)
+
+	@returns	exit code
+	"""
+	if len(args.inputs) == 1:
+		tipsy.txt2tipsy(args.inputs[0], args.output, chunk_size = args.chunk_size)
+	else:
+		tipsy.txt2tipsy_shards(args.inputs, args.output, nProcs = args.procs, chunk_size = args.chunk_size)
+	return 0
+
+def parse_camera(text):
+	"""
+	@param[in]	text	"elevAng,rotAng" in degrees
+
+	@returns	(elevAng, rotAng) tuple of floats
+	"""
+	try:
+		elevAng, rotAng = [float(value) for value in text.split(',')]
+	except ValueError:
+		raise argparse.ArgumentTypeError("camera must be ELEV,ROT in degrees, not '%s'" % text)
+	return elevAng, rotAng
+
+def render(args):
+	"""
+	Renders a PNG per snapshot (see tipsy.render_frames())
+
+	@param[in]	args	parsed arguments
+
+	@returns	exit code
+	"""
+	kwargs = {'lim':args.lim, 'nRed':args.nRed, 'IDs':None if args.ids is None else np.loadtxt(args.ids, dtype = np.int64, ndmin = 1)}
+	if args.camera:
+		kwargs.update(cameras = args.camera, panels = not args.separate, spin = args.spin, size = args.size, columns = args.columns)
+	else:
+		kwargs.update(elevAng = args.elev, rotAng = args.rot, pointsize = args.pointsize, backend = args.backend)
+	paths = tipsy.render_frames(args.tipsy_prefix, args.figures_prefix, nProcs = args.procs, skip_existing = args.skip_existing, **kwargs)
+	print 'Rendered %i frames' % len(paths)
+	return 0
+
+def mp4(args):
+	"""
+	Encodes a movie from a PNG sequence (tipsy.make_mp4()) or directly from snapshots (tipsy.stream_mp4())
+
+	@param[in]	args	parsed arguments
+
+	@returns	exit code
+	"""
+	if args.tipsy:
+		tipsy.stream_mp4(args.prefix, args.mp4_prefix, frame_rate = args.rate, bit_rate = args.bitrate, codec = args.codec,
+						 size = args.size, lim = args.lim, nRed = args.nRed, elevAng = args.elev, rotAng = args.rot,
+						 cameras = args.camera, columns = args.columns, spin = args.spin)
+	else:
+		tipsy.make_mp4(args.prefix, args.mp4_prefix, frame_rate = args.rate, bit_rate = args.bitrate, codec = args.codec)
+	return 0
+
+def run(args):
+	"""
+	Launches a run with Bonsai or the CPU backend and waits for it (see bonsai.run_tipsy())
+
+	@param[in]	args	parsed arguments
+
+	@returns	exit code (1 if the run failed)
+	"""
+	import bonsai
+	folder = os.path.dirname(args.snap_prefix)
+	if folder and not os.path.isdir(folder):
+		os.makedirs(folder)
+	common = {'bonsai_bin':args.bonsai_bin, 'mpi_n':args.mpi, 'mpi_log_file':args.mpi_log, 'backend':args.backend, 'log':args.log}
+	if args.infile:
+		result = bonsai.run_tipsy(args.infile, args.snap_prefix, args.T, args.dt, args.snapiter, args.eps, resume = args.resume,
+								  presort = args.presort, **common)
+	elif args.plummer:
+		result = bonsai.run_plummer(args.plummer, args.snap_prefix, args.T, args.dt, args.snapiter, args.eps, **common)
+	else:
+		result = bonsai.run_sphere(args.sphere, args.snap_prefix, args.T, args.dt, args.snapiter, args.eps, **common)
+	print result
+	return 0 if result == "Done" else 1
+
+def add_view_arguments(parser):
+	"""
+	Adds the camera and selection options shared by render and mp4
+
+	@param[in]	parser	argparse parser of the command
+
+	@returns	None
+	"""
+	parser.add_argument('--lim', type = float, default = .8, help = 'half width of the view (default: 0.8)')
+	parser.add_argument('--nRed', type = int, default = None, help = 'color the first nRed particle IDs red, the rest blue')
+	parser.add_argument('--elev', type = float, default = 45, help = 'camera elevation in degrees (default: 45)')
+	parser.add_argument('--rot', type = float, default = 0, help = 'camera rotation about z in degrees (default: 0)')
+	parser.add_argument('--camera', type = parse_camera, action = 'append', metavar = 'ELEV,ROT',
+						help = 'render this view (repeat for several views from one read of each snapshot, replaces --elev/--rot)')
+	parser.add_argument('--columns', type = int, default = None, help = 'views per row of the panels (default: all in one row)')
+	parser.add_argument('--spin', type = float, default = 0., help = 'degrees per frame the cameras turn about z (default: 0)')
+
+def main(argv = None):
+	"""
+	Command line entry point
+
+	@param[in]	argv	arguments (default: None, sys.argv[1:])
+
+	@returns	exit code
+	"""
+	parser = argparse.ArgumentParser(description = 'Tipsy snapshot and Bonsai run tools')
+	commands = parser.add_subparsers(dest = 'command')
+
+	command = commands.add_parser('inspect', help = 'print tipsy headers and check that the files are complete')
+	command.add_argument('files', nargs = '+', help = 'tipsy files')
+	command.add_argument('--stats', action = 'store_true', help = 'also print total mass, ID range and bounding box (memory-mapped)')
+	command.set_defaults(func = inspect)
+
+	command = commands.add_parser('convert', help = 'convert nbody text files to a tipsy file')
+	command.add_argument('inputs', nargs = '+', help = 'nbody text files (several are converted in parallel and concatenated)')
+	command.add_argument('output', help = 'tipsy file')
+	command.add_argument('--procs', type = int, default = None, help = 'worker processes (default: number of cores)')
+	command.add_argument('--chunk-size', type = int, default = 100000, help = 'rows converted at a time (default: 100000)')
+	command.set_defaults(func = convert)
+
+	command = commands.add_parser('render', help = 'render "[figures_prefix]{index}.png" for each snapshot')
+	command.add_argument('tipsy_prefix', help = 'prefix of the tipsy files')
+	command.add_argument('figures_prefix', help = 'prefix of the png files')
+	add_view_arguments(command)
+	command.add_argument('--backend', choices = ('mplot3d', 'raster'), default = 'raster', help = 'single view renderer (default: raster)')
+	command.add_argument('--pointsize', type = float, default = .1, help = '(mplot3d) size of the stars')
+	command.add_argument('--size', type = int, default = 500, help = '(--camera) pixels per view (default: 500)')
+	command.add_argument('--separate', action = 'store_true', help = '(--camera) one png sequence per camera instead of panels')
+	command.add_argument('--ids', default = None, help = 'text file of particle IDs to draw (default: all)')
+	command.add_argument('--procs', type = int, default = None, help = 'rendering processes (default: number of cores)')
+	command.add_argument('--skip-existing', action = 'store_true', help = 'skip frames newer than their snapshot')
+	command.set_defaults(func = render)
+
+	command = commands.add_parser('mp4', help = 'encode "[prefix]{number}.png" frames (or snapshots with --tipsy) as "[mp4_prefix].mp4"')
+	command.add_argument('prefix', help = 'prefix of the png files (or of the tipsy files with --tipsy)')
+	command.add_argument('mp4_prefix', help = 'movie path without .mp4')
+	command.add_argument('--tipsy', action = 'store_true', help = 'rasterize snapshots straight into ffmpeg, no png files')
+	command.add_argument('--rate', type = int, default = 20, help = 'frames per second (default: 20)')
+	command.add_argument('--bitrate', default = '8000k', help = 'bit rate (default: 8000k)')
+	command.add_argument('--codec', default = 'libx264', help = 'ffmpeg video codec (default: libx264)')
+	command.add_argument('--size', type = int, default = 1000, help = '(--tipsy) pixels per view, even for libx264 (default: 1000)')
+	add_view_arguments(command)
+	command.set_defaults(func = mp4)
+
+	command = commands.add_parser('run', help = 'launch a Bonsai (or CPU) run and wait for it')
+	command.add_argument('snap_prefix', help = 'path prefix of the snapshot files')
+	model = command.add_mutually_exclusive_group(required = True)
+	model.add_argument('-i', '--infile', help = 'tipsy file with the initial conditions')
+	model.add_argument('--plummer', type = int, help = 'built in Plummer model with this many particles')
+	model.add_argument('--sphere', type = int, help = 'built in uniform sphere with this many particles')
+	command.add_argument('-T', type = float, default = 2, help = 'total simulation time (default: 2)')
+	command.add_argument('-dt', type = float, default = 0.0625, help = 'time step (default: 0.0625)')
+	command.add_argument('--snapiter', type = float, default = 0.0625, help = 'time between snapshots (default: 0.0625)')
+	command.add_argument('--eps', type = float, default = 0.05, help = 'softening length (default: 0.05)')
+	command.add_argument('--mpi', type = int, default = 0, help = 'MPI processes, 0 without mpirun (default: 0)')
+	command.add_argument('--mpi-log', default = 'mpiout.log', help = 'MPI output log file (default: mpiout.log)')
+	command.add_argument('--bonsai-bin', default = None, help = 'path to the bonsai executable')
+	command.add_argument('--backend', choices = ('bonsai', 'cpu'), default = 'bonsai', help = "'bonsai' or the CPU integrator 'cpu' (default: bonsai)")
+	command.add_argument('--log', action = 'store_true', help = "pass Bonsai's --log flag (output goes to bonsai_[snap name].log next to the snapshots)")
+	command.add_argument('--resume', action = 'store_true', help = '(--infile) continue from the latest complete snapshot')
+	command.add_argument('--presort', action = 'store_true', help = '(--infile) start from a Hilbert ordered copy of the infile')
+	command.set_defaults(func = run)
+
+	args = parser.parse_args(argv)
+	return args.func(args)
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,237 @@
+## @namespace diagnostics
+#  The diagnostics module measures energies, virial ratio, momenta and radial structure of snapshots
+
+"""
+Diagnostics.py module
+
+Sanity checks for runs: kinetic and potential energy (softened Barnes-Hut, see octree), virial ratio,
+center of mass, linear and angular momentum, Lagrangian radii and radial density profiles of a Stars
+object, and the same measurements over a whole snapshot series (one snapshot per worker process) as a
+time series that shows energy drift. Units are Bonsai's N-body units (G = 1).
+
+Project: UC San Diego Physics 241, Winter 2014, Prof. J. Kuti
+"""
+
+import json, traceback
+from multiprocessing import Pool, cpu_count
+import numpy as np
+import tipsy, octree, timing
+from timing import TIMER
+
+##\short	Default mass fractions of the Lagrangian radii
+LAGRANGIAN_FRACTIONS = (0.01, 0.1, 0.25, 0.5, 0.75, 0.9)
+
+def center_of_mass(stars):
+	"""
+	Center of mass position and velocity
+
+	@param[in]	stars	Stars object
+
+	@returns	(position (3 array), velocity (3 array))
+	"""
+	mass = stars.mass.astype(np.float64)
+	return (np.dot(mass, stars.pos.astype(np.float64))/mass.sum(),
+			np.dot(mass, stars.vel.astype(np.float64))/mass.sum())
+
+def momentum(stars):
+	"""
+	Total linear and angular momentum (about the origin)
+
+	@param[in]	stars	Stars object
+
+	@returns	(linear momentum (3 array), angular momentum (3 array))
+	"""
+	mass = stars.mass.astype(np.float64)
+	pos = stars.pos.astype(np.float64)
+	vel = stars.vel.astype(np.float64)
+	return np.dot(mass, vel), np.dot(mass, np.cross(pos, vel))
+
+def kinetic_energy(stars):
+	"""
+	Total kinetic energy
+
+	@param[in]	stars	Stars object
+
+	@returns	kinetic energy (float)
+	"""
+	vel = stars.vel.astype(np.float64)
+	return 0.5*np.dot(stars.mass.astype(np.float64), (vel**2).sum(axis = 1))
+
+def potential_energy(stars, eps = 0.0, theta = 0.6):
+	"""
+	Total softened potential energy (Barnes-Hut, Plummer softening)
+
+	@param[in]	stars	Stars object
+	@param[in]	eps		softening length, the eps the run was made with (default: 0)
+	@param[in]	theta	opening angle, smaller is more accurate and slower (default: 0.6, relative error
+						about 1e-4, see octree.Octree.potential_energy())
+
+	@returns	potential energy (float)
+	"""
+	with TIMER.stage('potential energy', stars.nStars):
+		return octree.potential_energy(stars.pos, stars.mass, eps, theta)
+
+def radii(stars, center = None):
+	"""
+	Distances of the stars from a center
+
+	@param[in]	stars	Stars object
+	@param[in]	center	position (default: None, center of mass)
+
+	@returns	(array) radii
+	"""
+	if center is None:
+		center = center_of_mass(stars)[0]
+	return np.sqrt(((stars.pos.astype(np.float64) - center)**2).sum(axis = 1))
+
+def lagrangian_radii(stars, fractions = LAGRANGIAN_FRACTIONS, center = None):
+	"""
+	Radii that enclose given fractions of the total mass
+
+	@param[in]	stars		Stars object
+	@param[in]	fractions	mass fractions (default: LAGRANGIAN_FRACTIONS)
+	@param[in]	center		position (default: None, center of mass)
+
+	@returns	(array) one radius per fraction
+	"""
+	r = radii(stars, center)
+	order = np.argsort(r)
+	enclosed = np.cumsum(stars.mass[order].astype(np.float64))
+	enclosed /= enclosed[-1]
+	return r[order][np.minimum(np.searchsorted(enclosed, fractions), len(r) - 1)]
+
+def density_profile(stars, nBins = 50, rmin = None, rmax = None, center = None):
+	"""
+	Spherically averaged density in logarithmic radial shells
+
+	@param[in]	stars	Stars object
+	@param[in]	nBins	number of shells (default: 50)
+	@param[in]	rmin	inner radius (default: None, the Lagrangian radius of 0.1% of the mass)
+	@param[in]	rmax	outer radius (default: None, the largest radius)
+	@param[in]	center	position (default: None, center of mass)
+
+	@returns	(shell radii (geometric mid points), densities, star counts)
+	"""
+	r = radii(stars, center)
+	if rmax is None:
+		rmax = r.max()
+	if rmin is None:
+		rmin = max(lagrangian_radii(stars, [0.001], center)[0], 1e-6*rmax)
+	edges = np.logspace(np.log10(rmin), np.log10(rmax), nBins + 1)
+	mass, edges = np.histogram(r, edges, weights = stars.mass.astype(np.float64))
+	counts = np.histogram(r, edges)[0]
+	volume = 4./3.*np.pi*(edges[1:]**3 - edges[:-1]**3)
+	return np.sqrt(edges[1:]*edges[:-1]), mass/volume, counts
+
+def diagnose(stars, eps = 0.0, theta = 0.6, fractions = LAGRANGIAN_FRACTIONS, nBins = 0):
+	"""
+	All diagnostics of one snapshot as a flat record
+
+	Keys: time, nStars, mass, kinetic, potential, energy, virial_ratio (2K/|W|, 1 in equilibrium),
+	com_x/y/z, com_vx/vy/vz, px/py/pz, Lx/Ly/Lz and r_{fraction} for each Lagrangian radius.
+	With nBins > 0 the record also has 'profile_r', 'profile_density' lists.
+
+	@param[in]	stars		Stars object
+	@param[in]	eps			softening length of the run (default: 0)
+	@param[in]	theta		opening angle of the potential (default: 0.6)
+	@param[in]	fractions	mass fractions of the Lagrangian radii (default: LAGRANGIAN_FRACTIONS)
+	@param[in]	nBins		number of density profile shells, 0 for none (default: 0)
+
+	@returns	dictionary
+	"""
+	kinetic = kinetic_energy(stars)
+	potential = potential_energy(stars, eps, theta)
+	com, com_vel = center_of_mass(stars)
+	p, L = momentum(stars)
+	record = {'time':float(stars.time), 'nStars':int(stars.nStars), 'mass':float(stars.mass.sum(dtype = np.float64)),
+			  'kinetic':kinetic, 'potential':potential, 'energy':kinetic + potential,
+			  'virial_ratio':2*kinetic/abs(potential) if potential else float('nan')}
+	for k, axis in enumerate('xyz'):
+		record['com_' + axis] = com[k]
+		record['com_v' + axis] = com_vel[k]
+		record['p' + axis] = p[k]
+		record['L' + axis] = L[k]
+	for fraction, radius in zip(fractions, lagrangian_radii(stars, fractions, com)):
+		record['r_%g' % fraction] = radius
+	if nBins:
+		r, density, counts = density_profile(stars, nBins, center = com)
+		record['profile_r'] = r.tolist()
+		record['profile_density'] = density.tolist()
+	return record
+
+def diagnose_file(task):
+	"""
+	Loads one snapshot and diagnoses it (worker function of diagnose_series())
+
+	@param[in]	task	(index, tipsy_file, diagnose keyword arguments) tuple
+
+	@returns	(index, record or None, traceback string or None)
+	"""
+	index, tipsy_file, kwargs = task
+	try:
+		return index, diagnose(tipsy.Stars(tipsy_file, mmap = True), **kwargs), None
+	except Exception:
+		return index, None, traceback.format_exc()
+
+def diagnose_series(tipsy_prefix, eps = 0.0, theta = 0.6, nProcs = None, fractions = LAGRANGIAN_FRACTIONS, nBins = 0):
+	"""
+	Diagnoses every "[tipsy_prefix]{time}" snapshot with a pool of processes
+
+	Records are returned in time order with energy drift columns relative to the first snapshot:
+	dE (E - E0) and dE_rel ((E - E0)/|E0|).
+
+	@param[in]	tipsy_prefix	prefix of tipsy files
+	@param[in]	eps				softening length of the run (default: 0)
+	@param[in]	theta			opening angle of the potential (default: 0.6)
+	@param[in]	nProcs			number of worker processes, 1 works in this process (default: number of cores)
+	@param[in]	fractions		mass fractions of the Lagrangian radii (default: LAGRANGIAN_FRACTIONS)
+	@param[in]	nBins			number of density profile shells, 0 for none (default: 0)
+
+	@returns	list of records (see diagnose())
+	"""
+	series = tipsy.SnapshotSeries(tipsy_prefix, cache_size = 0)
+	kwargs = {'eps':eps, 'theta':theta, 'fractions':fractions, 'nBins':nBins}
+	tasks = [(index, tipsy_file, kwargs) for index, tipsy_file in enumerate(series.files)]
+	if nProcs is None:
+		nProcs = cpu_count()
+	nProcs = max(1, min(nProcs, len(tasks)))
+
+	records = [None]*len(tasks)
+	errors = []
+	pool = Pool(nProcs) if nProcs > 1 else None
+	try:
+		results = tipsy.bounded_imap(pool, diagnose_file, tasks, 2*nProcs) if pool else (diagnose_file(task) for task in tasks)
+		for index, record, error in results:
+			if error is None:
+				records[index] = record
+			else:
+				errors.append('snapshot %i (%s):\n%s' % (index, series.files[index], error))
+		if pool:
+			pool.close()
+	finally:
+		if pool:
+			pool.terminate()
+			pool.join()
+
+	if errors:
+		raise Exception("Error: %i of %i snapshots failed\n%s" % (len(errors), len(tasks), '\n'.join(errors)))
+
+	if records:
+		E0 = records[0]['energy']
+		for record in records:
+			record['dE'] = record['energy'] - E0
+			record['dE_rel'] = record['dE']/abs(E0) if E0 else float('nan')
+	return records
+
+def save_series(out_prefix, records):
+	"""
+	Saves a diagnostics time series as "[out_prefix].csv" (scalar columns) and "[out_prefix].json" (everything)
+
+	@param[in]	out_prefix	output path without extension
+	@param[in]	records		list of records from diagnose_series()
+
+	@returns	None
+	"""
+	timing.save_csv(out_prefix + '.csv', [dict((key, value) for key, value in record.items() if not isinstance(value, list))
+										   for record in records])
+	json.dump(records, open(out_prefix + '.json', 'w'), indent = 1, sort_keys = True)
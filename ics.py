@@ -0,0 +1,242 @@
+## @namespace ics
+#  The ics module generates initial conditions (Plummer spheres, Hernquist bulges, exponential disks) as Stars objects
+
+"""
+Ics.py module
+
+Vectorized samplers for common galaxy components (and test models) in N-body units (G = 1, as in Bonsai).
+Every generator takes a seed so the same initial conditions can be made again, and returns a
+tipsy.Stars object centered on its center of mass, ready to be combined with Transform, append or
+add_stars and written with save_tipsy().
+
+Project: UC San Diego Physics 241, Winter 2014, Prof. J. Kuti
+"""
+
+import numpy as np
+import tipsy
+
+def random_directions(n, rng):
+	"""
+	Isotropic unit vectors
+
+	@param[in]	n		number of vectors
+	@param[in]	rng		numpy.random.RandomState
+
+	@returns	(n x 3) array
+	"""
+	cos_theta = rng.uniform(-1., 1., n)
+	sin_theta = np.sqrt(1. - cos_theta**2)
+	phi = rng.uniform(0., 2*np.pi, n)
+	return np.column_stack((sin_theta*np.cos(phi), sin_theta*np.sin(phi), cos_theta))
+
+def make_stars(mass, pos, vel, center = True):
+	"""
+	Packs arrays into a Stars object (IDs 0..N-1)
+
+	@param[in]	mass	(N array) particle masses
+	@param[in]	pos		(Nx3 array) positions
+	@param[in]	vel		(Nx3 array) velocities
+	@param[in]	center	move the center of mass to rest at the origin (default: True)
+
+	@returns	a Stars object
+	"""
+	if center:
+		pos = pos - np.average(pos, axis = 0, weights = mass)
+		vel = vel - np.average(vel, axis = 0, weights = mass)
+	stars = tipsy.Stars()
+	stars.add_stars(mass, pos, vel)
+	stars.trim()
+	return stars
+
+def enclosed_mass(radius, mass):
+	"""
+	Mass inside each particle's radius (spherical approximation, includes the particle itself)
+
+	@param[in]	radius	(N array) distances from the center
+	@param[in]	mass	(N array) particle masses
+
+	@returns	(N array) enclosed mass, in the order of radius
+	"""
+	order = np.argsort(radius)
+	enclosed = np.empty(len(radius))
+	enclosed[order] = np.cumsum(mass[order])
+	return enclosed
+
+def plummer(nStars, mass = 1., a = 1., rmax = None, seed = None):
+	"""
+	Plummer sphere with isotropic velocities from its distribution function (Aarseth, Henon & Wielen 1974)
+
+	@param[in]	nStars	number of particles
+	@param[in]	mass	total mass (default: 1)
+	@param[in]	a		Plummer scale radius (default: 1)
+	@param[in]	rmax	truncation radius (default: None, 100 a)
+	@param[in]	seed	random seed (default: None)
+
+	@returns	a Stars object
+	"""
+	rng = np.random.RandomState(seed)
+	if rmax is None:
+		rmax = 100.*a
+
+	#invert M(<r)/M = r^3/(r^2+a^2)^(3/2), up to rmax
+	xmax = rmax**3/(rmax**2 + a**2)**1.5
+	x = rng.uniform(0., xmax, nStars)
+	x = np.maximum(x, 1e-300)
+	r = a/np.sqrt(x**(-2./3.) - 1.)
+
+	#speed in units of the escape speed: rejection sampling of g(q) = q^2 (1-q^2)^(7/2)
+	q = np.empty(nStars)
+	todo = np.arange(nStars)
+	while len(todo):
+		trial = rng.uniform(0., 1., len(todo))
+		accept = rng.uniform(0., 0.1, len(todo)) < trial**2*(1. - trial**2)**3.5
+		q[todo[accept]] = trial[accept]
+		todo = todo[~accept]
+	v_escape = np.sqrt(2.*mass/a)*(1. + (r/a)**2)**-0.25
+
+	pos = r[:,None]*random_directions(nStars, rng)
+	vel = (q*v_escape)[:,None]*random_directions(nStars, rng)
+	return make_stars(np.full(nStars, float(mass)/nStars), pos, vel)
+
+def uniform_sphere(nStars, mass = 1., radius = 1., seed = None):
+	"""
+	Cold sphere of uniform density (all stars at rest), the model of Bonsai's --sphere option
+
+	@param[in]	nStars	number of particles
+	@param[in]	mass	total mass (default: 1)
+	@param[in]	radius	sphere radius (default: 1)
+	@param[in]	seed	random seed (default: None)
+
+	@returns	a Stars object
+	"""
+	rng = np.random.RandomState(seed)
+	r = radius*rng.uniform(0., 1., nStars)**(1./3.)
+	pos = r[:,None]*random_directions(nStars, rng)
+	return make_stars(np.full(nStars, float(mass)/nStars), pos, np.zeros((nStars,3)))
+
+def hernquist_dispersion(r, mass, a):
+	"""
+	Isotropic 1D velocity dispersion of a Hernquist sphere (Hernquist 1990, eq. 10)
+
+	@param[in]	r		(array) radii
+	@param[in]	mass	total mass
+	@param[in]	a		scale radius
+
+	@returns	(array) sigma
+	"""
+	s = r/a
+	sigma2 = mass/(12.*a)*(12.*s*(1. + s)**3*np.log1p(1./s) - s/(1. + s)*(25. + 52.*s + 42.*s**2 + 12.*s**3))
+	return np.sqrt(np.maximum(sigma2, 0.))
+
+def hernquist(nStars, mass = 1., a = 1., rmax = None, seed = None):
+	"""
+	Hernquist sphere (e.g. a bulge) with Gaussian isotropic velocities from the Jeans equation dispersion
+
+	@param[in]	nStars	number of particles
+	@param[in]	mass	total mass (default: 1)
+	@param[in]	a		Hernquist scale radius (default: 1)
+	@param[in]	rmax	truncation radius (default: None, 100 a)
+	@param[in]	seed	random seed (default: None)
+
+	@returns	a Stars object
+	"""
+	rng = np.random.RandomState(seed)
+	if rmax is None:
+		rmax = 100.*a
+
+	#invert M(<r)/M = u^2 with u = r/(r+a), up to rmax
+	umax = rmax/(rmax + a)
+	u = np.sqrt(rng.uniform(0., umax**2, nStars))
+	u = np.maximum(u, 1e-12)
+	r = a*u/(1. - u)
+
+	sigma = hernquist_dispersion(r, mass, a)
+	v_escape = np.sqrt(2.*mass/(r + a))
+	vel = sigma[:,None]*rng.normal(size = (nStars,3))
+	#no unbound stars
+	speed = np.sqrt((vel**2).sum(axis = 1))
+	too_fast = speed > 0.95*v_escape
+	vel[too_fast] *= (0.95*v_escape[too_fast]/speed[too_fast])[:,None]
+
+	pos = r[:,None]*random_directions(nStars, rng)
+	return make_stars(np.full(nStars, float(mass)/nStars), pos, vel)
+
+def exponential_disk(nStars, mass = 1., Rd = 1., z0 = 0.1, Rmax = None, sigma = 0.1, external_mass = None, seed = None):
+	"""
+	Exponential disk (surface density ~ exp(-R/Rd), vertical profile sech^2(z/z0)) in the x-y plane, rotating about +z
+
+	Stars move on circular orbits with speed sqrt(M(<r)/r), where M(<r) is the disk mass inside r
+	in the spherical approximation plus any external_mass (e.g. a bulge or halo), with Gaussian velocity
+	dispersion sigma*v_circ in each direction to make the disk warm.
+
+	@param[in]	nStars			number of particles
+	@param[in]	mass			disk mass (default: 1)
+	@param[in]	Rd				scale length (default: 1)
+	@param[in]	z0				scale height (default: 0.1)
+	@param[in]	Rmax			truncation radius (default: None, 10 Rd)
+	@param[in]	sigma			velocity dispersion as a fraction of the circular speed (default: 0.1)
+	@param[in]	external_mass	function of r giving the mass of other components inside r (default: None)
+	@param[in]	seed			random seed (default: None)
+
+	@returns	a Stars object
+	"""
+	rng = np.random.RandomState(seed)
+	if Rmax is None:
+		Rmax = 10.*Rd
+
+	#invert M(<R)/M = 1 - (1 + R/Rd) exp(-R/Rd) with a table
+	table_R = np.linspace(0., Rmax, 4096)
+	table_M = 1. - (1. + table_R/Rd)*np.exp(-table_R/Rd)
+	R = np.interp(rng.uniform(0., table_M[-1], nStars), table_M, table_R)
+	z = z0*np.arctanh(rng.uniform(-1. + 1e-12, 1. - 1e-12, nStars))
+	phi = rng.uniform(0., 2*np.pi, nStars)
+	pos = np.column_stack((R*np.cos(phi), R*np.sin(phi), z))
+
+	star_mass = np.full(nStars, float(mass)/nStars)
+	r = np.sqrt(R**2 + z**2)
+	enclosed = enclosed_mass(r, star_mass)
+	if external_mass is not None:
+		enclosed = enclosed + external_mass(r)
+	v_circ = np.sqrt(enclosed/np.maximum(r, 1e-12*Rd))
+
+	vel = np.column_stack((-v_circ*np.sin(phi), v_circ*np.cos(phi), np.zeros(nStars)))
+	vel += (sigma*v_circ)[:,None]*rng.normal(size = (nStars,3))
+	return make_stars(star_mass, pos, vel)
+
+def hernquist_mass(mass, a):
+	"""
+	Enclosed mass function of a Hernquist sphere, for exponential_disk(external_mass = ...)
+
+	@returns	function of r
+	"""
+	return lambda r: mass*r**2/(r + a)**2
+
+def disk_galaxy(nDisk, nBulge = 0, diskMass = 1., bulgeMass = 0., Rd = 1., z0 = 0.1, a_bulge = 0.2, sigma = 0.1, seed = None):
+	"""
+	Disk galaxy: exponential disk orbiting in the combined potential of itself and a Hernquist bulge
+
+	Disk star IDs come first, then the bulge.
+
+	@param[in]	nDisk		number of disk particles
+	@param[in]	nBulge		number of bulge particles (default: 0)
+	@param[in]	diskMass	disk mass (default: 1)
+	@param[in]	bulgeMass	bulge mass, must be positive if nBulge > 0 (default: 0)
+	@param[in]	Rd			disk scale length (default: 1)
+	@param[in]	z0			disk scale height (default: 0.1)
+	@param[in]	a_bulge		bulge scale radius (default: 0.2)
+	@param[in]	sigma		disk velocity dispersion as a fraction of the circular speed (default: 0.1)
+	@param[in]	seed		random seed (default: None)
+
+	@returns	a Stars object
+	"""
+	if nBulge > 0 and bulgeMass <= 0:
+		raise ValueError("Error: %i bulge particles need a positive bulgeMass (got %g)" % (nBulge, bulgeMass))
+	rng = np.random.RandomState(seed)
+	disk_seed, bulge_seed = rng.randint(0, 2**31 - 1, 2)
+	galaxy = exponential_disk(nDisk, diskMass, Rd, z0, sigma = sigma, seed = disk_seed,
+							  external_mass = hernquist_mass(bulgeMass, a_bulge) if nBulge else None)
+	if nBulge:
+		bulge = hernquist(nBulge, bulgeMass, a_bulge, seed = bulge_seed)
+		galaxy.add_stars(bulge.mass, bulge.pos, bulge.vel)
+		galaxy.trim()
+	return galaxy
@@ -0,0 +1,192 @@
+## @namespace nbody
+#  The nbody module is a CPU reference integrator (softened leapfrog with a Barnes-Hut tree) that stands in for Bonsai
+
+"""
+Nbody.py module
+
+Integrates a set of stars with a kick-drift-kick leapfrog and fixed time step, with forces from the
+octree module (Plummer softening eps, G = 1). Each step builds one tree that forked worker processes
+share (see forces()).
+Snapshots are written the way Bonsai writes them ("[snap_prefix]_%010.4f" % time, every dSnap
+starting at t = 0) and every step prints an "Iter: ..." line that timing.parse_bonsai_log() reads.
+
+Runs from bonsai.run_tipsy(), run_plummer() and run_sphere() with backend = 'cpu', which execute this
+file with Bonsai's command line options, e.g.
+
+	python nbody.py --plummer 10000 --snapname out/snap -T 2 -dt 0.0625 --snapiter 0.0625 --eps 0.05
+
+Meant for CPU-only machines and as a reference for the GPU code at 10^4 - 10^5 particles.
+
+Project: UC San Diego Physics 241, Winter 2014, Prof. J. Kuti
+"""
+
+import argparse, sys, time
+from multiprocessing import Pool, cpu_count
+import numpy as np
+import tipsy, octree, ics
+
+def snapshot_path(snap_prefix, snap_time):
+	"""
+	Name of a snapshot, as Bonsai names them
+
+	@param[in]	snap_prefix		path prefix of the snapshot files (--snapname)
+	@param[in]	snap_time		simulation time
+
+	@returns	path
+	"""
+	return snap_prefix + '_%010.4f' % snap_time
+
+##\short	Tree of the force evaluation in progress, inherited by the worker processes forces() forks
+SHARED_TREE = None
+
+def force_task(task):
+	"""
+	Evaluates one range of the particles in tree (Morton) order (worker function of forces())
+
+	@param[in]	task	(eps, theta, first, stop) tuple, the range is SHARED_TREE.order[first:stop]
+
+	@returns	(potential, accelerations) of the range
+	"""
+	eps, theta, first, stop = task
+	return SHARED_TREE.gravity(SHARED_TREE.order[first:stop], eps, theta)
+
+def forces(pos, mass, eps, theta = 0.6, nProcs = 1):
+	"""
+	Softened accelerations and potentials of all particles, split over worker processes
+
+	The tree is built once, then the workers are forked and find it in SHARED_TREE, so only the results
+	are sent between processes. Each worker evaluates stretches of the particles in the tree's Morton
+	order, i.e. spatially compact groups that open the same cells; there are a few stretches per worker
+	to even out the load between dense and sparse regions.
+
+	@param[in]	pos		(Nx3 array) positions
+	@param[in]	mass	(N array) masses
+	@param[in]	eps		softening length
+	@param[in]	theta	opening angle (default: 0.6)
+	@param[in]	nProcs	number of worker processes (default: 1, evaluate in this process)
+
+	@returns	(accelerations (Nx3 array), potential (N array))
+	"""
+	global SHARED_TREE
+	tree = octree.Octree(pos, mass)
+	nParts = 1 if nProcs < 2 else 4*nProcs
+	bounds = np.linspace(0, len(pos), nParts + 1).astype(int)
+	tasks = [(eps, theta, bounds[k], bounds[k + 1]) for k in range(nParts)]
+	SHARED_TREE = tree
+	try:
+		if nProcs < 2:
+			parts = [force_task(task) for task in tasks]
+		else:
+			pool = Pool(nProcs)
+			try:
+				parts = pool.map(force_task, tasks, chunksize = 1)
+				pool.close()
+			finally:
+				pool.terminate()
+				pool.join()
+	finally:
+		SHARED_TREE = None
+
+	pot = np.empty(len(pos))
+	acc = np.empty((len(pos),3))
+	pot[tree.order] = np.concatenate([part_pot for part_pot, part_acc in parts])
+	acc[tree.order] = np.concatenate([part_acc for part_pot, part_acc in parts])
+	return acc, pot
+
+def leapfrog(stars, T, dt, dSnap, eps, snap_prefix, theta = 0.6, nProcs = None, log = sys.stdout):
+	"""
+	Integrates stars from stars.time to stars.time + T and writes snapshots
+
+	Kick-drift-kick leapfrog with fixed time step dt. A snapshot is written at the start and every
+	round(dSnap/dt) steps. The total energy (kinetic + softened potential) is logged every step.
+
+	@param[in]	stars		Stars object with the initial conditions (integrated in place)
+	@param[in]	T			total simulation time
+	@param[in]	dt			time step
+	@param[in]	dSnap		interval at which snapshot files are generated
+	@param[in]	eps			softening length
+	@param[in]	snap_prefix	path prefix for snapshot files (time will be appended)
+	@param[in]	theta		opening angle (default: 0.6)
+	@param[in]	nProcs		number of worker processes for the forces (default: number of cores)
+	@param[in]	log			file the step lines are written to (default: stdout)
+
+	@returns	list of snapshot paths
+	"""
+	if nProcs is None:
+		nProcs = cpu_count()
+	nSteps = int(round(T/dt))
+	snap_every = max(1, int(round(dSnap/dt)))
+	t0 = float(stars.time)
+	mass = stars.mass.astype(np.float64)
+	pos = stars.pos.astype(np.float64)
+	vel = stars.vel.astype(np.float64)
+
+	def energy(vel, pot):
+		return 0.5*np.dot(mass, (vel**2).sum(axis = 1)) + 0.5*np.dot(mass, pot)
+
+	def snapshot(step):
+		path = snapshot_path(snap_prefix, t0 + step*dt)
+		tipsy.write_stars(path, t0 + step*dt, mass, pos, vel, stars.IDs)
+		return path
+
+	start = time.time()
+	acc, pot = forces(pos, mass, eps, theta, nProcs)
+	E0 = energy(vel, pot)
+	log.write('N: %i  nProcs: %i  theta: %g  eps: %g  Etot: %.10g  gravity: %.4f\n' % (len(mass), nProcs, theta, eps, E0, time.time() - start))
+	paths = [snapshot(0)]
+	for step in range(1, nSteps + 1):
+		start = time.time()
+		vel += 0.5*dt*acc
+		pos += dt*vel
+		force_start = time.time()
+		acc, pot = forces(pos, mass, eps, theta, nProcs)
+		force_time = time.time() - force_start
+		vel += 0.5*dt*acc
+		E = energy(vel, pot)
+		if step % snap_every == 0 or step == nSteps:
+			paths.append(snapshot(step))
+		log.write('Iter: %i  t: %.6f  dt: %g  Etot: %.10g  dE: %.4e  gravity: %.4f  Total iteration took: %.4f\n'
+				  % (step, t0 + step*dt, dt, E, (E - E0)/abs(E0) if E0 else 0., force_time, time.time() - start))
+		log.flush()
+
+	stars.detach()
+	stars.pos[:] = pos
+	stars.vel[:] = vel
+	stars.time = t0 + nSteps*dt
+	return paths
+
+def main(argv = None):
+	"""
+	Command line with Bonsai's options (see bonsai.bonsai_command())
+
+	@param[in]	argv	arguments (default: None, sys.argv[1:])
+
+	@returns	exit code
+	"""
+	parser = argparse.ArgumentParser(description = 'CPU Barnes-Hut leapfrog with Bonsai compatible options')
+	model = parser.add_mutually_exclusive_group(required = True)
+	model.add_argument('-i', '--infile', help = 'tipsy file with the initial conditions')
+	model.add_argument('--plummer', type = int, help = 'start from a Plummer sphere of this many particles')
+	model.add_argument('--sphere', type = int, help = 'start from a cold uniform sphere of this many particles')
+	parser.add_argument('--snapname', required = True, help = 'path prefix of the snapshot files')
+	parser.add_argument('--snapiter', type = float, required = True, help = 'time between snapshots')
+	parser.add_argument('-T', type = float, required = True, help = 'total simulation time')
+	parser.add_argument('-dt', type = float, required = True, help = 'time step')
+	parser.add_argument('--eps', type = float, default = 0.05, help = 'softening length')
+	parser.add_argument('--theta', type = float, default = 0.6, help = 'opening angle')
+	parser.add_argument('--procs', type = int, default = None, help = 'worker processes (default: number of cores)')
+	parser.add_argument('--seed', type = int, default = None, help = 'random seed of the built in models')
+	parser.add_argument('--log', action = 'store_true', help = 'accepted for compatibility, the step log is always printed')
+	args = parser.parse_args(argv)
+
+	if args.infile:
+		stars = tipsy.Stars(args.infile)
+	elif args.plummer:
+		stars = ics.plummer(args.plummer, seed = args.seed)
+	else:
+		stars = ics.uniform_sphere(args.sphere, seed = args.seed)
+	leapfrog(stars, args.T, args.dt, args.snapiter, args.eps, args.snapname, args.theta, args.procs)
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
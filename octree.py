@@ -0,0 +1,608 @@
+## @namespace octree
+#  The octree module computes softened gravitational potentials and accelerations with a vectorized Barnes-Hut tree
+
+"""
+Octree.py module
+
+Particles are sorted along a Morton (Z-order) curve, so every tree cell is a contiguous run of the sorted
+particles and a whole level of the tree can be built with a few array operations. The tree walk is
+vectorized over blocks of target particles: each level turns a list of (target, cell) pairs into
+accepted monopole interactions, direct particle-particle sums for small leaf cells, and pairs with the
+children of the cells that have to be opened.
+
+Interactions use Plummer softening with the same eps as Bonsai (--eps), G = 1.
+
+Project: UC San Diego Physics 241, Winter 2014, Prof. J. Kuti
+"""
+
+import numpy as np
+
+##\short	Bits per coordinate in a Morton key (3 x 21 bits fit in 64 bits)
+KEY_BITS = 21
+
+def spread_bits(x):
+	"""
+	Spreads the lower 21 bits of x so that there are two zero bits between consecutive bits
+
+	@param[in]	x	(uint64 array) integer coordinates
+
+	@returns	(uint64 array)
+	"""
+	x = x & np.uint64(0x1fffff)
+	x = (x | x << np.uint64(32)) & np.uint64(0x1f00000000ffff)
+	x = (x | x << np.uint64(16)) & np.uint64(0x1f0000ff0000ff)
+	x = (x | x << np.uint64(8)) & np.uint64(0x100f00f00f00f00f)
+	x = (x | x << np.uint64(4)) & np.uint64(0x10c30c30c30c30c3)
+	x = (x | x << np.uint64(2)) & np.uint64(0x1249249249249249)
+	return x
+
+def bounding_cube(pos):
+	"""
+	Smallest cube containing all positions (slightly enlarged)
+
+	@param[in]	pos		(Nx3 array) positions
+
+	@returns	(lower corner, edge length)
+	"""
+	lo = pos.min(axis = 0).astype(np.float64)
+	hi = pos.max(axis = 0).astype(np.float64)
+	size = float((hi - lo).max())
+	if size <= 0:
+		size = 1.0
+	size *= 1.0 + 1e-6
+	return lo - 0.5e-6*size, size
+
+def morton_keys(pos, lo = None, size = None):
+	"""
+	Morton (Z-order) keys of positions within a cube
+
+	Positions outside of the cube are clamped to its faces.
+
+	@param[in]	pos		(Nx3 array) positions
+	@param[in]	lo		lower corner of the cube (default: None, bounding_cube(pos))
+	@param[in]	size	edge length of the cube (default: None, bounding_cube(pos))
+
+	@returns	(uint64 array) keys
+	"""
+	if lo is None or size is None:
+		lo, size = bounding_cube(pos)
+	return interleave(grid_coordinates(pos, lo, size))
+
+def hilbert_keys(pos, lo = None, size = None):
+	"""
+	Peano-Hilbert keys of positions within a cube
+
+	Consecutive keys are always neighbouring grid cells, so sorting by these keys keeps particles that
+	are close in the array close in space (better than Morton order, which jumps at cell boundaries).
+	Uses Skilling's transpose algorithm (AIP Conf. Proc. 707, 381 (2004)) on all positions at once.
+
+	@param[in]	pos		(Nx3 array) positions
+	@param[in]	lo		lower corner of the cube (default: None, bounding_cube(pos))
+	@param[in]	size	edge length of the cube (default: None, bounding_cube(pos))
+
+	@returns	(uint64 array) keys
+	"""
+	if lo is None or size is None:
+		lo, size = bounding_cube(pos)
+	x = [column.copy() for column in grid_coordinates(pos, lo, size).T]
+
+	#inverse undo excess work
+	q = 1 << (KEY_BITS - 1)
+	while q > 1:
+		p = np.uint64(q - 1)
+		for i in range(3):
+			flip = (x[i] & np.uint64(q)) != 0
+			x[0] = np.where(flip, x[0] ^ p, x[0])
+			t = np.where(flip, np.uint64(0), (x[0] ^ x[i]) & p)
+			x[0] ^= t
+			x[i] ^= t
+		q >>= 1
+
+	#Gray encode
+	x[1] ^= x[0]
+	x[2] ^= x[1]
+	t = np.zeros(len(x[0]), dtype = np.uint64)
+	q = 1 << (KEY_BITS - 1)
+	while q > 1:
+		t = np.where((x[2] & np.uint64(q)) != 0, t ^ np.uint64(q - 1), t)
+		q >>= 1
+	return interleave(np.column_stack([x[0] ^ t, x[1] ^ t, x[2] ^ t]))
+
+def curve_keys(pos, curve = 'hilbert'):
+	"""
+	Space-filling curve keys of positions within their bounding cube
+
+	@param[in]	pos		(Nx3 array) positions
+	@param[in]	curve	'hilbert' or 'morton' (default: 'hilbert')
+
+	@returns	(uint64 array) keys
+	"""
+	if curve == 'hilbert':
+		return hilbert_keys(pos)
+	elif curve == 'morton':
+		return morton_keys(pos)
+	raise Exception("Error: curve '%s' is not known (use 'hilbert' or 'morton')." % curve)
+
+def grid_coordinates(pos, lo, size):
+	"""
+	Integer coordinates of positions on the finest grid (2^KEY_BITS cells per edge) of a cube
+
+	@param[in]	pos		(Nx3 array) positions
+	@param[in]	lo		lower corner of the cube
+	@param[in]	size	edge length of the cube
+
+	@returns	(Nx3 uint64 array), clamped to the cube
+	"""
+	cells = np.floor((np.asarray(pos, dtype = np.float64) - lo)*(2**KEY_BITS/size))
+	return np.clip(cells, 0, 2**KEY_BITS - 1).astype(np.uint64)
+
+def interleave(cells):
+	"""
+	Morton code of integer grid coordinates (of any level)
+
+	@param[in]	cells	(Nx3 uint64 array) coordinates
+
+	@returns	(uint64 array) codes
+	"""
+	return (spread_bits(cells[:,0]) << np.uint64(2)) | (spread_bits(cells[:,1]) << np.uint64(1)) | spread_bits(cells[:,2])
+
+def expand_ranges(starts, counts):
+	"""
+	Concatenated ranges starts[i] .. starts[i]+counts[i]-1
+
+	@param[in]	starts	(int array) first index of every range
+	@param[in]	counts	(int array) length of every range
+
+	@returns	(owner, index): for every element the range it came from and its index
+	"""
+	total = int(counts.sum())
+	owner = np.repeat(np.arange(len(counts)), counts)
+	offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+	return owner, np.repeat(starts, counts) + offsets
+
+def pair_products(start_a, count_a, start_b, count_b, same, diagonal):
+	"""
+	All index pairs (i, j) with i in range a and j in range b, for each pair of ranges
+
+	When both ranges of a pair are the same range, every unordered pair is returned once.
+
+	@param[in]	start_a, count_a	first ranges
+	@param[in]	start_b, count_b	second ranges
+	@param[in]	same				(bool array) the two ranges are identical
+	@param[in]	diagonal			include i == j for identical ranges
+
+	@returns	(i, j) index arrays
+	"""
+	owner, k = expand_ranges(np.zeros(len(count_a), dtype = np.int64), count_a*count_b)
+	i = start_a[owner] + k//count_b[owner]
+	j = start_b[owner] + k%count_b[owner]
+	keep = ~same[owner] | ((i <= j) if diagonal else (i < j))
+	return i[keep], j[keep]
+
+def sort_groups(group, value, largest):
+	"""
+	Sort order by group and by value within each group (a faster np.lexsort((value, group)))
+
+	Sorts a single float key group + value/largest, so values are ordered to about 1e-12 of the
+	largest value of their group.
+
+	@param[in]	group	(int array) small non-negative group numbers
+	@param[in]	value	(array) non-negative values
+	@param[in]	largest	(array) for each element, the largest value of its group
+
+	@returns	(int array) sort order
+	"""
+	scaled = value/np.where(largest > 0, largest*(1. + 1e-9), 1.)
+	return np.argsort(2.*group + scaled)
+
+class Octree(object):
+	"""
+	Barnes-Hut octree over a set of particles
+
+	Each level stores its cells as arrays (Morton code prefix, first sorted particle, particle count,
+	mass, center of mass, first child and number of children on the next level).
+	"""
+
+	## Permutation that sorts the particles along the Morton curve
+	order = None
+	## Morton keys of the sorted particles
+	keys = None
+	## Sorted particle positions (float64)
+	pos = None
+	## Sorted particle masses (float64)
+	mass = None
+	## Lower corner of the root cell
+	lo = None
+	## Edge length of the root cell
+	size = None
+	## Cells with at most this many particles are not opened (their particles are summed directly)
+	leaf_size = 8
+	## List of dictionaries, one per level, of cell arrays
+	levels = None
+
+	def __init__(self, pos, mass, leaf_size = 8):
+		"""
+		Builds the tree
+
+		@param[in]	pos			(Nx3 array) particle positions
+		@param[in]	mass		(N array) particle masses
+		@param[in]	leaf_size	largest number of particles in a cell that is not opened (default: 8)
+
+		@returns	an instance of the Octree object
+		"""
+		pos = np.asarray(pos, dtype = np.float64)
+		mass = np.asarray(mass, dtype = np.float64)
+		self.leaf_size = leaf_size
+		self.lo, self.size = bounding_cube(pos)
+		keys = morton_keys(pos, self.lo, self.size)
+		self.order = np.argsort(keys, kind = 'mergesort')
+		self.keys = keys[self.order]
+		self.pos = pos[self.order]
+		self.mass = mass[self.order]
+
+		weighted = self.pos*self.mass[:,None]
+		self.levels = []
+		for level in range(KEY_BITS + 1):
+			codes = self.keys >> np.uint64(3*(KEY_BITS - level))
+			starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+			counts = np.diff(np.r_[starts, len(codes)])
+			cell_mass = np.add.reduceat(self.mass, starts)
+			com = np.add.reduceat(weighted, starts)/np.where(cell_mass > 0, cell_mass, 1.0)[:,None]
+			massless = cell_mass <= 0
+			if massless.any():
+				com[massless] = np.add.reduceat(self.pos, starts)[massless]/counts[massless][:,None]
+			#radius of the sphere around the center of mass that holds all particles of the cell
+			offset = np.sqrt(((self.pos - np.repeat(com, counts, axis = 0))**2).sum(axis = 1))
+			self.levels.append({'codes':codes[starts], 'starts':starts, 'counts':counts, 'mass':cell_mass,
+								'com':com, 'radius':np.maximum.reduceat(offset, starts), 'size':self.size/2**level,
+								'lower':np.minimum.reduceat(self.pos, starts), 'upper':np.maximum.reduceat(self.pos, starts)})
+			if counts.max() <= leaf_size:
+				break
+
+		#children of a cell are the cells on the next level whose code drops its last 3 bits to the cell's code
+		for level, cells in enumerate(self.levels):
+			if level + 1 == len(self.levels):
+				cells['child_start'] = np.zeros(len(cells['codes']), dtype = np.int64)
+				cells['child_count'] = np.zeros(len(cells['codes']), dtype = np.int64)
+				cells['leaf'] = np.ones(len(cells['codes']), dtype = bool)
+				continue
+			parents = self.levels[level + 1]['codes'] >> np.uint64(3)
+			cells['child_start'] = np.searchsorted(parents, cells['codes'], 'left')
+			cells['child_count'] = np.searchsorted(parents, cells['codes'], 'right') - cells['child_start']
+			cells['leaf'] = cells['counts'] <= leaf_size
+
+	def gravity(self, targets = None, eps = 0.0, theta = 0.6, accelerations = True, block = 8192):
+		"""
+		Softened potential (and acceleration) at target positions
+
+		A cell is used as a point mass when it does not contain the target and is seen under an angle
+		smaller than theta (cell size < theta x distance to its center of mass).
+
+		@param[in]	targets			indices of the tree's particles to evaluate (default: None, all particles).
+									A particle does not interact with itself.
+		@param[in]	eps				Plummer softening length (default: 0)
+		@param[in]	theta			opening angle (default: 0.6)
+		@param[in]	accelerations	also compute accelerations (default: True)
+		@param[in]	block			number of targets walked together, bounds memory use (default: 8192)
+
+		@returns	(potential (N array), accelerations (Nx3 array) or None), in the order of targets
+		"""
+		nParticles = len(self.pos)
+		if targets is None:
+			targets = np.arange(nParticles)
+		targets = np.asarray(targets)
+		#position of every original particle index in the sorted arrays
+		rank = np.empty(nParticles, dtype = np.int64)
+		rank[self.order] = np.arange(nParticles)
+
+		pot = np.zeros(len(targets))
+		acc = np.zeros((len(targets),3)) if accelerations else None
+		for first in range(0, len(targets), block):
+			sorted_index = rank[targets[first:first + block]]
+			block_pot, block_acc = self.walk(sorted_index, eps**2, theta**2, accelerations)
+			pot[first:first + block] = block_pot
+			if accelerations:
+				acc[first:first + block] = block_acc
+		return pot, acc
+
+	def walk(self, sorted_index, eps2, theta2, accelerations):
+		"""
+		Tree walk for one block of targets
+
+		@param[in]	sorted_index	indices of the targets in the sorted particle arrays
+		@param[in]	eps2			softening length squared
+		@param[in]	theta2			opening angle squared
+		@param[in]	accelerations	also compute accelerations
+
+		@returns	(potential, accelerations or None)
+		"""
+		n = len(sorted_index)
+		tpos = self.pos[sorted_index]
+		tkeys = self.keys[sorted_index]
+		pot = np.zeros(n)
+		acc = np.zeros((n,3)) if accelerations else None
+
+		def interact(target, dx, source_mass):
+			r2 = (dx**2).sum(axis = 1) + eps2
+			inv_r = 1.0/np.sqrt(r2)
+			pot[:] -= np.bincount(target, source_mass*inv_r, minlength = n)
+			if accelerations:
+				weight = source_mass*inv_r**3
+				for k in range(3):
+					acc[:,k] += np.bincount(target, weight*dx[:,k], minlength = n)
+
+		target = np.arange(n)
+		cell = np.zeros(n, dtype = np.int64)
+		for level, cells in enumerate(self.levels):
+			if not len(target):
+				break
+			dx = cells['com'][cell] - tpos[target]
+			d2 = (dx**2).sum(axis = 1)
+			contained = (tkeys[target] >> np.uint64(3*(KEY_BITS - level))) == cells['codes'][cell]
+			far = ~contained & (d2*theta2 > cells['size']**2)
+			interact(target[far], dx[far], cells['mass'][cell[far]])
+
+			near = ~far
+			leaf = near & cells['leaf'][cell]
+			if leaf.any():
+				owner, source = expand_ranges(cells['starts'][cell[leaf]], cells['counts'][cell[leaf]])
+				pair_target = target[leaf][owner]
+				keep = source != sorted_index[pair_target]
+				pair_target, source = pair_target[keep], source[keep]
+				interact(pair_target, self.pos[source] - tpos[pair_target], self.mass[source])
+
+			opened = near & ~cells['leaf'][cell]
+			owner, child = expand_ranges(cells['child_start'][cell[opened]], cells['child_count'][cell[opened]])
+			target, cell = target[opened][owner], child
+		return pot, acc
+
+	def potential_energy(self, eps = 0.0, theta = 0.6, chunk = 1000000):
+		"""
+		Total softened potential energy W = -sum over pairs m_i m_j / sqrt(r_ij^2 + eps^2)
+
+		Walks pairs of cells instead of particles: two cells whose particles are seen from each other
+		under an angle smaller than theta (sum of radii < theta x distance) interact as point masses,
+		so the number of interactions grows about linearly with the number of particles. Much faster
+		than summing gravity() when only the total is needed.
+
+		Cells interact as monopoles only: for a 2x10^4 particle Plummer model the relative error against
+		direct summation is about 1e-4 at theta = 0.6, 2e-5 at 0.3 and 6e-6 at 0.2 (each step costs about
+		twice the time); theta = 0 opens every cell and gives the direct sum.
+
+		@param[in]	eps		Plummer softening length (default: 0)
+		@param[in]	theta	opening angle (default: 0.6)
+		@param[in]	chunk	largest number of cell pairs processed at once, bounds memory use (default: 10^6)
+
+		@returns	potential energy (float)
+		"""
+		eps2 = eps**2
+		energy = 0.0
+		#pending (level, cells a, cells b), depth first so that only a few chunks are held at a time
+		stack = [(0, np.zeros(1, dtype = np.int64), np.zeros(1, dtype = np.int64))]
+		while stack:
+			level, a, b = stack.pop()
+			cells = self.levels[level]
+			same = a == b
+			d2 = ((cells['com'][a] - cells['com'][b])**2).sum(axis = 1)
+			far = ~same & (d2*theta**2 > (cells['radius'][a] + cells['radius'][b])**2)
+			energy -= (cells['mass'][a[far]]*cells['mass'][b[far]]/np.sqrt(d2[far] + eps2)).sum()
+
+			near = ~far
+			leaf = near & cells['leaf'][a] & cells['leaf'][b]
+			if leaf.any():
+				i, j = pair_products(cells['starts'][a[leaf]], cells['counts'][a[leaf]],
+									 cells['starts'][b[leaf]], cells['counts'][b[leaf]], same[leaf], False)
+				r2 = ((self.pos[i] - self.pos[j])**2).sum(axis = 1) + eps2
+				energy -= (self.mass[i]*self.mass[j]/np.sqrt(r2)).sum()
+
+			opened = np.flatnonzero(near & ~leaf)
+			#each opened pair has at most 64 child pairs
+			for first in range(0, len(opened), max(chunk//64, 1)):
+				part = opened[first:first + max(chunk//64, 1)]
+				children = pair_products(cells['child_start'][a[part]], cells['child_count'][a[part]],
+										 cells['child_start'][b[part]], cells['child_count'][b[part]], same[part], True)
+				stack.append((level + 1,) + children)
+		return energy
+
+	def region(self, classify, contains):
+		"""
+		Indices of the particles in a region, found by walking the cells that overlap it
+
+		@param[in]	classify	function(cells, cell) -> (cell overlaps the region, cell lies inside the region) bool arrays
+		@param[in]	contains	function(positions) -> bool array, particle lies inside the region
+
+		@returns	(int array) sorted indices into the original particle arrays
+		"""
+		found = []
+		cell = np.zeros(1, dtype = np.int64)
+		for cells in self.levels:
+			if not len(cell):
+				break
+			overlaps, inside = classify(cells, cell)
+			owner, index = expand_ranges(cells['starts'][cell[inside]], cells['counts'][cell[inside]])
+			found.append(index)
+
+			partial = overlaps & ~inside
+			leaf = partial & cells['leaf'][cell]
+			owner, index = expand_ranges(cells['starts'][cell[leaf]], cells['counts'][cell[leaf]])
+			found.append(index[contains(self.pos[index])])
+
+			opened = partial & ~cells['leaf'][cell]
+			owner, cell = expand_ranges(cells['child_start'][cell[opened]], cells['child_count'][cell[opened]])
+		return np.sort(self.order[np.concatenate(found)])
+
+	def in_box(self, lower, upper):
+		"""
+		Particles inside an axis aligned box (boundaries included)
+
+		@param[in]	lower	(3-vector) lower corner
+		@param[in]	upper	(3-vector) upper corner
+
+		@returns	(int array) sorted indices into the original particle arrays
+		"""
+		lower = np.asarray(lower, dtype = np.float64)
+		upper = np.asarray(upper, dtype = np.float64)
+
+		def classify(cells, cell):
+			overlaps = np.all((cells['upper'][cell] >= lower) & (cells['lower'][cell] <= upper), axis = 1)
+			inside = np.all((cells['lower'][cell] >= lower) & (cells['upper'][cell] <= upper), axis = 1)
+			return overlaps, inside
+
+		return self.region(classify, lambda pos: np.all((pos >= lower) & (pos <= upper), axis = 1))
+
+	def in_sphere(self, center, radius):
+		"""
+		Particles inside a sphere (boundary included)
+
+		@param[in]	center	(3-vector) center
+		@param[in]	radius	radius
+
+		@returns	(int array) sorted indices into the original particle arrays
+		"""
+		center = np.asarray(center, dtype = np.float64)
+		r2 = float(radius)**2
+
+		def classify(cells, cell):
+			lower, upper = cells['lower'][cell], cells['upper'][cell]
+			nearest = (np.maximum(np.maximum(lower - center, center - upper), 0)**2).sum(axis = 1)
+			farthest = (np.maximum(np.abs(center - lower), np.abs(center - upper))**2).sum(axis = 1)
+			return nearest <= r2, farthest <= r2
+
+		return self.region(classify, lambda pos: ((pos - center)**2).sum(axis = 1) <= r2)
+
+	def nearest(self, points, k, block = 1024):
+		"""
+		k nearest particles of each point (a point that is a particle finds itself at distance 0)
+
+		The k-th closest of the particles next to the point along the Morton curve gives an upper bound
+		of the k-th neighbour distance; the tree is then walked for all particles within that distance
+		(like in_sphere(), for a block of points at once) and the k closest are kept.
+
+		@param[in]	points	(Mx3 array) query positions
+		@param[in]	k		number of neighbours
+		@param[in]	block	number of points searched together, bounds memory use (default: 1024)
+
+		@returns	(distances (Mxk array, ascending), indices into the original particle arrays (Mxk int array))
+		"""
+		points = np.atleast_2d(np.asarray(points, dtype = np.float64))
+		if k > len(self.pos):
+			raise Exception("Error: %i neighbours requested from %i particles" % (k, len(self.pos)))
+		distances = np.empty((len(points), k))
+		indices = np.empty((len(points), k), dtype = np.int64)
+		for first in range(0, len(points), block):
+			d, i = self.nearest_block(points[first:first + block], k)
+			distances[first:first + block] = d
+			indices[first:first + block] = self.order[i]
+		return distances, indices
+
+	def nearest_block(self, points, k):
+		"""
+		nearest() for one block of points
+
+		@returns	(distances, indices into the sorted particle arrays)
+		"""
+		n = len(points)
+		keys = morton_keys(points, self.lo, self.size)
+
+		#the k-th closest of the 2k particles next to the point along the Morton curve bounds the k-th neighbour distance
+		width = min(2*k, len(self.pos))
+		first = np.clip(np.searchsorted(self.keys, keys) - k, 0, len(self.pos) - width)
+		window = first[:,None] + np.arange(width)
+		d2 = ((self.pos[window] - points[:,None,:])**2).sum(axis = 2)
+		bound = np.partition(d2, k - 1, axis = 1)[:,k - 1]
+
+		#all particles within the bound
+		found_owner, found_particle, found_d2 = [], [], []
+		owner = np.arange(n)
+		cell = np.zeros(n, dtype = np.int64)
+		for cells in self.levels:
+			if not len(cell):
+				break
+			lower, upper = cells['lower'][cell], cells['upper'][cell]
+			nearest = (np.maximum(np.maximum(lower - points[owner], points[owner] - upper), 0)**2).sum(axis = 1)
+			overlaps = nearest <= bound[owner]
+
+			leaf = overlaps & cells['leaf'][cell]
+			pair, particle = expand_ranges(cells['starts'][cell[leaf]], cells['counts'][cell[leaf]])
+			pair = owner[leaf][pair]
+			d2 = ((self.pos[particle] - points[pair])**2).sum(axis = 1)
+			keep = d2 <= bound[pair]
+			found_owner.append(pair[keep])
+			found_particle.append(particle[keep])
+			found_d2.append(d2[keep])
+
+			opened = overlaps & ~cells['leaf'][cell]
+			pair, cell = expand_ranges(cells['child_start'][cell[opened]], cells['child_count'][cell[opened]])
+			owner = owner[opened][pair]
+
+		owner, particle, d2 = np.concatenate(found_owner), np.concatenate(found_particle), np.concatenate(found_d2)
+		order = sort_groups(owner, d2, bound[owner])
+		owner, particle, d2 = owner[order], particle[order], d2[order]
+		rank = np.arange(len(owner)) - np.searchsorted(owner, owner)
+		take = rank < k
+		distances = np.empty((n, k))
+		indices = np.empty((n, k), dtype = np.int64)
+		distances[owner[take], rank[take]] = np.sqrt(d2[take])
+		indices[owner[take], rank[take]] = particle[take]
+		return distances, indices
+
+	def knn_density(self, k = 32):
+		"""
+		Mass density at every particle from its k nearest neighbours (itself included)
+
+		density = (mass of the k nearest particles) / (4/3 pi r_k^3), r_k the distance to the k-th
+
+		@param[in]	k	number of neighbours (default: 32)
+
+		@returns	(array) density per particle, in the original particle order
+		"""
+		distances, indices = self.nearest(self.pos, k)
+		original_mass = np.empty(len(self.mass))
+		original_mass[self.order] = self.mass
+		density = np.empty(len(self.pos))
+		density[self.order] = original_mass[indices].sum(axis = 1)/(4./3.*np.pi*distances[:,-1]**3)
+		return density
+
+def potential(pos, mass, eps = 0.0, theta = 0.6, targets = None, leaf_size = 8):
+	"""
+	Softened gravitational potential of every particle due to all others (G = 1)
+
+	@param[in]	pos			(Nx3 array) particle positions
+	@param[in]	mass		(N array) particle masses
+	@param[in]	eps			Plummer softening length (default: 0)
+	@param[in]	theta		opening angle (default: 0.6)
+	@param[in]	targets		indices of the particles to evaluate (default: None, all)
+	@param[in]	leaf_size	largest number of particles in an unopened cell (default: 8)
+
+	@returns	(array) potential per particle
+	"""
+	return Octree(pos, mass, leaf_size).gravity(targets, eps, theta, accelerations = False)[0]
+
+def accelerations(pos, mass, eps = 0.0, theta = 0.6, leaf_size = 8):
+	"""
+	Softened gravitational accelerations and potentials of all particles (G = 1)
+
+	@param[in]	pos			(Nx3 array) particle positions
+	@param[in]	mass		(N array) particle masses
+	@param[in]	eps			Plummer softening length (default: 0)
+	@param[in]	theta		opening angle (default: 0.6)
+	@param[in]	leaf_size	largest number of particles in an unopened cell (default: 8)
+
+	@returns	(accelerations (Nx3 array), potential (N array))
+	"""
+	pot, acc = Octree(pos, mass, leaf_size).gravity(None, eps, theta)
+	return acc, pot
+
+def potential_energy(pos, mass, eps = 0.0, theta = 0.6, leaf_size = 8):
+	"""
+	Total softened potential energy of a set of particles (G = 1), see Octree.potential_energy()
+
+	@param[in]	pos			(Nx3 array) particle positions
+	@param[in]	mass		(N array) particle masses
+	@param[in]	eps			Plummer softening length (default: 0)
+	@param[in]	theta		opening angle (default: 0.6)
+	@param[in]	leaf_size	largest number of particles in an unopened cell (default: 8)
+
+	@returns	potential energy (float)
+	"""
+	return Octree(pos, mass, leaf_size).potential_energy(eps, theta)
@@ -0,0 +1,284 @@
+## @namespace sweep
+#  The sweep module runs parameter sweeps of Bonsai simulations as a local batch queue
+
+"""
+Sweep.py module
+
+Runs many Bonsai jobs (e.g. a range of eps, dt or initial condition files) a few at a time,
+each in its own output folder, and keeps track of them so an interrupted sweep can be resumed.
+
+Project: UC San Diego Physics 241, Winter 2014, Prof. J. Kuti
+"""
+
+import itertools, json, os, time
+
+import bonsai
+
+##\short	Parameters of a job that are not swept and not given in the spec
+DEFAULTS = {'mode':'infile', 'T':2, 'dt':0.0625, 'dSnap':0.0625, 'eps':0.05, 'mpi_n':0, 'backend':'bonsai'}
+
+##\short	Snapshot prefix of a job within its folder (Bonsai appends "_%010.4f" % time)
+SNAP_NAME = 'snap'
+
+##\short	Parameter that must be given for each mode
+MODE_PARAMETERS = {'infile':'tipsy_file', 'plummer':'nParticles', 'sphere':'nParticles'}
+
+def check_job(name, job):
+	"""
+	Checks the parameters of one job before anything is started
+
+	@param[in]	name	job name (for the message)
+	@param[in]	job		parameter dictionary
+
+	@returns	None, raises ValueError if the mode, its particle count or file, or the backend is missing or not known
+	"""
+	mode = job['mode']
+	if mode not in MODE_PARAMETERS:
+		raise ValueError("Error: %s: mode '%s' is not known (one of %s)" % (name, mode, ', '.join(sorted(MODE_PARAMETERS))))
+	if job.get(MODE_PARAMETERS[mode]) is None:
+		raise ValueError("Error: %s: mode '%s' needs '%s' in the sweep spec" % (name, mode, MODE_PARAMETERS[mode]))
+	if job['backend'] not in bonsai.BACKENDS:
+		raise ValueError("Error: %s: backend '%s' is not known (one of %s)" % (name, job['backend'], ', '.join(bonsai.BACKENDS)))
+
+def make_jobs(spec):
+	"""
+	Expands a sweep spec into a list of jobs
+
+	Every key of spec whose value is a list is swept: one job is made for each combination of the
+	listed values (cartesian product). Keys are Bonsai parameters: mode ('infile', 'plummer' or 'sphere'),
+	tipsy_file (infile mode) or nParticles, T, dt, dSnap, eps, mpi_n and backend. Missing keys take the values in DEFAULTS.
+
+	Example: {'tipsy_file':['b0.tipsy','b1.tipsy'], 'eps':[0.01,0.05], 'T':10} makes 4 jobs.
+
+	Every job is checked with check_job(), so a bad spec fails here rather than after the sweep has started.
+
+	@param[in]	spec	dictionary of parameter values or lists of values
+
+	@returns	list of (name, parameters) tuples, the name is made from the swept values
+	"""
+	params = dict(DEFAULTS)
+	params.update(spec)
+
+	swept = sorted(key for key, value in params.items() if isinstance(value, (list, tuple)))
+	jobs = []
+	for number, values in enumerate(itertools.product(*[params[key] for key in swept])):
+		job = dict(params)
+		job.update(zip(swept, values))
+		name = '_'.join(['job%03i' % number] + ['%s%s' % (key, os.path.basename(str(value))) for key, value in zip(swept, values)])
+		check_job(name, job)
+		jobs.append((name, job))
+	return jobs
+
+
+class Sweep(object):
+	"""
+	A queue of Bonsai jobs run at most max_jobs at a time
+
+	Job i runs in "[out_dir]/[name]/" with snapshots "snap_[time]" and its output in "bonsai.log".
+	The state of every job (queued, running, done or error, with times and return codes) is saved to
+	"[out_dir]/sweep.json" whenever it changes. Creating a Sweep on an existing out_dir resumes it:
+	finished jobs are skipped and jobs that were running when the sweep was interrupted are run again.
+
+	bonsai_bin can be any executable accepting Bonsai's command line, e.g. a stand-in script for testing
+	on machines without a GPU.
+	"""
+
+	## Folder holding one sub-folder per job and the state file
+	out_dir = None
+	## List of job state dictionaries (name, params, status, start, end, wall_time, returncode, and error if the launch failed)
+	jobs = None
+	## Maximum number of jobs running at the same time
+	max_jobs = 1
+	## Path to bonsai exe (None: bonsai.BONSAI_BIN)
+	bonsai_bin = None
+	## CUDA devices handed out to the running jobs, one per job (None: not set)
+	devices = None
+	## Seconds between checks on the running jobs
+	poll_interval = 1.0
+
+	def __init__(self, spec, out_dir, max_jobs = 1, bonsai_bin = None, devices = None, poll_interval = 1.0):
+		"""
+		Sets up a sweep, resuming the saved state in out_dir if there is one
+
+		@param[in]	spec			sweep spec, see make_jobs()
+		@param[in]	out_dir			output folder (created if needed)
+		@param[in]	max_jobs		maximum number of concurrent jobs (default: 1, or len(devices))
+		@param[in]	bonsai_bin		path to bonsai exe (default: None, bonsai.BONSAI_BIN)
+		@param[in]	devices			list of CUDA device numbers, each running job gets one through CUDA_VISIBLE_DEVICES (default: None)
+		@param[in]	poll_interval	seconds between checks on the running jobs (default: 1)
+
+		@returns	an instance of the Sweep object
+		"""
+		self.out_dir = out_dir
+		self.bonsai_bin = bonsai_bin
+		self.devices = devices
+		self.max_jobs = len(devices) if devices else max_jobs
+		self.poll_interval = poll_interval
+		self.runs = {}
+
+		if not os.path.isdir(out_dir):
+			os.makedirs(out_dir)
+
+		saved = {}
+		if os.path.exists(self.state_file()):
+			for job in json.load(open(self.state_file()))['jobs']:
+				saved[job['name']] = job
+
+		self.jobs = []
+		for name, params in make_jobs(spec):
+			job = saved.get(name)
+			if job is None or job['params'] != json.loads(json.dumps(params)):
+				job = {'name':name, 'params':params, 'status':'queued',
+					   'start':None, 'end':None, 'wall_time':None, 'returncode':None}
+			elif job['status'] == 'running':
+				#interrupted
+				job['status'] = 'queued'
+			self.jobs.append(job)
+		self.save_state()
+
+	def state_file(self):
+		"""
+		@returns	path of the saved sweep state
+		"""
+		return os.path.join(self.out_dir, 'sweep.json')
+
+	def save_state(self):
+		"""
+		Writes the job states to the state file (atomically, via a temporary file)
+
+		@returns	None
+		"""
+		temp_file = self.state_file() + '.tmp'
+		json.dump({'jobs':self.jobs}, open(temp_file,'w'), indent=1, sort_keys=True)
+		os.rename(temp_file, self.state_file())
+
+	def job_dir(self, job):
+		"""
+		@returns	output folder of a job
+		"""
+		return os.path.join(self.out_dir, job['name'])
+
+	def start_job(self, job, device = None):
+		"""
+		Starts one job in the background
+
+		@param[in]	job		job state dictionary
+		@param[in]	device	CUDA device for the job (default: None)
+
+		@returns	True if the job was started, False if it could not be launched (it is marked 'error')
+		"""
+		params = job['params']
+		job_dir = self.job_dir(job)
+		if not os.path.isdir(job_dir):
+			os.makedirs(job_dir)
+
+		nPart_or_file = params['tipsy_file'] if params['mode'] == 'infile' else params['nParticles']
+		command = bonsai.bonsai_command(params['mode'], nPart_or_file, os.path.join(job_dir,SNAP_NAME),
+										params['T'], params['dt'], params['dSnap'], params['eps'],
+										self.bonsai_bin, params['mpi_n'], os.path.join(job_dir,'mpiout.log'),
+										backend = params['backend'])
+
+		env = None
+		if device is not None:
+			env = dict(os.environ)
+			env['CUDA_VISIBLE_DEVICES'] = str(device)
+
+		run = bonsai.BonsaiRun(command, os.path.join(job_dir,SNAP_NAME), log_file = os.path.join(job_dir,'bonsai.log'),
+							   poll_interval = self.poll_interval, env = env)
+		job['start'] = time.time()
+		job['end'] = None
+		job['wall_time'] = None
+		job['returncode'] = None
+		job['device'] = device
+		job.pop('error', None)
+		try:
+			run.start()
+		except (OSError, IOError) as e:
+			#e.g. bonsai_bin not found (BonsaiRun.start() closes the log file)
+			job['status'] = 'error'
+			job['end'] = time.time()
+			job['error'] = str(e)
+			print 'Could not start %s: %s' % (job['name'], e)
+			return False
+		self.runs[job['name']] = (run, device)
+		job['status'] = 'running'
+		print 'Started %s' % job['name']
+		return True
+
+	def finish_job(self, job):
+		"""
+		Records the result of a job whose process has exited
+
+		@param[in]	job		job state dictionary
+
+		@returns	CUDA device freed by the job
+		"""
+		run, device = self.runs.pop(job['name'])
+		run.wait()
+		job['end'] = time.time()
+		job['wall_time'] = job['end'] - job['start']
+		job['returncode'] = run.returncode()
+		job['status'] = 'done' if job['returncode'] == 0 else 'error'
+		print 'Finished %s: %s (%.1f s)' % (job['name'], job['status'], job['wall_time'])
+		return device
+
+	def run(self, retry_failed = False):
+		"""
+		Runs the queued jobs, at most max_jobs at a time, and returns when all have finished
+
+		If interrupted (e.g. Ctrl-C) the running jobs are cancelled and left queued in the state file.
+
+		@param[in]	retry_failed	also run jobs that finished with an error before (default: False)
+
+		@returns	the job states
+		"""
+		if retry_failed:
+			for job in self.jobs:
+				if job['status'] == 'error':
+					job['status'] = 'queued'
+
+		queue = [job for job in self.jobs if job['status'] == 'queued']
+		free_devices = list(self.devices) if self.devices else []
+		running = []
+		try:
+			while queue or running:
+				while queue and len(running) < self.max_jobs:
+					job = queue.pop(0)
+					device = free_devices.pop(0) if free_devices else None
+					if self.start_job(job, device):
+						running.append(job)
+					elif device is not None:
+						free_devices.append(device)
+					self.save_state()
+
+				time.sleep(self.poll_interval)
+
+				for job in list(running):
+					if self.runs[job['name']][0].returncode() is not None:
+						device = self.finish_job(job)
+						if device is not None:
+							free_devices.append(device)
+						running.remove(job)
+						self.save_state()
+		finally:
+			for job in running:
+				run, device = self.runs.pop(job['name'])
+				run.cancel()
+				job['status'] = 'queued'
+			self.save_state()
+
+		print self.summary()
+		return self.jobs
+
+	def summary(self):
+		"""
+		@returns	a table of job names, status and wall time (string)
+		"""
+		lines = ['%-50s %-8s %10s' % ('job', 'status', 'wall (s)')]
+		total = 0.
+		for job in self.jobs:
+			wall_time = job['wall_time']
+			lines.append('%-50s %-8s %10s' % (job['name'], job['status'], '%.1f' % wall_time if wall_time is not None else '-'))
+			total += wall_time or 0.
+		lines.append('%-50s %-8s %10.1f' % ('total', '', total))
+		return '\n'.join(lines)
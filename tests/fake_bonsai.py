@@ -0,0 +1,53 @@
+"""
+Stand-in for the Bonsai executable used by the tests
+
+Accepts Bonsai's command line (see bonsai.bonsai_command()), writes "[snapname]_%010.4f" snapshots of a
+small cold sphere that does not move, and prints an "Iter: ..." line per step like Bonsai.
+
+With --infile the clock continues from the time in the file's header, or restarts at zero if the
+environment variable FAKE_BONSAI_CLOCK is 'restart' (both happen with Bonsai builds). FAKE_BONSAI_DELAY
+makes every step take that many seconds.
+"""
+
+import argparse, os, sys, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+import tipsy
+
+def main(argv = None):
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--log', action = 'store_true')
+	parser.add_argument('-i', '--infile')
+	parser.add_argument('--plummer', type = int)
+	parser.add_argument('--sphere', type = int)
+	parser.add_argument('--snapname', required = True)
+	parser.add_argument('--snapiter', type = float, required = True)
+	parser.add_argument('-T', type = float, required = True)
+	parser.add_argument('-dt', type = float, required = True)
+	parser.add_argument('--eps', type = float)
+	args = parser.parse_args(argv)
+
+	if args.infile:
+		stars = tipsy.Stars(args.infile)
+		mass, pos, vel, IDs = stars.mass, stars.pos, stars.vel, stars.IDs
+	else:
+		nStars = args.plummer or args.sphere
+		rng = np.random.RandomState(nStars)
+		mass, pos, vel, IDs = np.full(nStars, 1./nStars), rng.uniform(-1, 1, (nStars,3)), np.zeros((nStars,3)), np.arange(nStars)
+	t0 = float(stars.time) if args.infile and os.environ.get('FAKE_BONSAI_CLOCK') != 'restart' else 0.
+
+	nSteps = int(round(args.T/args.dt))
+	snap_every = max(1, int(round(args.snapiter/args.dt)))
+	delay = float(os.environ.get('FAKE_BONSAI_DELAY', 0))
+	for step in range(nSteps + 1):
+		time.sleep(delay)
+		t = t0 + step*args.dt
+		if step % snap_every == 0:
+			tipsy.write_stars(args.snapname + '_%010.4f' % t, t, mass, pos, vel, IDs)
+		print 'Iter: %i  t: %f  dt: %g  Total iteration took: %f' % (step, t, args.dt, 0.001)
+		sys.stdout.flush()
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+Round trip tests of the archive module
+
+Run from the repo folder with: python -m unittest discover tests
+"""
+
+import os, sys, shutil, tempfile, unittest
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import archive, ics, tipsy
+
+class TestArchive(unittest.TestCase):
+
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+		self.path = os.path.join(self.folder, 'run.archive')
+		stars = ics.plummer(1000, seed = 2)
+		rng = np.random.RandomState(4)
+		#snapshots in a different particle order each time, like Bonsai's output
+		self.frames = []
+		for step in range(3):
+			order = rng.permutation(stars.nStars)
+			frame = tipsy.Stars()
+			frame.add_stars(stars.mass[order], stars.pos[order] + step*stars.vel[order], stars.vel[order]*(1. + step), stars.IDs[order])
+			frame.trim()
+			frame.time = 0.125*step
+			self.frames.append(frame)
+
+	def tearDown(self):
+		shutil.rmtree(self.folder)
+
+	def assertSameStars(self, stars, expected):
+		order = np.argsort(expected.IDs, kind = 'mergesort')
+		np.testing.assert_array_equal(stars.IDs, expected.IDs[order])
+		np.testing.assert_array_equal(stars.mass, expected.mass[order])
+		np.testing.assert_array_equal(stars.pos, expected.pos[order])
+		np.testing.assert_array_equal(stars.vel, expected.vel[order])
+		self.assertEqual(stars.time, expected.time)
+
+	def test_lossless_round_trip(self):
+		writer = archive.Archive(self.path, 'w', chunk_size = 128)
+		writer.append(self.frames[0])
+		#frames appended after reopening
+		writer = archive.Archive(self.path, 'a')
+		for frame in self.frames[1:]:
+			writer.append(frame)
+
+		reader = archive.Archive(self.path)
+		self.assertEqual(len(reader), 3)
+		for stars, expected in zip(reader, self.frames):
+			self.assertSameStars(stars, expected)
+		self.assertSameStars(reader[0.13], self.frames[1])
+		self.assertSameStars(reader[-1], self.frames[2])
+
+		#ranges that start and end inside chunks
+		full = reader.frame(2)
+		np.testing.assert_array_equal(reader.pos(2, 100, 700), full.pos[100:700])
+		np.testing.assert_array_equal(reader.vel(2, 250, 260), full.vel[250:260])
+		np.testing.assert_array_equal(reader.IDs(999), full.IDs[999:])
+
+		self.assertRaises(Exception, reader.append, self.frames[0])
+		other = ics.plummer(1000, seed = 3)
+		other.IDs += 1
+		self.assertRaises(Exception, archive.Archive(self.path, 'a').append, other)
+
+	def test_lossy_positions(self):
+		order = np.argsort(self.frames[1].IDs)
+		expected = self.frames[1].pos[order].astype(np.float64)
+		extent = expected.max(axis = 0) - expected.min(axis = 0)
+		#half a step of each format: 11 bit mantissa, 16 bit grid over the bounding box
+		bounds = {'float16':np.abs(expected)*2.**-11 + 2.**-24, 'quantized':0.5*extent/65535*(1. + 1e-5)}
+		for pos_format, bound in sorted(bounds.items()):
+			writer = archive.Archive(self.path, 'w', chunk_size = 256, pos_format = pos_format)
+			writer.append(self.frames[1])
+			stars = archive.Archive(self.path).frame(0)
+			self.assertTrue(np.all(np.abs(stars.pos - expected) <= bound + 1e-6*extent), pos_format)
+			np.testing.assert_array_equal(stars.vel, self.frames[1].vel[order])
+
+	def test_tipsy_round_trip(self):
+		prefix = os.path.join(self.folder, 'snap_')
+		for frame in self.frames:
+			tipsy.write_stars(prefix + '%010.4f' % frame.time, frame.time, frame.mass, frame.pos, frame.vel, frame.IDs)
+		archive.from_tipsy(prefix, self.path, chunk_size = 300)
+		paths = archive.to_tipsy(self.path, os.path.join(self.folder, 'copy_'))
+		self.assertEqual([os.path.basename(path) for path in paths], ['copy_%010.4f' % frame.time for frame in self.frames])
+		for path, frame in zip(paths, self.frames):
+			header, records = tipsy.read_stars(path)
+			order = np.argsort(frame.IDs, kind = 'mergesort')
+			self.assertEqual(header['time'], frame.time)
+			np.testing.assert_array_equal(records['phi'], frame.IDs[order])
+			np.testing.assert_array_equal(records['pos'], frame.pos[order])
+			np.testing.assert_array_equal(records['vel'], frame.vel[order])
+			np.testing.assert_array_equal(records['mass'], frame.mass[order])
+
+if __name__ == '__main__':
+	unittest.main()
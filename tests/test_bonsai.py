@@ -0,0 +1,168 @@
+"""
+Behaviour tests of bonsai.BonsaiRun with a stand-in Bonsai executable (tests/fake_bonsai.py)
+
+Run from the repo folder with: python -m unittest discover tests
+"""
+
+import glob, os, sys, shutil, stat, tempfile, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import bonsai, tipsy
+
+def make_bonsai_bin(folder):
+	"""
+	Writes an executable that runs tests/fake_bonsai.py with this Python
+
+	@returns	path of the executable
+	"""
+	path = os.path.join(folder, 'bonsai_bin')
+	script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_bonsai.py')
+	out = open(path, 'w')
+	out.write('#!/bin/sh\nexec "%s" "%s" "$@"\n' % (sys.executable, script))
+	out.close()
+	os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+	return path
+
+class TestBonsaiRun(unittest.TestCase):
+
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+		self.bonsai_bin = make_bonsai_bin(self.folder)
+		self.snap_prefix = os.path.join(self.folder, 'snap')
+
+	def tearDown(self):
+		os.environ.pop('FAKE_BONSAI_DELAY', None)
+		shutil.rmtree(self.folder)
+
+	def start(self, reported):
+		run = bonsai.run_plummer(100, self.snap_prefix, T = 0.25, dt = 0.0625, dSnap = 0.125, bonsai_bin = self.bonsai_bin,
+								 wait = False, callback = reported.append)
+		run.poll_interval = 0.05
+		return run
+
+	def test_snapshots_and_callback(self):
+		reported = []
+		run = self.start(reported)
+		self.assertEqual(run.wait(), "Done")
+		expected = [self.snap_prefix + '_%010.4f' % t for t in (0., 0.125, 0.25)]
+		self.assertEqual(list(run.snapshots()), expected)
+		self.assertEqual(reported, expected)
+		self.assertEqual([step['iteration'] for step in run.steps()], [0, 1, 2, 3, 4])
+
+	def test_blocking_run_captures_log(self):
+		reported = []
+		result = bonsai.run_plummer(100, self.snap_prefix, T = 0.25, dt = 0.0625, dSnap = 0.125, bonsai_bin = self.bonsai_bin,
+									callback = reported.append, log = True)
+		self.assertEqual(result, "Done")
+		self.assertEqual(len(reported), 3)
+		log_file = os.path.join(self.folder, 'bonsai_snap.log')
+		self.assertEqual(bonsai.log_path(self.snap_prefix), log_file)
+		steps = bonsai.timing.parse_bonsai_log(log_file)
+		self.assertEqual([step['iteration'] for step in steps], [0, 1, 2, 3, 4])
+		self.assertIn('wall_time', steps[0])
+
+	def test_rerun_into_existing_prefix(self):
+		first = self.start([])
+		first.wait()
+		reported = []
+		run = self.start(reported)
+		self.assertEqual(run.wait(), "Done")
+		self.assertEqual(len(list(run.snapshots())), 3)
+		self.assertEqual(len(reported), 3)
+
+	def test_log_outside_snapshot_prefix(self):
+		for snap_prefix in ('out/snap_', 'out/b', 'out/bonsai_', 'snap'):
+			log_file = bonsai.log_path(snap_prefix)
+			self.assertEqual(os.path.dirname(log_file), os.path.dirname(snap_prefix))
+			self.assertFalse(log_file.startswith(snap_prefix), log_file)
+		run = self.start([])
+		run.wait()
+		self.assertEqual(len(bonsai.tipsy.SnapshotSeries(self.snap_prefix, cache_size = 0)), 3)
+		self.assertEqual(sorted(glob.glob(self.snap_prefix + '*')), run.snapshot_files)
+
+	def test_cancel_from_callback(self):
+		os.environ['FAKE_BONSAI_DELAY'] = '0.5'
+		reported, errors = [], []
+		def cancel(path):
+			reported.append(path)
+			try:
+				run.cancel()
+			except Exception as e:
+				errors.append(e)
+		run = self.start([])
+		run.callback = cancel
+		self.assertEqual(run.wait(), "Error")
+		self.assertEqual(run.status(), "cancelled")
+		self.assertEqual(errors, [])
+		self.assertEqual(reported, [self.snap_prefix + '_%010.4f' % 0.])
+
+	def test_wait_before_start(self):
+		run = bonsai.BonsaiRun(['true'], self.snap_prefix)
+		self.assertRaises(Exception, run.wait)
+		self.assertEqual(run.status(), "not started")
+		run.cancel()
+
+	def test_untouched_files_are_not_reported(self):
+		stale = self.snap_prefix + '_stale'
+		open(stale, 'w').write('not a snapshot')
+		run = self.start([])
+		run.wait()
+		self.assertNotIn(stale, run.snapshot_files)
+
+class TestResume(unittest.TestCase):
+
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+		self.bonsai_bin = make_bonsai_bin(self.folder)
+		self.snap_prefix = os.path.join(self.folder, 'snap')
+		self.times = [0., 0.0625, 0.125, 0.1875, 0.25]
+		self.paths = [self.snap_prefix + '_%010.4f' % t for t in self.times]
+		bonsai.run_plummer(100, self.snap_prefix, T = 0.25, dt = 0.0625, dSnap = 0.0625, bonsai_bin = self.bonsai_bin)
+		#the run died while writing t = 0.125
+		for path in self.paths[3:]:
+			os.remove(path)
+		data = open(self.paths[2], 'rb').read()
+		open(self.paths[2], 'wb').write(data[:len(data)//2])
+
+	def tearDown(self):
+		os.environ.pop('FAKE_BONSAI_CLOCK', None)
+		shutil.rmtree(self.folder)
+
+	def resume(self, reported):
+		run = bonsai.run_tipsy(self.paths[0], self.snap_prefix, 0.25, 0.0625, 0.0625, 0.05, bonsai_bin = self.bonsai_bin,
+							   wait = False, callback = reported.append, resume = True)
+		run.poll_interval = 0.05
+		return run
+
+	def check_resumed(self, run, reported):
+		#the truncated snapshot is replaced, the names continue, t = 0.0625 is not written twice
+		paths = list(run.snapshots())
+		self.assertEqual(run.wait(), "Done")
+		self.assertEqual(paths, self.paths[2:])
+		self.assertEqual(reported, self.paths[2:])
+		self.assertEqual(run.snapshot_files, self.paths[2:])
+		self.assertEqual(sorted(glob.glob(self.snap_prefix + '_*')), self.paths)
+		self.assertEqual(glob.glob(self.snap_prefix + bonsai.RESUME_SUFFIX + '*'), [])
+		for path, t in zip(self.paths, self.times):
+			self.assertEqual(tipsy.Stars(path).time, t)
+
+	def test_latest_snapshot_skips_truncated(self):
+		self.assertEqual(bonsai.latest_snapshot(self.snap_prefix, 100), (self.paths[1], 0.0625))
+
+	def test_resume_continued_clock(self):
+		reported = []
+		self.check_resumed(self.resume(reported), reported)
+
+	def test_resume_restarted_clock(self):
+		os.environ['FAKE_BONSAI_CLOCK'] = 'restart'
+		reported = []
+		self.check_resumed(self.resume(reported), reported)
+
+	def test_resume_complete_run(self):
+		run = bonsai.resume_run(self.paths[1], 0.0625, self.snap_prefix, 0.0625, 0.0625, 0.0625, 0.05, self.bonsai_bin,
+								0, 'mpiout.log', wait = False)
+		self.assertEqual(run.wait(), "Done")
+		self.assertEqual(list(run.snapshots()), [])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,53 @@
+"""
+Behaviour tests of the ics module: sampled mass profiles and virial equilibrium
+
+Run from the repo folder with: python -m unittest discover tests
+"""
+
+import os, sys, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+import ics, diagnostics
+
+def enclosed_fractions(stars, radii):
+	r = diagnostics.radii(stars)
+	return np.array([np.mean(r < radius) for radius in radii])
+
+def virial_ratio(stars):
+	return 2*diagnostics.kinetic_energy(stars)/abs(diagnostics.potential_energy(stars, 0., 0.5))
+
+class TestInitialConditions(unittest.TestCase):
+
+	radii = np.array([0.5, 1., 2., 5.])
+
+	def test_plummer_mass_profile(self):
+		stars = ics.plummer(50000, seed = 1)
+		analytic = self.radii**3/(self.radii**2 + 1.)**1.5
+		np.testing.assert_allclose(enclosed_fractions(stars, self.radii), analytic, atol = 0.01)
+
+	def test_hernquist_mass_profile(self):
+		rmax = 100.
+		stars = ics.hernquist(50000, seed = 1)
+		analytic = (self.radii/(self.radii + 1.))**2/(rmax/(rmax + 1.))**2
+		np.testing.assert_allclose(enclosed_fractions(stars, self.radii), analytic, atol = 0.01)
+		self.assertAlmostEqual(np.median(diagnostics.radii(stars)), 1. + np.sqrt(2.), delta = 0.15)
+
+	def test_virial_equilibrium(self):
+		for stars in (ics.plummer(20000, seed = 2), ics.hernquist(20000, seed = 2)):
+			self.assertAlmostEqual(virial_ratio(stars), 1., delta = 0.1)
+
+	def test_centered(self):
+		stars = ics.disk_galaxy(5000, 2000, diskMass = 1., bulgeMass = .3, seed = 3)
+		com, com_vel = diagnostics.center_of_mass(stars)
+		np.testing.assert_allclose(com, 0., atol = 1e-5)
+		np.testing.assert_allclose(com_vel, 0., atol = 1e-5)
+		np.testing.assert_array_equal(stars.IDs, np.arange(7000))
+
+	def test_bulge_needs_mass(self):
+		self.assertRaises(ValueError, ics.disk_galaxy, 2000, 500, seed = 1)
+		self.assertRaises(ValueError, ics.disk_galaxy, 2000, 500, bulgeMass = -1., seed = 1)
+		self.assertEqual(ics.disk_galaxy(2000, seed = 1).nStars, 2000)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,67 @@
+"""
+Tests of the CPU leapfrog backend
+
+Run from the repo folder with: python -m unittest discover tests
+"""
+
+import glob, os, sys, shutil, tempfile, unittest
+from StringIO import StringIO
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ics, nbody, tipsy, timing
+
+class TestNbody(unittest.TestCase):
+
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+		self.snap_prefix = os.path.join(self.folder, 'snap')
+
+	def tearDown(self):
+		shutil.rmtree(self.folder)
+
+	def test_parallel_forces(self):
+		stars = ics.plummer(2000, seed = 6)
+		pos, mass = stars.pos.astype(np.float64), stars.mass.astype(np.float64)
+		acc, pot = nbody.forces(pos, mass, 0.05)
+		parallel_acc, parallel_pot = nbody.forces(pos, mass, 0.05, nProcs = 3)
+		np.testing.assert_allclose(parallel_acc, acc, rtol = 1e-12, atol = 1e-14)
+		np.testing.assert_allclose(parallel_pot, pot, rtol = 1e-12)
+		#same as walking the tree for the particles in their original order
+		tree_pot, tree_acc = nbody.octree.Octree(pos, mass).gravity(None, 0.05)
+		np.testing.assert_allclose(acc, tree_acc, rtol = 1e-12, atol = 1e-14)
+		np.testing.assert_allclose(pot, tree_pot, rtol = 1e-12)
+		self.assertIsNone(nbody.SHARED_TREE)
+
+	def test_circular_orbit(self):
+		#equal masses 1/2 at distance 1: circular speed 1/2 each, period 2 pi
+		stars = tipsy.Stars()
+		stars.add_stars(np.array([0.5, 0.5]), np.array([[0.5, 0., 0.], [-0.5, 0., 0.]]),
+						np.array([[0., 0.5, 0.], [0., -0.5, 0.]]), np.array([0, 1]))
+		stars.trim()
+		start = stars.pos.copy()
+		nbody.leapfrog(stars, 2*np.pi, 2*np.pi/2000, np.pi, 0., self.snap_prefix, theta = 0., nProcs = 1, log = StringIO())
+		self.assertAlmostEqual(stars.time, 2*np.pi, places = 5)
+		np.testing.assert_allclose(stars.pos, start, atol = 1e-3)
+
+	def test_leapfrog_snapshots_and_energy(self):
+		stars = ics.plummer(500, seed = 8)
+		IDs = stars.IDs.copy()
+		log = StringIO()
+		paths = nbody.leapfrog(stars, 0.25, 1./64, 1./16, 0.05, self.snap_prefix, nProcs = 1, log = log)
+		self.assertEqual(paths, [nbody.snapshot_path(self.snap_prefix, t) for t in (0., 0.0625, 0.125, 0.1875, 0.25)])
+		self.assertEqual(sorted(glob.glob(self.snap_prefix + '_*')), paths)
+		last = tipsy.Stars(paths[-1])
+		self.assertEqual(last.time, 0.25)
+		np.testing.assert_array_equal(last.IDs, IDs)
+		np.testing.assert_array_equal(last.pos, stars.pos)
+
+		drift = [float(line.split('dE:')[1].split()[0]) for line in log.getvalue().splitlines() if line.startswith('Iter:')]
+		self.assertEqual(len(drift), 16)
+		self.assertLess(max(abs(dE) for dE in drift), 1e-3)
+		log_file = os.path.join(self.folder, 'run.log')
+		open(log_file, 'w').write(log.getvalue())
+		self.assertEqual([record['iteration'] for record in timing.parse_bonsai_log(log_file)], range(1, 17))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,59 @@
+"""
+Tests of the octree module against direct summation
+
+Run from the repo folder with: python -m unittest discover tests
+"""
+
+import os, sys, unittest
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ics, octree
+
+def direct_sum(pos, mass, eps):
+	"""
+	@returns	(potential (N array), accelerations (Nx3 array), potential energy) by summing all pairs
+	"""
+	dx = pos[None,:,:] - pos[:,None,:]
+	r2 = (dx**2).sum(axis = 2) + eps**2
+	inv_r = 1./np.sqrt(r2)
+	np.fill_diagonal(inv_r, 0.)
+	pot = -(inv_r*mass[None,:]).sum(axis = 1)
+	acc = ((inv_r**3*mass[None,:])[:,:,None]*dx).sum(axis = 1)
+	return pot, acc, 0.5*np.dot(mass, pot)
+
+class TestGravity(unittest.TestCase):
+
+	eps = 0.05
+
+	def setUp(self):
+		stars = ics.plummer(1500, seed = 5)
+		self.pos = stars.pos.astype(np.float64)
+		self.mass = stars.mass.astype(np.float64)
+		self.pot, self.acc, self.energy = direct_sum(self.pos, self.mass, self.eps)
+
+	def test_theta_zero_is_direct_sum(self):
+		for leaf_size in (1, 8):
+			acc, pot = octree.accelerations(self.pos, self.mass, self.eps, theta = 0., leaf_size = leaf_size)
+			np.testing.assert_allclose(pot, self.pot, rtol = 1e-10)
+			np.testing.assert_allclose(acc, self.acc, rtol = 1e-8, atol = 1e-10*np.abs(self.acc).max())
+			energy = octree.potential_energy(self.pos, self.mass, self.eps, theta = 0., leaf_size = leaf_size)
+			self.assertAlmostEqual(energy/self.energy, 1., places = 12)
+
+	def test_targets_and_blocks(self):
+		tree = octree.Octree(self.pos, self.mass)
+		targets = np.array([7, 3, 1200, 3])
+		pot, acc = tree.gravity(targets, self.eps, theta = 0., block = 3)
+		np.testing.assert_allclose(pot, self.pot[targets], rtol = 1e-10)
+		np.testing.assert_allclose(acc, self.acc[targets], rtol = 1e-8)
+
+	def test_opening_angle_accuracy(self):
+		acc, pot = octree.accelerations(self.pos, self.mass, self.eps, theta = 0.6)
+		self.assertLess(np.abs(pot/self.pot - 1.).max(), 1e-2)
+		error = np.sqrt(((acc - self.acc)**2).sum(axis = 1)/(self.acc**2).sum(axis = 1))
+		self.assertLess(np.median(error), 1e-2)
+		energy = octree.potential_energy(self.pos, self.mass, self.eps, theta = 0.6)
+		self.assertLess(abs(energy/self.energy - 1.), 1e-3)
+
+if __name__ == '__main__':
+	unittest.main()
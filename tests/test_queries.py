@@ -0,0 +1,56 @@
+"""
+Tests of the Stars spatial queries (octree index) against brute force
+
+Run from the repo folder with: python -m unittest discover tests
+"""
+
+import os, sys, unittest
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ics
+
+class TestQueries(unittest.TestCase):
+
+	def setUp(self):
+		self.stars = ics.hernquist(3000, rmax = 20., seed = 11)
+		self.pos = self.stars.pos.astype(np.float64)
+		self.rng = np.random.RandomState(3)
+
+	def test_in_box(self):
+		for i in range(20):
+			corners = self.pos[self.rng.randint(0, len(self.pos), 2)]
+			#corners at star positions: stars on the boundary count as inside
+			lower, upper = corners.min(axis = 0), corners.max(axis = 0)
+			expected = np.flatnonzero(np.all((self.pos >= lower) & (self.pos <= upper), axis = 1))
+			np.testing.assert_array_equal(self.stars.in_box(lower, upper), expected)
+		self.assertEqual(len(self.stars.in_box([-1e3]*3, [1e3]*3)), self.stars.nStars)
+		self.assertEqual(len(self.stars.in_box([50.]*3, [60.]*3)), 0)
+
+	def test_in_sphere(self):
+		for radius in (0.01, 0.3, 1., 5., 100.):
+			center = self.pos[self.rng.randint(len(self.pos))] + self.rng.normal(0., 0.1, 3)
+			expected = np.flatnonzero(((self.pos - center)**2).sum(axis = 1) <= radius**2)
+			np.testing.assert_array_equal(self.stars.in_sphere(center, radius), expected)
+
+	def test_nearest(self):
+		points = np.vstack([self.pos[:50], self.rng.normal(0., 3., (50,3))])
+		for k in (1, 7, 40):
+			distances, indices = self.stars.nearest(points, k)
+			d = np.sqrt(((points[:,None,:] - self.pos[None,:,:])**2).sum(axis = 2))
+			expected = np.argsort(d, axis = 1, kind = 'mergesort')[:,:k]
+			np.testing.assert_allclose(distances, np.sort(d, axis = 1)[:,:k], rtol = 1e-12)
+			np.testing.assert_array_equal(indices, expected)
+		#a star finds itself first
+		np.testing.assert_array_equal(self.stars.nearest(self.pos[:50], 1)[1][:,0], np.arange(50))
+
+	def test_index_follows_moves(self):
+		before = self.stars.in_sphere([0., 0., 0.], 1.)
+		self.stars.translate([0.5, 0., 0.])
+		pos = self.stars.pos.astype(np.float64)
+		expected = np.flatnonzero((pos**2).sum(axis = 1) <= 1.)
+		np.testing.assert_array_equal(self.stars.in_sphere([0., 0., 0.], 1.), expected)
+		self.assertFalse(np.array_equal(before, expected))
+
+if __name__ == '__main__':
+	unittest.main()
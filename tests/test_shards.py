@@ -0,0 +1,89 @@
+"""
+Tests of space-filling curve ordering and domain shards
+
+Run from the repo folder with: python -m unittest discover tests
+"""
+
+import os, sys, shutil, tempfile, unittest
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ics, octree, tipsy
+
+class TestCurves(unittest.TestCase):
+
+	def grid(self, n):
+		cells = np.indices((n, n, n)).reshape(3, -1).T
+		return cells, (cells + 0.5)/n
+
+	def test_hilbert_steps_to_neighbours(self):
+		cells, pos = self.grid(16)
+		keys = octree.hilbert_keys(pos, np.zeros(3), 1.)
+		self.assertEqual(len(np.unique(keys)), len(keys))
+		steps = np.abs(np.diff(cells[np.argsort(keys)], axis = 0))
+		np.testing.assert_array_equal(steps.sum(axis = 1), 1)
+
+	def test_curves_fill_octants_in_turn(self):
+		cells, pos = self.grid(8)
+		for keys in (octree.morton_keys(pos, np.zeros(3), 1.), octree.hilbert_keys(pos, np.zeros(3), 1.)):
+			parents = (cells[np.argsort(keys)]//2).reshape(-1, 8, 3)
+			np.testing.assert_array_equal(parents, np.repeat(parents[:,:1], 8, axis = 1))
+
+class TestShards(unittest.TestCase):
+
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+		self.stars = ics.hernquist(1001, seed = 9)
+		#IDs out of order, like a merged run
+		order = np.random.RandomState(1).permutation(self.stars.nStars)
+		stars = tipsy.Stars()
+		stars.add_stars(self.stars.mass[order], self.stars.pos[order], self.stars.vel[order], self.stars.IDs[order])
+		stars.trim()
+		self.stars = stars
+
+	def tearDown(self):
+		shutil.rmtree(self.folder)
+
+	def test_sort_spatial_keeps_stars(self):
+		before = [a.copy() for a in (self.stars.mass, self.stars.pos, self.stars.vel, self.stars.IDs)]
+		order = self.stars.sort_spatial()
+		for array, original in zip((self.stars.mass, self.stars.pos, self.stars.vel, self.stars.IDs), before):
+			np.testing.assert_array_equal(array, original[order])
+		self.assertTrue(np.all(np.diff(octree.hilbert_keys(self.stars.pos).astype(np.float64)) >= 0))
+
+	def test_balanced_shards(self):
+		for nShards in (1, 3, 8):
+			shards = self.stars.shards(nShards)
+			sizes = [len(idx) for idx in shards]
+			self.assertEqual(len(shards), nShards)
+			self.assertLessEqual(max(sizes) - min(sizes), 1)
+			np.testing.assert_array_equal(np.sort(np.concatenate(shards)), np.arange(self.stars.nStars))
+		shards = self.stars.shards(4, weights = 'mass')
+		masses = [self.stars.mass[idx].sum(dtype = np.float64) for idx in shards]
+		self.assertLess(max(masses) - min(masses), 2*self.stars.mass.max())
+
+	def test_write_and_merge_shards(self):
+		prefix = os.path.join(self.folder, 'rank')
+		paths = tipsy.write_shards(self.stars, prefix, 4)
+		self.assertEqual(paths, [prefix + '%i.tipsy' % rank for rank in range(4)])
+		merged = os.path.join(self.folder, 'merged.tipsy')
+		self.assertEqual(tipsy.merge_shards(paths, merged, sort_ids = True), self.stars.nStars)
+
+		header, records = tipsy.read_stars(merged)
+		order = np.argsort(self.stars.IDs)
+		self.assertEqual(header['time'], self.stars.time)
+		np.testing.assert_array_equal(records['phi'], self.stars.IDs[order])
+		np.testing.assert_array_equal(records['mass'], self.stars.mass[order])
+		np.testing.assert_array_equal(records['pos'], self.stars.pos[order])
+		np.testing.assert_array_equal(records['vel'], self.stars.vel[order])
+
+	def test_sort_tipsy(self):
+		path = os.path.join(self.folder, 'ics.tipsy')
+		tipsy.write_stars(path, 0., self.stars.mass, self.stars.pos, self.stars.vel, self.stars.IDs)
+		header, records = tipsy.read_stars(tipsy.sort_tipsy(path, os.path.join(self.folder, 'ics.sorted.tipsy')))
+		self.stars.sort_spatial()
+		np.testing.assert_array_equal(records['phi'], self.stars.IDs)
+		np.testing.assert_array_equal(records['pos'], self.stars.pos)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,53 @@
+"""
+Behaviour tests of the sweep module with a stand-in Bonsai executable (tests/fake_bonsai.py)
+
+Run from the repo folder with: python -m unittest discover tests
+"""
+
+import glob, os, sys, shutil, tempfile, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import sweep
+from test_bonsai import make_bonsai_bin
+
+class TestSweep(unittest.TestCase):
+
+	spec = {'mode':'plummer', 'nParticles':50, 'eps':[0.01, 0.05], 'T':0.125, 'dt':0.0625, 'dSnap':0.0625}
+
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+		self.bonsai_bin = make_bonsai_bin(self.folder)
+		self.out_dir = os.path.join(self.folder, 'sweep')
+
+	def tearDown(self):
+		shutil.rmtree(self.folder)
+
+	def test_make_jobs(self):
+		jobs = sweep.make_jobs(self.spec)
+		self.assertEqual([params['eps'] for name, params in jobs], [0.01, 0.05])
+		self.assertEqual(len(set(name for name, params in jobs)), 2)
+
+	def test_invalid_specs(self):
+		for spec in ({'eps':0.1}, {'mode':'plummer'}, {'mode':'disk', 'nParticles':10},
+					 {'mode':'sphere', 'nParticles':10, 'backend':'gpu'}):
+			self.assertRaises(ValueError, sweep.make_jobs, spec)
+
+	def test_run_and_resume(self):
+		jobs = sweep.Sweep(self.spec, self.out_dir, max_jobs = 2, bonsai_bin = self.bonsai_bin, poll_interval = 0.05).run()
+		self.assertEqual([job['status'] for job in jobs], ['done', 'done'])
+		for job in jobs:
+			snapshots = sorted(glob.glob(os.path.join(self.out_dir, job['name'], 'snap*')))
+			self.assertEqual([os.path.basename(path) for path in snapshots], ['snap_%010.4f' % t for t in (0., 0.0625, 0.125)])
+
+		resumed = sweep.Sweep(self.spec, self.out_dir, bonsai_bin = self.bonsai_bin, poll_interval = 0.05)
+		self.assertEqual([job['status'] for job in resumed.jobs], ['done', 'done'])
+		self.assertEqual([job['start'] for job in resumed.run()], [job['start'] for job in jobs])
+
+	def test_launch_failure(self):
+		missing = os.path.join(self.folder, 'no_such_bonsai')
+		jobs = sweep.Sweep(self.spec, self.out_dir, bonsai_bin = missing, poll_interval = 0.05).run()
+		self.assertEqual([job['status'] for job in jobs], ['error', 'error'])
+		self.assertTrue(all(job.get('error') for job in jobs))
+
+if __name__ == '__main__':
+	unittest.main()
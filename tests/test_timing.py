@@ -0,0 +1,36 @@
+"""
+Behaviour tests of the timing module: Bonsai log parsing and bounded stage records
+
+Run from the repo folder with: python -m unittest discover tests
+"""
+
+import os, sys, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import timing
+
+class TestTiming(unittest.TestCase):
+
+	def test_records_are_capped_but_totals_exact(self):
+		timer = timing.StageTimer(max_records = 10)
+		for i in range(1000):
+			timer.add('decode', 0.5, 100)
+		timer.add('render', 2.)
+		self.assertEqual(len(timer.records), 10)
+		summary = dict((stage['stage'], stage) for stage in timer.summary())
+		self.assertEqual(summary['decode']['count'], 1000)
+		self.assertAlmostEqual(summary['decode']['seconds'], 500.)
+		self.assertAlmostEqual(summary['decode']['items_per_second'], 200.)
+		self.assertEqual([stage['stage'] for stage in timer.summary()], ['decode', 'render'])
+		timer.reset()
+		self.assertEqual((len(timer.records), timer.summary()), (0, []))
+
+	def test_parse_bonsai_log(self):
+		log = 'Iter: 0  t: 0.000000  Total iteration took: 0.5\nIter: 1  t: 0.0625  gravity: 0.25  Total iteration took: 0.5\n'
+		steps = timing.parse_bonsai_log(log, nParticles = 1000)
+		self.assertEqual([step['iteration'] for step in steps], [0, 1])
+		self.assertEqual(steps[1]['force_time'], 0.25)
+		self.assertEqual(steps[1]['particles_per_second'], 2000.)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,98 @@
+"""
+Round trip tests of the trajectory module
+
+Run from the repo folder with: python -m unittest discover tests
+"""
+
+import os, sys, shutil, tempfile, unittest
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ics, tipsy, trajectory
+
+class TestTrajectories(unittest.TestCase):
+
+	nStars = 300
+
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+		self.prefix = os.path.join(self.folder, 'snap_')
+		self.path = os.path.join(self.folder, 'run.traj')
+		self.stars = ics.plummer(self.nStars, seed = 12)
+		#IDs with gaps
+		self.stars.IDs *= 3
+		self.rng = np.random.RandomState(5)
+		#expected (times, pos, vel) in ID order: nStars x frames x 3
+		self.times, self.pos, self.vel = [], [], []
+
+	def tearDown(self):
+		shutil.rmtree(self.folder)
+
+	def write_snapshots(self, count):
+		"""
+		Writes the next count snapshots, each with the stars in a different order
+		"""
+		for k in range(count):
+			step = len(self.times)
+			snap_time = 0.0625*step
+			pos = self.stars.pos + snap_time*self.stars.vel
+			vel = self.stars.vel*(1. + step)
+			order = self.rng.permutation(self.nStars)
+			tipsy.write_stars(self.prefix + '%010.4f' % snap_time, snap_time, self.stars.mass[order], pos[order], vel[order], self.stars.IDs[order])
+			self.times.append(snap_time)
+			self.pos.append(pos.astype(np.float32))
+			self.vel.append(vel.astype(np.float32))
+
+	def expected(self, ids, start = 0, stop = None):
+		rows = np.searchsorted(self.stars.IDs, ids)
+		pos = np.array(self.pos).transpose(1, 0, 2)[rows, start:stop]
+		vel = np.array(self.vel).transpose(1, 0, 2)[rows, start:stop]
+		return pos, vel
+
+	def assertTrajectories(self, store, ids, start = 0, stop = None):
+		pos, vel = store.fetch(ids, start, stop)
+		expected_pos, expected_vel = self.expected(ids, start, stop)
+		np.testing.assert_array_equal(pos, expected_pos)
+		np.testing.assert_array_equal(vel, expected_vel)
+
+	def test_build_and_fetch(self):
+		self.write_snapshots(5)
+		#a buffer of about two frames
+		store = trajectory.build(self.prefix, self.path, memory_MB = 0.01)
+		store.close()
+
+		store = trajectory.Trajectories(self.path)
+		np.testing.assert_array_equal(store.times, self.times)
+		np.testing.assert_array_equal(store.IDs, self.stars.IDs)
+		np.testing.assert_array_equal(store.mass, self.stars.mass)
+		self.assertTrajectories(store, self.stars.IDs)
+		#neighbouring IDs (one read) and scattered IDs (one read per star), in any order
+		self.assertTrajectories(store, self.stars.IDs[[40, 38, 39, 41]])
+		self.assertTrajectories(store, self.stars.IDs[[299, 0, 150, 7]], 1, 4)
+		pos, vel = store.star(self.stars.IDs[10], 2)
+		np.testing.assert_array_equal(pos, self.expected([self.stars.IDs[10]], 2)[0][0])
+		self.assertRaises(Exception, store.fetch, [1])
+
+	def test_incremental_growth(self):
+		self.write_snapshots(2)
+		ids = self.stars.IDs[::7]
+		store = trajectory.build(self.prefix, self.path, ids)
+		self.assertEqual(store.index['capacity'], 2)
+		reader = trajectory.Trajectories(self.path)
+
+		self.write_snapshots(3)
+		self.assertEqual(store.update(self.prefix), 3)
+		self.assertEqual(store.update(self.prefix), 0)
+		self.write_snapshots(1)
+		store.append_file(self.prefix + '%010.4f' % self.times[-1])
+		self.assertGreaterEqual(store.index['capacity'], 6)
+
+		np.testing.assert_array_equal(store.times, self.times)
+		self.assertTrajectories(store, ids)
+		self.assertTrajectories(trajectory.Trajectories(self.path), ids[::-1])
+		#a reader opened before the store grew keeps its frames
+		self.assertTrajectories(reader, ids, 0, 2)
+		self.assertRaises(Exception, store.fetch, self.stars.IDs[1:2])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,257 @@
+## @namespace timing
+#  The timing module records where time goes in a production run: Bonsai's own per-step log and the Python stages
+
+"""
+Timing.py module
+
+Parses Bonsai's output into per-step records and times the Python side stages (tipsy decode/encode,
+rendering, video encoding). Results can be saved as JSON or CSV and summarized in a report.
+
+Project: UC San Diego Physics 241, Winter 2014, Prof. J. Kuti
+"""
+
+import csv, json, os, re, time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+##\short	Regular expression of the line that starts a new time step in Bonsai's output (group 1: iteration)
+STEP_PATTERN = re.compile(r'\bIter(?:ation)?\b\s*[:=]?\s*(\d+)', re.IGNORECASE)
+
+##\short	Regular expression of "label: number" (or "label = number") pairs in Bonsai's output
+VALUE_PATTERN = re.compile(r'([A-Za-z][A-Za-z0-9_ ./()-]*?)\s*[:=]\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)')
+
+##\short	Standard field names and the (lower case) Bonsai labels they are read from
+FIELD_ALIASES = {
+	'time':					['t', 'time', 't_current', 'tcurrent'],
+	'dt':					['dt'],
+	'wall_time':			['total iteration took', 'iteration took', 'total time', 'wall time', 'walltime', 'step time'],
+	'tree_build_time':		['build', 'tree build', 'build tree', 'sort and build', 'tree construction'],
+	'force_time':			['gravity', 'force', 'approx gravity', 'grav', 'compute forces'],
+	'interactions':			['interactions', 'total interactions', 'direct', 'ppi'],
+	'interactions_per_second':	['interactions/s', 'interactions per second', 'int/s'],
+	'particles':			['n', 'nparticles', 'particles', 'ntotal'],
+	'energy':				['etot', 'e'],
+	'energy_error':			['de', 'demax'],
+}
+
+def parse_bonsai_log(log, nParticles = None):
+	"""
+	Parses Bonsai's stdout (or --log output) into one record per time step
+
+	A step starts at a line matching STEP_PATTERN. Within a step every "label: number" pair is kept
+	under its lower case label, and labels listed in FIELD_ALIASES are also stored under the standard
+	field name (wall_time, tree_build_time, force_time, interactions, ...). When they are not printed,
+	interactions_per_second and particles_per_second are derived from wall_time.
+
+	@param[in]	log			path to a log file, or the log text itself
+	@param[in]	nParticles	number of particles, for particles_per_second (default: None, read from the log if printed)
+
+	@returns	list of dictionaries, one per step (key 'iteration' holds the step number)
+	"""
+	text = open(log).read() if os.path.isfile(log) else log
+
+	labels = {}
+	for field, aliases in FIELD_ALIASES.items():
+		for alias in aliases:
+			labels.setdefault(alias, field)
+
+	steps = []
+	for line in text.splitlines():
+		match = STEP_PATTERN.search(line)
+		if match:
+			steps.append({'iteration':int(match.group(1))})
+		if not steps:
+			continue
+		step = steps[-1]
+		for label, value in VALUE_PATTERN.findall(line):
+			label = label.strip().lower()
+			if label in ('iter', 'iteration'):
+				continue
+			value = float(value)
+			step[label] = value
+			field = labels.get(label)
+			if field is not None and field not in step:
+				step[field] = value
+
+	for step in steps:
+		wall_time = step.get('wall_time')
+		if not wall_time:
+			continue
+		if 'interactions_per_second' not in step and 'interactions' in step:
+			step['interactions_per_second'] = step['interactions']/wall_time
+		n = step.get('particles', nParticles)
+		if n:
+			step['particles_per_second'] = n/wall_time
+	return steps
+
+
+class StageTimer(object):
+	"""
+	Collects wall clock timings of named stages
+
+	Use "with TIMER.stage('render', items=nStars): ..." around a stage. Each call is added to running totals
+	per stage (summary()) and kept as a record, but only the last max_records records are kept, so a
+	long-running process or pool worker does not grow without bound. Every process has its own TIMER
+	(worker processes are not merged).
+	"""
+
+	## Most recent records (deque of at most max_records): dictionaries with stage, start, seconds and items
+	records = None
+	## Totals per stage in order of first appearance: stage name to {'count', 'seconds', 'items'}
+	totals = None
+	## Number of individual records kept
+	max_records = 10000
+	## Set to False to stop recording
+	enabled = True
+
+	def __init__(self, max_records = 10000):
+		"""
+		@param[in]	max_records		number of individual records kept (default: 10000)
+
+		@returns	an instance of the StageTimer object (empty)
+		"""
+		self.max_records = max_records
+		self.reset()
+
+	@contextmanager
+	def stage(self, name, items = None):
+		"""
+		Context manager timing one stage
+
+		@param[in]	name	stage name
+		@param[in]	items	number of items processed (e.g. particles), for throughput (default: None)
+		"""
+		start = time.time()
+		try:
+			yield
+		finally:
+			self.add(name, time.time() - start, items, start)
+
+	def add(self, name, seconds, items = None, start = None):
+		"""
+		Records a stage timing measured elsewhere
+
+		@param[in]	name		stage name
+		@param[in]	seconds		wall clock duration
+		@param[in]	items		number of items processed (default: None)
+		@param[in]	start		start time (default: now - seconds)
+
+		@returns	None
+		"""
+		if self.enabled:
+			self.records.append({'stage':name, 'start':time.time() - seconds if start is None else start,
+								 'seconds':seconds, 'items':items})
+			total = self.totals.get(name)
+			if total is None:
+				total = self.totals[name] = {'count':0, 'seconds':0., 'items':0}
+			total['count'] += 1
+			total['seconds'] += seconds
+			total['items'] += items or 0
+
+	def reset(self):
+		"""
+		Forgets all records and totals
+
+		@returns	None
+		"""
+		self.records = deque(maxlen = self.max_records)
+		self.totals = OrderedDict()
+
+	def summary(self):
+		"""
+		Totals per stage, in order of first appearance (all calls, including records no longer kept)
+
+		@returns	list of dictionaries with stage, count, seconds, items, mean and items_per_second
+		"""
+		result = []
+		for name, totals in self.totals.items():
+			total = dict(totals, stage = name)
+			total['mean'] = total['seconds']/total['count']
+			total['items_per_second'] = total['items']/total['seconds'] if total['items'] and total['seconds'] > 0 else None
+			result.append(total)
+		return result
+
+##\short	Module-wide timer used by tipsy and bonsai
+TIMER = StageTimer()
+
+def save_json(path, steps = None, timer = TIMER):
+	"""
+	Saves Bonsai step records and Python stage timings in one JSON file
+
+	@param[in]	path	output file
+	@param[in]	steps	records from parse_bonsai_log() (default: None)
+	@param[in]	timer	StageTimer (default: TIMER)
+
+	@returns	None
+	"""
+	json.dump({'bonsai_steps':steps or [], 'stages':list(timer.records), 'stage_summary':timer.summary()},
+			  open(path,'w'), indent=1, sort_keys=True)
+
+def save_csv(path, records):
+	"""
+	Saves a list of records (step records or StageTimer.records) as CSV, one column per key
+
+	@param[in]	path		output file
+	@param[in]	records		list of dictionaries
+
+	@returns	None
+	"""
+	keys = []
+	for record in records:
+		for key in sorted(record):
+			if key not in keys:
+				keys.append(key)
+	out = open(path,'wb')
+	writer = csv.DictWriter(out, keys)
+	writer.writeheader()
+	writer.writerows(records)
+	out.close()
+
+def report(steps = None, timer = TIMER):
+	"""
+	Text summary of a run: Bonsai step statistics and Python stage totals
+
+	@param[in]	steps	records from parse_bonsai_log() (default: None)
+	@param[in]	timer	StageTimer (default: TIMER)
+
+	@returns	report (string)
+	"""
+	lines = []
+	if steps:
+		lines.append('Bonsai: %i steps' % len(steps))
+		for field in ('wall_time', 'tree_build_time', 'force_time', 'interactions_per_second', 'particles_per_second'):
+			values = [step[field] for step in steps if field in step]
+			if values:
+				lines.append('  %-24s total %12.4g  mean %12.4g  min %12.4g  max %12.4g'
+							 % (field, sum(values), sum(values)/len(values), min(values), max(values)))
+	stages = timer.summary()
+	if stages:
+		lines.append('%-24s %8s %12s %12s %14s' % ('stage', 'count', 'total (s)', 'mean (s)', 'items/s'))
+		for stage in stages:
+			lines.append('%-24s %8i %12.4f %12.4f %14s' % (stage['stage'], stage['count'], stage['seconds'], stage['mean'],
+														 '%.4g' % stage['items_per_second'] if stage['items_per_second'] else '-'))
+	return '\n'.join(lines)
+
+def write_report(out_prefix, log_files = (), nParticles = None, timer = TIMER):
+	"""
+	Parses Bonsai logs and writes "[out_prefix].json", "[out_prefix]_steps.csv", "[out_prefix]_stages.csv"
+	and "[out_prefix].txt" (the report, which is also printed)
+
+	@param[in]	out_prefix	path prefix of the output files
+	@param[in]	log_files	Bonsai output files, e.g. BonsaiRun.log_file or the mpi log files
+	@param[in]	nParticles	number of particles, for particles_per_second (default: None)
+	@param[in]	timer		StageTimer (default: TIMER)
+
+	@returns	list of step records
+	"""
+	steps = []
+	for log_file in log_files:
+		steps += parse_bonsai_log(log_file, nParticles)
+
+	save_json(out_prefix + '.json', steps, timer)
+	save_csv(out_prefix + '_steps.csv', steps)
+	save_csv(out_prefix + '_stages.csv', list(timer.records))
+	text = report(steps, timer)
+	open(out_prefix + '.txt','w').write(text + '\n')
+	print text
+	return steps
@@ -14,28 +14,460 @@ Project: UC San Diego Physics 241, Winter 2014, Prof. J. Kuti
 """
 
 
-import matplotlib
-matplotlib.use('Agg') #allows figures to be generated without $DISPLAY connected (on a remote server)
-
-import struct, glob
-from subprocess import call
-from multiprocessing import Process
+import glob, os, numbers, sys, threading, time, traceback
+from collections import OrderedDict, deque
+from subprocess import call, Popen, PIPE
+from Queue import Queue
+from multiprocessing import Pool, cpu_count
 
 import numpy as np
-from matplotlib import pyplot as plt
-from mpl_toolkits.mplot3d import axes3d
+import octree
+from timing import TIMER
 from math import pi, cos, sin
 
 
+##\short	Byte order of tipsy files written by this module
+##\details	'=' is native (what Bonsai reads and writes), use '>' for standard big-endian tipsy
+TIPSY_BYTEORDER = '='
+
+def header_dtype(byteorder = TIPSY_BYTEORDER):
+	"""
+	Numpy structured dtype of the 32 byte tipsy header
+
+	The C header struct is padded to a multiple of 8 bytes, the padding is kept as an explicit field.
+
+	@param[in]	byteorder	'=' (native), '<' (little-endian) or '>' (big-endian)
+
+	@returns	numpy dtype with fields time, nTot, dim, nGas, nDark, nStar, pad
+	"""
+	return np.dtype([('time',byteorder+'f8'),
+					 ('nTot',byteorder+'i4'),('dim',byteorder+'i4'),
+					 ('nGas',byteorder+'i4'),('nDark',byteorder+'i4'),('nStar',byteorder+'i4'),
+					 ('pad',byteorder+'i4')])
+
+def star_dtype(byteorder = TIPSY_BYTEORDER):
+	"""
+	Numpy structured dtype of one 44 byte tipsy star record (no padding)
+
+	The phi field is used as the particle ID (like Bonsai).
+
+	@param[in]	byteorder	'=' (native), '<' (little-endian) or '>' (big-endian)
+
+	@returns	numpy dtype with fields mass, pos, vel, metals, tform, eps, phi
+	"""
+	return np.dtype([('mass',byteorder+'f4'),
+					 ('pos',byteorder+'f4',(3,)),('vel',byteorder+'f4',(3,)),
+					 ('metals',byteorder+'f4'),('tform',byteorder+'f4'),('eps',byteorder+'f4'),
+					 ('phi',byteorder+'i4')])
+
+def read_header(tfile):
+	"""
+	Reads a tipsy header from an open file, detecting the byte order of the file
+
+	@param[in]	tfile	file object opened in 'rb' mode, positioned at the start of the file
+
+	@returns	(header, byteorder) where header is a numpy record and byteorder is '=' or the swapped order
+	"""
+	raw = tfile.read(header_dtype().itemsize)
+	if len(raw) < header_dtype().itemsize:
+		raise Exception("Error: file too short for a tipsy header")
+
+	byteorder = TIPSY_BYTEORDER
+	header = np.frombuffer(raw,dtype=header_dtype(byteorder))[0]
+	if not 0 < header['dim'] <= 3:
+		#try the other byte order
+		byteorder = '>' if np.little_endian else '<'
+		header = np.frombuffer(raw,dtype=header_dtype(byteorder))[0]
+		if not 0 < header['dim'] <= 3:
+			raise Exception("Error: tipsy header not recognized")
+
+	return header, byteorder
+
+def file_size(header):
+	"""
+	Size in bytes of a complete tipsy file with this header
+
+	Gas (48 byte) and dark matter (36 byte) records are counted too, as written by Bonsai.
+
+	@param[in]	header	numpy record from read_header()
+
+	@returns	number of bytes (int)
+	"""
+	return header_dtype().itemsize + 48*int(header['nGas']) + 36*int(header['nDark']) + star_dtype().itemsize*int(header['nStar'])
+
+def read_stars(tipsyFilePath):
+	"""
+	Reads the header and all star records of a tipsy file in one bulk read
+
+	@param[in]	tipsyFilePath	path to a single .tipsy file
+
+	@returns	(header, records) where records is a structured array of star_dtype()
+	"""
+	tfile = open(tipsyFilePath,'rb')
+	header, byteorder = read_header(tfile)
+
+	if header['dim'] != 3:
+		tfile.close()
+		raise Exception("%iD not supported"%header['dim'])
+
+	with TIMER.stage('tipsy decode', int(header['nStar'])):
+		records = np.fromfile(tfile,dtype=star_dtype(byteorder),count=header['nStar'])
+	tfile.close()
+
+	if records.shape[0] != header['nStar']:
+		raise Exception("Error: %s is truncated (%i of %i stars)" % (tipsyFilePath, records.shape[0], header['nStar']))
+
+	return header, records
+
+def map_stars(tipsyFilePath):
+	"""
+	Memory-maps the star records of a tipsy file (read-only, nothing is read until accessed)
+
+	@param[in]	tipsyFilePath	path to a single .tipsy file
+
+	@returns	(header, records) where records is a read-only numpy.memmap of star_dtype()
+	"""
+	tfile = open(tipsyFilePath,'rb')
+	header, byteorder = read_header(tfile)
+	tfile.close()
+
+	if header['dim'] != 3:
+		raise Exception("%iD not supported"%header['dim'])
+
+	offset = header_dtype().itemsize
+	nStars = int(header['nStar'])
+	if os.path.getsize(tipsyFilePath) < offset + nStars*star_dtype().itemsize:
+		raise Exception("Error: %s is truncated (expected %i stars)" % (tipsyFilePath, nStars))
+
+	if nStars == 0:
+		return header, np.zeros(0,dtype=star_dtype(byteorder))
+
+	records = np.memmap(tipsyFilePath,dtype=star_dtype(byteorder),mode='r',offset=offset,shape=(nStars,))
+	return header, records
+
+def write_stars(tipsyFilePath, time, mass, pos, vel, IDs = None, byteorder = TIPSY_BYTEORDER):
+	"""
+	Writes a tipsy file of stars in one bulk write
+
+	The metals, tform and eps fields are written as zeros.
+
+	@param[in]	tipsyFilePath	path to output file
+	@param[in]	time			simulation time stored in the header
+	@param[in]	mass			(N array) star masses
+	@param[in]	pos				(Nx3 array) star positions
+	@param[in]	vel				(Nx3 array) star velocities
+	@param[in]	IDs				(N array) particle IDs stored in phi (default: 0..N-1)
+	@param[in]	byteorder		'=' (native), '<' (little-endian) or '>' (big-endian)
+
+	@returns	None
+	"""
+	writer = TipsyWriter(tipsyFilePath, time, byteorder)
+	writer.write(mass, pos, vel, IDs)
+	writer.close()
+
+
+class TipsyWriter(object):
+	"""
+	Writes a tipsy file of stars in batches
+
+	The header is written first with a star count of zero and patched by close(), so the total
+	number of stars does not have to be known in advance and only one batch is held in memory.
+	"""
+
+	## Path of the file being written
+	tipsyFilePath = None
+	## Simulation time stored in the header
+	time = 0.0
+	## Byte order of the file
+	byteorder = TIPSY_BYTEORDER
+	## Number of stars written so far
+	nStars = 0
+
+	def __init__(self, tipsyFilePath, time = 0.0, byteorder = TIPSY_BYTEORDER):
+		"""
+		Opens a tipsy file for writing and writes a placeholder header
+
+		@param[in]	tipsyFilePath	path to output file
+		@param[in]	time			simulation time stored in the header
+		@param[in]	byteorder		'=' (native), '<' (little-endian) or '>' (big-endian)
+
+		@returns	an instance of the TipsyWriter object
+		"""
+		self.tipsyFilePath = tipsyFilePath
+		self.time = time
+		self.byteorder = byteorder
+		self.nStars = 0
+		self.tfile = open(tipsyFilePath,'wb')
+		self.write_header()
+
+	def write_header(self):
+		"""
+		(Re)writes the header with the current star count, leaving the file position at the end of the file
+
+		@returns	None
+		"""
+		header = np.zeros(1,dtype=header_dtype(self.byteorder))
+		header['time'] = self.time
+		header['nTot'] = self.nStars
+		header['dim'] = 3
+		header['nStar'] = self.nStars
+
+		self.tfile.seek(0)
+		header.tofile(self.tfile)
+		self.tfile.seek(0,2)
+
+	def write(self, mass, pos, vel, IDs = None):
+		"""
+		Appends a batch of stars (metals, tform and eps are written as zeros)
+
+		@param[in]	mass	(N array) star masses
+		@param[in]	pos		(Nx3 array) star positions
+		@param[in]	vel		(Nx3 array) star velocities
+		@param[in]	IDs		(N array) particle IDs stored in phi (default: continue counting from nStars)
+
+		@returns	None
+		"""
+		nStars = len(mass)
+
+		with TIMER.stage('tipsy encode', nStars):
+			records = np.zeros(nStars,dtype=star_dtype(self.byteorder))
+			records['mass'] = mass
+			records['pos'] = pos
+			records['vel'] = vel
+			records['phi'] = self.nStars + np.arange(nStars) if IDs is None else IDs
+
+			records.tofile(self.tfile)
+		self.nStars += nStars
+
+	def write_records(self, records):
+		"""
+		Appends a structured array of star records as they are (converted to the byte order of the file)
+
+		@param[in]	records		structured array of star_dtype()
+
+		@returns	None
+		"""
+		records.astype(star_dtype(self.byteorder)).tofile(self.tfile)
+		self.nStars += len(records)
+
+	def close(self):
+		"""
+		Writes the final star count into the header and closes the file
+
+		@returns	None
+		"""
+		self.write_header()
+		self.tfile.close()
+
+
+def pyplot():
+	"""
+	Imports matplotlib.pyplot the first time a figure is drawn, so reading, converting and transforming
+	stars (and worker processes that only do that) never load matplotlib
+
+	Selects the Agg backend, which allows figures to be generated without $DISPLAY connected (on a remote
+	server), unless pyplot was already imported (e.g. in a notebook).
+
+	@returns	the matplotlib.pyplot module
+	"""
+	if 'matplotlib.pyplot' not in sys.modules:
+		import matplotlib
+		matplotlib.use('Agg')
+	from matplotlib import pyplot as plt
+	return plt
+
+def camera_matrix(elevAng = 45, rotAng = 0):
+	"""
+	Rotation matrix of the mplot3d camera used by Stars.save_figure()
+
+	Rows are the screen right and up directions and the direction towards the camera,
+	so pos.dot(camera_matrix(...).T) gives (x, y, depth) screen coordinates.
+
+	@param[in]	elevAng		camera view elevation in degrees from x-y plane
+	@param[in]	rotAng		camera view rotation in degrees about z-axis
+
+	@returns	3x3 numpy array
+	"""
+	elev = elevAng*pi/180.
+	azim = rotAng*pi/180.
+	return np.array([[-sin(azim), cos(azim), 0.],
+					 [-sin(elev)*cos(azim), -sin(elev)*sin(azim), cos(elev)],
+					 [cos(elev)*cos(azim), cos(elev)*sin(azim), sin(elev)]])
+
+def camera_matrices(cameras, spin = 0.):
+	"""
+	Stacked camera_matrix() rotations of several cameras
+
+	@param[in]	cameras		list of (elevAng, rotAng) pairs in degrees
+	@param[in]	spin		degrees added to every rotAng, e.g. frame index times degrees per frame (default: 0)
+
+	@returns	(C x 3 x 3) numpy array
+	"""
+	cameras = np.asarray(cameras, dtype = np.float64).reshape(-1, 2)
+	elev = cameras[:,0]*pi/180.
+	azim = (cameras[:,1] + spin)*pi/180.
+	zero = np.zeros(len(cameras))
+	return np.array([[-np.sin(azim), np.cos(azim), zero],
+					 [-np.sin(elev)*np.cos(azim), -np.sin(elev)*np.sin(azim), np.cos(elev)],
+					 [np.cos(elev)*np.cos(azim), np.cos(elev)*np.sin(azim), np.sin(elev)]]).transpose(2, 0, 1)
+
+def compose_panels(images, columns = None):
+	"""
+	Tiles equally sized images into one panel image (row by row, unused tiles are white)
+
+	@param[in]	images		list of (size x size x 3) uint8 arrays, e.g. from Stars.rasterize_views()
+	@param[in]	columns		number of panels per row (default: None, all in one row)
+
+	@returns	(rows*size x columns*size x 3) uint8 numpy array
+	"""
+	if columns is None:
+		columns = len(images)
+	rows = (len(images) + columns - 1)//columns
+	height, width = images[0].shape[:2]
+	panels = np.full((rows*height, columns*width, 3), 255, dtype = np.uint8)
+	for k, image in enumerate(images):
+		row, col = divmod(k, columns)
+		panels[row*height:(row + 1)*height, col*width:(col + 1)*width] = image
+	return panels
+
+
+def euler_matrix(phi, theta, psi):
+	"""
+	Active rotation matrix for Euler angles in radians (http://mathworld.wolfram.com/EulerAngles.html)
+
+	See Stars.rotate_euler().
+
+	@param[in]	phi		(radians) right hand rotation about +Z axis
+	@param[in]	theta	(radians) right hand roation about resultant +X axis
+	@param[in]	psi		(radians) right hand rotation about resultant +Z axis
+
+	@returns	3x3 numpy array
+	"""
+	phi = -phi
+	theta = -theta
+	psi = -psi
+
+	a = np.zeros((3,3))
+	a[0,0]	=	cos(psi)*cos(phi)-cos(theta)*sin(phi)*sin(psi)
+	a[0,1]	=	cos(psi)*sin(phi)+cos(theta)*cos(phi)*sin(psi)
+	a[0,2]	=	sin(psi)*sin(theta)
+	a[1,0]	=	-sin(psi)*cos(phi)-cos(theta)*sin(phi)*cos(psi)
+	a[1,1]	=	-sin(psi)*sin(phi)+cos(theta)*cos(phi)*cos(psi)
+	a[1,2]	=	cos(psi)*sin(theta)
+	a[2,0]	=	sin(theta)*sin(phi)
+	a[2,1]	=	-sin(theta)*cos(phi)
+	a[2,2]	=	cos(theta)
+	return a
+
+
+class Transform(object):
+	"""
+	A rigid motion of a set of stars: rotation, translation and boost composed into one affine operation
+
+	pos -> rotation.pos + displacement, vel -> rotation.vel + velocity
+
+	The methods return a new Transform with the step appended, so steps can be chained in the order they
+	are applied, e.g. Transform().rotate_euler_deg(0,30,0).translate((2,0,0)).boost((-.5,0,0)),
+	then applied once with Stars.transform().
+	"""
+
+	## 3x3 rotation matrix applied to positions and velocities
+	rotation = None
+	## Displacement added to positions (after the rotation)
+	displacement = None
+	## Velocity added to velocities (after the rotation)
+	velocity = None
+
+	def __init__(self, rotation = None, displacement = (0.,0.,0.), velocity = (0.,0.,0.)):
+		"""
+		Constructs a Transform (the identity by default)
+
+		@param[in]	rotation		3x3 rotation matrix (default: identity)
+		@param[in]	displacement	position offset 3-vector (default: 0)
+		@param[in]	velocity		velocity offset 3-vector (default: 0)
+
+		@returns	an instance of the Transform object
+		"""
+		self.rotation = np.identity(3) if rotation is None else np.array(rotation, dtype=np.float64)
+		self.displacement = np.array(displacement, dtype=np.float64)
+		self.velocity = np.array(velocity, dtype=np.float64)
+
+	def then(self, other):
+		"""
+		Composes this transform with another one applied after it
+
+		@param[in]	other	Transform applied second
+
+		@returns	new Transform
+		"""
+		return Transform(other.rotation.dot(self.rotation),
+						 other.rotation.dot(self.displacement) + other.displacement,
+						 other.rotation.dot(self.velocity) + other.velocity)
+
+	def translate(self, displacement):
+		"""
+		@param[in]	displacement	vector added to all positions
+
+		@returns	new Transform (see Stars.translate())
+		"""
+		return self.then(Transform(displacement = displacement))
+
+	def boost(self, velocity):
+		"""
+		@param[in]	velocity	vector added to all velocities
+
+		@returns	new Transform (see Stars.boost())
+		"""
+		return self.then(Transform(velocity = velocity))
+
+	def rotate_euler(self, phi, theta, psi):
+		"""
+		@param[in]	phi, theta, psi		Euler angles in radians
+
+		@returns	new Transform (see Stars.rotate_euler())
+		"""
+		return self.then(Transform(rotation = euler_matrix(phi, theta, psi)))
+
+	def rotate_euler_deg(self, phi, theta, psi):
+		"""
+		@param[in]	phi, theta, psi		Euler angles in degrees
+
+		@returns	new Transform (see Stars.rotate_euler_deg())
+		"""
+		return self.rotate_euler(phi*pi/180., theta*pi/180., psi*pi/180.)
+
+	def apply(self, pos, vel, mask = None):
+		"""
+		Transforms position and velocity arrays in place
+
+		@param[in,out]	pos		Nx3 positions
+		@param[in,out]	vel		Nx3 velocities
+		@param[in]		mask	(bool or index array) only transform these rows (default: None, all rows)
+
+		@returns	None
+		"""
+		if mask is None:
+			pos[:] = pos.dot(self.rotation.T) + self.displacement
+			vel[:] = vel.dot(self.rotation.T) + self.velocity
+		else:
+			pos[mask] = pos[mask].dot(self.rotation.T) + self.displacement
+			vel[mask] = vel[mask].dot(self.rotation.T) + self.velocity
+
+
 class Stars(object):
 	""" 
 	The Stars object holds mass, position, velocity, and particle IDs extracted	from a .tipsy file.
 
 	Currently on stars are processed (gas and dark matter ignored). Also, the phi parameter is used as a particle ID (like Bonsai).
 
-	@todo: The "IDs" argument int Stars.save_figure() is handy, but since Bonsai re-sorts particles at runtime, the IDs become out of order.
-	This causes the save_figure() funtion to have to sort them before selecting the proper particles. It would be nice if we added a
-	member function that returned the indexes within the tipsy file that match given IDs.
+	Since Bonsai re-sorts particles at runtime, the IDs are out of order in its snapshots. Use indices_of() or select()
+	to find particles by ID, they share an ID index that is built once per Stars object.
+
+	Region and neighbour queries (in_box(), in_sphere(), nearest(), local_density()) share an octree over pos that is
+	built on first use and rebuilt after translate(), rotate_euler() or transform() move the stars.
+
+	sort_spatial() reorders the stars along a Hilbert (or Morton) curve for memory locality, shards() cuts that curve into
+	balanced, spatially compact pieces (see write_shards() and merge_shards() for per-rank files).
 	"""
 
 	## Simulation timestamp (carried over from .tipsy file)
@@ -46,54 +478,90 @@ class Stars(object):
 	pos = None
 	## Array of star velocities
 	vel = None
-	## Array of star id numbers
+	## Array of star id numbers (integers)
 	IDs = None
 	## Number of stars stored in this object
 	nStars = 0
-
-	def __init__(self,tipsyFilePath):
+	## True while mass, pos, vel and IDs are read-only views of a memory-mapped file
+	mmap = False
+	## Arrays (mass, pos, vel, IDs) with spare capacity that back the public arrays while stars are added
+	buffers = None
+	## The public arrays as last handed out from buffers (used to detect arrays replaced by other code)
+	views = None
+	## Cached ID index: (IDs array it was built from, smallest ID, lookup table, None) or (IDs array, None, sort order, sorted IDs)
+	id_index = None
+	## Cached spatial index: (pos array it was built from, octree.Octree), dropped when positions change
+	spatial_index = None
+
+	def __init__(self,tipsyFilePath = None, mmap = False):
 		"""
 		Constructs Stars object from a .tipsy file.
 
 		Converts from binary .tipsy format to a python object
 
-		@param[in] tipsyFilePath	path to a single .tipsy file
+		Without a file an empty Stars object (time 0) is created, fill it with add_stars().
 
-		@returns	an instance of the Stars object
-		"""
-
-		tfile = open(tipsyFilePath,'rb')
+		With mmap = True nothing is copied: mass, pos, vel and IDs are read-only strided views of the
+		memory-mapped star records (IDs are the int32 phi column), so only the pages that are accessed get read.
+		The arrays are copied into memory the first time a method that modifies them is called (see detach()).
 
+		@param[in] tipsyFilePath	path to a single .tipsy file (default: None, no stars)
+		@param[in] mmap				memory-map the file instead of loading it (default: False)
 
-		#get time
-		self.time, = struct.unpack('d',tfile.read(8)) #one double (the trailing ',' makes self.time a number rather than a tuple
+		@returns	an instance of the Stars object
+		"""
 
-		
-		#get number of each particle
-		#nTot,nDim,nGas,nDark,nStar = struct.unpack('iiiii',tfile.read(20))
-		nTot,dim,nGas,nDark,self.nStars,temp = struct.unpack('iiiiii',tfile.read(24)) #c structures pad to multiple of 8 bytes?
-		#print self.time
-		print 'Loading Header (%s)... time:%f, nTot:%i, nStar:%i' % (tipsyFilePath, self.time, nTot, self.nStars)
+		if tipsyFilePath is None:
+			self.time = 0.0
+			self.nStars = 0
+			self.mass = np.zeros((0,),dtype=np.float32)
+			self.pos = np.zeros((0,3),dtype=np.float32)
+			self.vel = np.zeros((0,3),dtype=np.float32)
+			self.IDs = np.zeros((0,),dtype=np.int64)
+			return
+
+		if mmap:
+			header, records = map_stars(tipsyFilePath)
+			self.time = float(header['time'])
+			self.nStars = int(header['nStar'])
+			print 'Mapping Header (%s)... time:%f, nTot:%i, nStar:%i' % (tipsyFilePath, self.time, header['nTot'], self.nStars)
+
+			self.mass = records['mass']
+			self.pos = records['pos']
+			self.vel = records['vel']
+			self.IDs = records['phi']
+			self.mmap = True
+			return
+
+		header, records = read_stars(tipsyFilePath)
+
+		self.time = float(header['time'])
+		self.nStars = int(header['nStar'])
+		print 'Loading Header (%s)... time:%f, nTot:%i, nStar:%i' % (tipsyFilePath, self.time, header['nTot'], self.nStars)
+
+		#copy columns out of the records (contiguous arrays in native byte order)
+		self.mass = records['mass'].astype(np.float32)
+		self.pos = records['pos'].astype(np.float32)
+		self.vel = records['vel'].astype(np.float32)
+		self.IDs = records['phi'].astype(np.int64)
+		# self.metals = records['metals'].astype(np.float32)
+
+	def detach(self):
+		"""
+		Copies memory-mapped arrays into memory so they can be modified (copy-on-write)
 
-		#pass the file pointer to this function for each particle
-		self.mass = np.zeros((self.nStars),dtype=np.float32)
-		self.pos = np.zeros((self.nStars,dim),dtype=np.float32)
-		self.vel = np.zeros((self.nStars,dim),dtype=np.float32)
-		self.IDs = np.zeros((self.nStars),dtype=np.float32)
-		# self.metals = np.zeros((self.nStars),dtype=np.float32)
+		Called by every method that modifies the stars, does nothing if the object is not memory-mapped.
 
-		if dim == 3:
-			#3D
-			for i in range(self.nStars):
-				mass,x1,x2,x3,v1,v2,v3,metals,tform_IGNORED,eps_IGNORED,phi_ID = struct.unpack('f3f3f3fi',tfile.read(44))
-				self.pos[i,:] = (x1,x2,x3)
-				self.vel[i,:] = (v1,v2,v3)
-				self.mass[i] = mass
-				# self.metals[i] = metals
-				self.IDs[i] = phi_ID
+		@returns	None
+		"""
+		if not self.mmap:
+			return
 
-		else:
-			raise Exception("%iD not supported"%dim)
+		self.mass = self.mass.astype(np.float32)
+		self.pos = self.pos.astype(np.float32)
+		self.vel = self.vel.astype(np.float32)
+		self.IDs = self.IDs.astype(np.int64)
+		self.mmap = False
 
 	# Probably doesn't work right, taken out
 	# def scale(self,factor, invarient = True):
@@ -124,18 +592,270 @@ class Stars(object):
 		@returns	None
 		"""
 
-		#make room
-		self.mass.resize((self.nStars+1,))
-		self.pos.resize((self.nStars+1,3))
-		self.vel.resize((self.nStars+1,3))
+		self.add_stars([mass],[pos],[vel])
+
+	def add_stars(self, mass, pos, vel, IDs = None):
+		"""
+		Add many stars to the collection
+
+		Storage grows by doubling, so adding N stars one at a time or in batches costs O(N) copying.
+		The spare capacity is released by trim() (called by save_tipsy()).
 
-		#save values
-		self.mass[self.nStars] = mass
-		self.pos[self.nStars,:] = pos
-		self.vel[self.nStars,:] = vel
+		@param[in]	mass	(N array) particle masses
+		@param[in]	pos		(Nx3 array) particle positions
+		@param[in]	vel		(Nx3 array) particle velocities
+		@param[in]	IDs		(N array) particle IDs (default: continue counting from Stars.nStars)
+
+		@returns	None
+		"""
+
+		mass = np.atleast_1d(mass)
+		nStars_added = len(mass)
+		if IDs is None:
+			IDs = self.nStars + np.arange(nStars_added)
+
+		self.reserve(self.nStars + nStars_added)
+		start = self.nStars
+		self.nStars += nStars_added
+		self.set_views()
+
+		self.spatial_index = None
+		self.mass[start:] = mass
+		self.pos[start:] = np.reshape(pos,(nStars_added,3))
+		self.vel[start:] = np.reshape(vel,(nStars_added,3))
+		self.IDs[start:] = IDs
+
+	def reserve(self, nStars):
+		"""
+		Makes room for at least nStars stars (at least doubling the storage when it has to grow)
+
+		@param[in]	nStars	total number of stars to make room for
+
+		@returns	None
+		"""
+
+		self.detach()
+		arrays = (self.mass, self.pos, self.vel, self.IDs)
+		if self.buffers is not None and all(a is b for a, b in zip(arrays, self.views)) and nStars <= len(self.buffers[0]):
+			return
+
+		capacity = max(nStars, 2*self.nStars)
+		self.buffers = tuple(np.zeros((capacity,)+a.shape[1:],dtype=a.dtype) for a in arrays)
+		for buf, a in zip(self.buffers, arrays):
+			buf[:self.nStars] = a[:self.nStars]
+		self.set_views()
+
+	def set_views(self):
+		"""
+		Points mass, pos, vel and IDs at the first nStars entries of the buffers
+
+		@returns	None
+		"""
+		self.mass, self.pos, self.vel, self.IDs = [buf[:self.nStars] for buf in self.buffers]
+		self.views = (self.mass, self.pos, self.vel, self.IDs)
+
+	def trim(self):
+		"""
+		Releases the spare capacity left by add_stars()
+
+		@returns	None
+		"""
+		if self.buffers is None:
+			return
+		self.mass, self.pos, self.vel, self.IDs = [a.copy() for a in (self.mass, self.pos, self.vel, self.IDs)]
+		self.buffers = None
+		self.views = None
+
+	def indices_of(self, ids):
+		"""
+		Returns the array indexes of the stars with the given particle IDs
+
+		The ID index is built on first use (a lookup table when the IDs are dense, otherwise a sort order
+		searched with np.searchsorted) and reused until the IDs array is replaced, e.g. by add_stars().
+
+		@param[in]	ids		particle ID or array of particle IDs
+
+		@returns	index array (same shape as ids) into mass, pos, vel and IDs
+		"""
+
+		ids = np.asarray(ids, dtype=np.int64)
+		if self.id_index is None or self.id_index[0] is not self.IDs:
+			self.build_id_index()
+		source, first, table, sorted_ids = self.id_index
+
+		if len(table) == 0:
+			idx = np.full(ids.shape, -1, dtype=np.int64)
+		elif sorted_ids is None:
+			#lookup table
+			offset = np.clip(ids - first, 0, len(table)-1)
+			idx = np.where(ids - first == offset, table[offset], -1)
+		else:
+			#sort order
+			pos = np.clip(np.searchsorted(sorted_ids, ids), 0, len(sorted_ids)-1)
+			idx = np.where(sorted_ids[pos] == ids, table[pos], -1)
+
+		if np.any(idx < 0):
+			raise Exception("Error: particle IDs not found: %s" % ids[idx < 0][:10])
+		return idx
+
+	def build_id_index(self):
+		"""
+		Builds the ID index used by indices_of()
+
+		@returns	None
+		"""
+
+		IDs = np.asarray(self.IDs).astype(np.int64)
+		if len(IDs) and IDs.max() - IDs.min() < 4*len(IDs) + 1024:
+			#dense IDs: lookup table from ID - first to index
+			first = int(IDs.min())
+			table = np.full(int(IDs.max()) - first + 1, -1, dtype=np.int64)
+			table[IDs - first] = np.arange(len(IDs))
+			self.id_index = (self.IDs, first, table, None)
+		else:
+			#sparse IDs: sort order and sorted IDs for np.searchsorted
+			order = np.argsort(IDs, kind='mergesort')
+			self.id_index = (self.IDs, None, order, IDs[order])
+
+	def select(self, ids):
+		"""
+		Returns a new Stars object holding copies of the stars with the given particle IDs (in the order of ids)
 
-		#increment star count
-		self.nStars +=1
+		@param[in]	ids		array of particle IDs
+
+		@returns	a Stars object
+		"""
+
+		idx = self.indices_of(np.atleast_1d(ids))
+		selected = Stars()
+		selected.time = self.time
+		selected.add_stars(self.mass[idx], self.pos[idx], self.vel[idx], self.IDs[idx])
+		return selected
+
+	def spatial_tree(self):
+		"""
+		Returns the octree over the star positions, building it if there is none or the stars moved
+
+		@returns	an octree.Octree
+		"""
+		if self.spatial_index is None or self.spatial_index[0] is not self.pos:
+			start = time.time()
+			self.spatial_index = (self.pos, octree.Octree(self.pos, self.mass))
+			TIMER.add('spatial index', time.time() - start, self.nStars)
+		return self.spatial_index[1]
+
+	def in_box(self, lower, upper):
+		"""
+		Indices of the stars inside an axis aligned box
+
+		@param[in]	lower	(3-vector) lower corner
+		@param[in]	upper	(3-vector) upper corner
+
+		@returns	sorted index array into mass, pos, vel and IDs (use self.IDs[...] for particle IDs)
+		"""
+		return self.spatial_tree().in_box(lower, upper)
+
+	def in_sphere(self, center, radius):
+		"""
+		Indices of the stars within radius of center
+
+		@param[in]	center	(3-vector) center of the sphere
+		@param[in]	radius	radius of the sphere
+
+		@returns	sorted index array into mass, pos, vel and IDs
+		"""
+		return self.spatial_tree().in_sphere(center, radius)
+
+	def nearest(self, points, k = 1):
+		"""
+		The k stars nearest to each point
+
+		@param[in]	points	(Mx3 array) positions (a star's own position finds the star itself first)
+		@param[in]	k		number of neighbours (default: 1)
+
+		@returns	(distances (Mxk array, ascending), indices into mass, pos, vel and IDs (Mxk array))
+		"""
+		return self.spatial_tree().nearest(points, k)
+
+	def local_density(self, k = 32):
+		"""
+		Mass density at each star estimated from its k nearest neighbours (itself included)
+
+		The result can be passed to save_figure(colors = ...), or use colors = 'density' there.
+
+		@param[in]	k	number of neighbours (default: 32)
+
+		@returns	(array) density per star
+		"""
+		start = time.time()
+		density = self.spatial_tree().knn_density(min(k, self.nStars))
+		TIMER.add('knn density', time.time() - start, self.nStars)
+		return density
+
+	def color_values(self, colors, selected):
+		"""
+		Values for coloring stars, scaled to [0, 1] (1st to 99th percentile)
+
+		@param[in]	colors		'density' (log10 of local_density()) or an array with one value per star
+		@param[in]	selected	index array or slice of the stars drawn
+
+		@returns	(array) values of the selected stars
+		"""
+		if isinstance(colors, str):
+			if colors != 'density':
+				raise Exception("Error: colors '%s' is not known (use 'density' or an array)." % colors)
+			values = np.log10(self.local_density())
+		else:
+			values = np.asarray(colors, dtype = np.float64)
+			if len(values) != self.nStars:
+				raise Exception("Error: %i color values for %i stars" % (len(values), self.nStars))
+		values = values[selected]
+		finite = np.isfinite(values)
+		if not finite.any():
+			return np.zeros(len(values))
+		low, high = np.percentile(values[finite], [1, 99])
+		scale = high - low if high > low else 1.
+		return np.clip(np.where(finite, values, high) - low, 0, scale)/scale
+
+	def sort_spatial(self, curve = 'hilbert'):
+		"""
+		Reorders the stars along a space-filling curve (particle IDs move with their stars)
+
+		Stars that are close in the arrays are then close in space, which makes rendering, neighbour
+		queries and Bonsai's domain decomposition access memory more locally.
+
+		@param[in]	curve	'hilbert' (Peano-Hilbert) or 'morton' (default: 'hilbert')
+
+		@returns	the permutation that was applied (new star i is old star order[i])
+		"""
+		order = np.argsort(octree.curve_keys(self.pos, curve), kind = 'mergesort')
+		self.detach()
+		self.trim()
+		self.mass, self.pos, self.vel, self.IDs = [a[order] for a in (self.mass, self.pos, self.vel, self.IDs)]
+		self.spatial_index = None
+		return order
+
+	def shards(self, nShards, curve = 'hilbert', weights = None):
+		"""
+		Splits the stars into spatially compact pieces of (nearly) equal weight
+
+		Each piece is a contiguous stretch of the space-filling curve.
+
+		@param[in]	nShards		number of pieces (e.g. mpi_n)
+		@param[in]	curve		'hilbert' or 'morton' (default: 'hilbert')
+		@param[in]	weights		None (equal numbers of stars), 'mass', or one weight per star, e.g. a cost estimate
+
+		@returns	list of nShards index arrays into mass, pos, vel and IDs
+		"""
+		order = np.argsort(octree.curve_keys(self.pos, curve), kind = 'mergesort')
+		if weights is None:
+			cumulative = np.arange(1, self.nStars + 1, dtype = np.float64)
+		else:
+			w = self.mass if isinstance(weights, str) and weights == 'mass' else np.asarray(weights)
+			cumulative = np.cumsum(np.asarray(w, dtype = np.float64)[order])
+		total = cumulative[-1] if len(cumulative) else 0.
+		cuts = np.searchsorted(cumulative, total*np.arange(1, nShards)/float(nShards), 'right')
+		return np.split(order, cuts)
 
 	def boost(self, velocity):
 		"""
@@ -148,10 +868,8 @@ class Stars(object):
 		@returns	None
 		"""
 
-		velocity = np.array(velocity)
-
-		for i in range(self.nStars):
-			self.vel[i] += velocity
+		self.detach()
+		self.vel += np.array(velocity)
 
 
 	def translate(self,displacement):
@@ -165,10 +883,9 @@ class Stars(object):
 		@returns	None
 		"""
 
-		displacement = np.array(displacement)
-
-		for i in range(self.nStars):
-			self.pos[i] += displacement
+		self.detach()
+		self.pos += np.array(displacement)
+		self.spatial_index = None
 
 
 	def rotate_euler_deg(self, phi, theta, psi):
@@ -201,24 +918,26 @@ class Stars(object):
 		@returns	None
 		"""
 
-		phi = -phi
-		theta = -theta
-		psi = -psi
+		self.detach()
 
-		a = np.zeros((3,3))
-		a[0,0]	=	cos(psi)*cos(phi)-cos(theta)*sin(phi)*sin(psi)	
-		a[0,1]	=	cos(psi)*sin(phi)+cos(theta)*cos(phi)*sin(psi)	
-		a[0,2]	=	sin(psi)*sin(theta)	
-		a[1,0]	=	-sin(psi)*cos(phi)-cos(theta)*sin(phi)*cos(psi)	
-		a[1,1]	=	-sin(psi)*sin(phi)+cos(theta)*cos(phi)*cos(psi)	
-		a[1,2]	=	cos(psi)*sin(theta)	
-		a[2,0]	=	sin(theta)*sin(phi)	
-		a[2,1]	=	-sin(theta)*cos(phi)	
-		a[2,2]	=	cos(theta)
+		a = euler_matrix(phi, theta, psi)
+		self.pos[:] = self.pos.dot(a.T)
+		self.vel[:] = self.vel.dot(a.T)
+		self.spatial_index = None
 
-		for i in range(self.nStars):
-			self.pos[i] = a.dot(self.pos[i])
-			self.vel[i] = a.dot(self.vel[i])
+	def transform(self, transform, IDs = None):
+		"""
+		Applies a (composed) Transform to all stars in a single pass over pos and vel
+
+		@param[in]	transform	a Transform object
+		@param[in]	IDs			(int array) only transform the stars with these particle IDs (default: None, all stars)
+
+		@returns	None
+		"""
+
+		self.detach()
+		transform.apply(self.pos, self.vel, None if IDs is None else self.indices_of(IDs))
+		self.spatial_index = None
 
 	def append(self,tipsyFilePath):
 		"""
@@ -231,34 +950,12 @@ class Stars(object):
 		@returns	None
 		"""
 
-		tfile = open(tipsyFilePath,'rb')
-		#get time
-		time, = struct.unpack('d',tfile.read(8)) #one double (the trailing ',' makes self.time a number rather than a tuple
-
-		#get number of each particle
-		#nTot,nDim,nGas,nDark,nStar = struct.unpack('iiiii',tfile.read(20))
-		nTot,dim,nGas,nDark,nStars_added,temp = struct.unpack('iiiiii',tfile.read(24)) #c structures pad to multiple of 8 bytes?
-		#print self.time
-		print 'Loading Header (%s)... time:%f, nTot:%i, nStar:%i' % (tipsyFilePath, time, nTot, nStars_added)
-
-		#pass the file pointer to this function for each particle
-		self.mass.resize((self.nStars+nStars_added,)) #= np.zeros((self.nStars),dtype=np.float32)
-		self.pos.resize((self.nStars+nStars_added,dim)) #= np.zeros((self.nStars,dim),dtype=np.float32)
-		self.vel.resize((self.nStars+nStars_added,dim)) #= np.zeros((self.nStars,dim),dtype=np.float32)
-		self.IDs.resize((self.nStars+nStars_added,))  #= np.zeros((self.nStars),dtype=np.float32)
-
-		if dim == 3:
-			#3D
-			for i in range(self.nStars, self.nStars+nStars_added):
-				mass,x1,x2,x3,v1,v2,v3,metals,tform_IGNORED,eps_IGNORED,phi_ID = struct.unpack('f3f3f3fi',tfile.read(44))
-				self.pos[i,:] = (x1,x2,x3)
-				self.vel[i,:] = (v1,v2,v3)
-				self.mass[i] = mass
-				self.IDs[i] = self.nStars+phi_ID
-
-			self.nStars += nStars_added
-		else:
-			raise Exception("%iD not supported"%dim)
+		self.detach()
+		header, records = read_stars(tipsyFilePath)
+		nStars_added = int(header['nStar'])
+		print 'Loading Header (%s)... time:%f, nTot:%i, nStar:%i' % (tipsyFilePath, header['time'], header['nTot'], nStars_added)
+
+		self.add_stars(records['mass'],records['pos'],records['vel'],self.nStars+records['phi'])
 
 	def save_tipsy(self,tipsyFilePath):
 		"""
@@ -271,25 +968,187 @@ class Stars(object):
 		@returns	None
 		"""
 		print "Writing..."
-		tfile = open(tipsyFilePath,'wb')
+		self.trim()
+		write_stars(tipsyFilePath,self.time,self.mass,self.pos,self.vel)
 
-		#time first
-		tfile.write(struct.pack('d',self.time)) #initial time
+		print "Saved: "+tipsyFilePath
 
-		tfile.write(struct.pack('iiiiii',self.nStars,3,0,0,self.nStars,0)) # nTot,dim,nGas,nDark,self.nStars,temp
+	def rasterize(self, lim = .8, size = 1000, nRed = None, elevAng = 45, rotAng = 0, IDs = None, log = True, weights = None, colors = None, cmap = 'viridis'):
+		"""
+		Projects the stars with the save_figure() camera and bins them into an RGB image
+
+		Stars are drawn dark on a white background: black, or red/blue when nRed is given, or with the colormap
+		color of the mean of their colors values in each pixel when colors is given.
+		The view is scaled so that the [-lim,lim] cube appears the same size as in save_figure().
+
+		@param[in]	lim			limits the range of all axis in view (default: .8)
+		@param[in]	size		image width and height in pixels (default: 1000)
+		@param[in]	nRed		colors the first nRed particles red and the remaining blue (default: None)
+		@param[in]	elevAng		camera view elevation in degrees from x-y plane.
+		@param[in]	rotAng		camera view rotation in degrees about z-axis.
+		@param[in]	IDs			(int array) list of particle IDs to plot
+		@param[in]	log			log scale the counts (default: True), otherwise linear
+		@param[in]	weights		None (count stars, default) or 'mass' (luminosity proportional to mass)
+		@param[in]	colors		None, 'density' (local_density()) or one value per star (default: None, overrides nRed)
+		@param[in]	cmap		matplotlib colormap name for colors (default: 'viridis')
+
+		@returns	(size x size x 3) uint8 numpy array
+		"""
 
-		for i in range(self.nStars):
-			 tfile.write(struct.pack('f3f3f3fi',self.mass[i],self.pos[i,0],self.pos[i,1],self.pos[i,2],self.vel[i,0],self.vel[i,1],self.vel[i,2],0.0,0.0,0.0,i))
-			 #mass,x1,x2,x3,v1,v2,v3,metals,tform_IGNORED,eps_IGNORED,phi_ID
-		
-		tfile.close()
+		return self.rasterize_views([(elevAng, rotAng)], lim = lim, size = size, nRed = nRed, IDs = IDs, log = log, weights = weights,
+									colors = colors, cmap = cmap)[0]
 
-		print "Saved: "+tipsyFilePath
+	def rasterize_views(self, cameras, lim = .8, size = 1000, nRed = None, IDs = None, log = True, weights = None, colors = None, cmap = 'viridis', spin = 0.):
+		"""
+		rasterize() for several cameras at once
 
-	def save_figure(self, figure_name, lim = .8, figsize = 10, pointsize = .1, nRed = None, elevAng=45, rotAng=0, IDs=None):
+		The stars are selected, colored and projected once: a single matrix product gives the screen
+		coordinates of all cameras, then each view is binned on its own.
+
+		@param[in]	cameras		list of (elevAng, rotAng) pairs in degrees
+		@param[in]	spin		degrees added to every rotAng (default: 0)
+		@param[in]	...			see rasterize()
+
+		@returns	list of (size x size x 3) uint8 numpy arrays, one per camera
+		"""
+
+		if IDs is not None:
+			selected = self.indices_of(IDs)
+		else:
+			selected = slice(None)
+
+		pos = self.pos[selected]
+		w = self.mass[selected] if weights == 'mass' else None
+		if colors is not None:
+			nRed = None
+			values = self.color_values(colors, selected)
+		elif nRed is not None:
+			red = np.asarray(self.IDs[selected]) < nRed
+
+		#mplot3d draws the [-lim,lim] box at about 0.65 of the half width of the figure
+		half_width = lim/0.65
+		#screen right and up rows of every camera: columns 2k, 2k+1 of screen belong to camera k
+		screen = pos.dot(camera_matrices(cameras, spin)[:,:2].reshape(-1, 3).T)
+
+		images = []
+		for k in range(screen.shape[1]//2):
+			col = np.floor((screen[:,2*k]/half_width + 1.)*0.5*size).astype(np.int64)
+			row = np.floor((1. - screen[:,2*k + 1]/half_width)*0.5*size).astype(np.int64)
+			inside = (col >= 0) & (col < size) & (row >= 0) & (row < size)
+			pixel = row*size + col
+
+			def density(mask):
+				if w is None:
+					counts = np.bincount(pixel[mask], minlength = size*size)
+				else:
+					counts = np.bincount(pixel[mask], weights = w[mask], minlength = size*size)
+				return counts.reshape(size,size).astype(np.float64)
+
+			if colors is not None:
+				counts = np.bincount(pixel[inside], minlength = size*size)
+				mean = np.bincount(pixel[inside], weights = values[inside], minlength = size*size)/np.maximum(counts, 1)
+				tint = pyplot().get_cmap(cmap)(mean.reshape(size,size))[:,:,:3]
+				layers = [density(inside)]
+			elif nRed is not None:
+				layers = [density(inside & red), density(inside & ~red)]
+			else:
+				layers = [density(inside)]
+
+			#scale all layers together so colors stay comparable
+			peak = max(layer.max() for layer in layers)
+			for i in range(len(layers)):
+				if peak <= 0:
+					break
+				if log:
+					nonzero = layers[i] > 0
+					minimum = layers[i][nonzero].min() if nonzero.any() else 1.
+					floor = min(minimum, peak)
+					layers[i][nonzero] = (1. + np.log(layers[i][nonzero]/floor))/(1. + np.log(peak/floor))
+				else:
+					layers[i] /= peak
+
+			if colors is not None:
+				#fade from white to the colormap color with the star density
+				image = 1. - layers[0][:,:,None]*(1. - tint)
+			elif nRed is not None:
+				#red stars remove green and blue, blue stars remove red and green
+				red_layer, blue_layer = layers
+				image = np.dstack((1. - blue_layer, 1. - red_layer - blue_layer, 1. - red_layer))
+			else:
+				image = np.dstack([1. - layers[0]]*3)
+
+			images.append((np.clip(image, 0., 1.)*255).astype(np.uint8))
+		return images
+
+	def save_image(self, figure_name, lim = .8, figsize = 10, dpi = 100, nRed = None, elevAng = 45, rotAng = 0, IDs = None, log = True, weights = None, colors = None, cmap = 'viridis'):
+		"""
+		Fast alternative to save_figure(): saves a rasterized "[figure_name].png" (see rasterize())
+
+		@param[in]	figure_name		path where figure is to be saved
+		@param[in]	lim				limits the range of all axis in view (default: .8)
+		@param[in]	figsize			size of final image (.png) in inches
+		@param[in]	dpi				pixels per inch (default: 100)
+		@param[in]	nRed			figure colors the first nRed particles red and the remaining blue (default: None)
+		@param[in]	elevAng			camera view elevation in degrees from x-y plane.
+		@param[in]	rotAng			camera view rotation in degrees about z-axis.
+		@param[in]	IDs				(int array) list of particle IDs to plot
+		@param[in]	log				log scale the star counts (default: True)
+		@param[in]	weights			None (count stars) or 'mass' (luminosity proportional to mass)
+		@param[in]	colors			None, 'density' or one value per star (see rasterize())
+		@param[in]	cmap			matplotlib colormap name for colors (default: 'viridis')
+
+		@returns	path to file just saved (string)
+		"""
+
+		start = time.time()
+		size = int(figsize*dpi)
+		image = self.rasterize(lim = lim, size = size, nRed = nRed, elevAng = elevAng, rotAng = rotAng, IDs = IDs, log = log, weights = weights,
+							   colors = colors, cmap = cmap)
+
+		fig_path_string = save_raster(image, figure_name, self.time, dpi)
+		TIMER.add('render (raster)', time.time() - start, self.nStars)
+		return fig_path_string
+
+	def save_views(self, figure_names, cameras, lim = .8, size = 500, dpi = 100, nRed = None, IDs = None, log = True, weights = None,
+				   colors = None, cmap = 'viridis', columns = None, spin = 0.):
+		"""
+		Saves several camera views of these stars from one projection (see rasterize_views())
+
+		With a single figure name the views are tiled into one panel image "[figure_names].png"
+		(see compose_panels()), e.g. cameras = [(90, 0), (0, 0)] for face-on and side-on panels.
+		With a list of names each view is saved on its own.
+
+		@param[in]	figure_names	path of the panel figure, or list of paths (one per camera)
+		@param[in]	cameras			list of (elevAng, rotAng) pairs in degrees
+		@param[in]	lim				limits the range of all axis in view (default: .8)
+		@param[in]	size			width and height of each view in pixels (default: 500)
+		@param[in]	dpi				pixels per inch (default: 100)
+		@param[in]	nRed, IDs, log, weights, colors, cmap	see rasterize()
+		@param[in]	columns			(panels only) views per row (default: None, all in one row)
+		@param[in]	spin			degrees added to every rotAng (default: 0)
+
+		@returns	path to the panel figure (string) or list of paths
+		"""
+
+		start = time.time()
+		images = self.rasterize_views(cameras, lim = lim, size = size, nRed = nRed, IDs = IDs, log = log, weights = weights,
+									  colors = colors, cmap = cmap, spin = spin)
+		if isinstance(figure_names, str):
+			paths = save_raster(compose_panels(images, columns), figure_names, self.time, dpi)
+		else:
+			if len(figure_names) != len(images):
+				raise Exception("Error: %i figure names for %i cameras" % (len(figure_names), len(images)))
+			paths = [save_raster(image, figure_name, self.time, dpi) for image, figure_name in zip(images, figure_names)]
+		TIMER.add('render (views)', time.time() - start, self.nStars)
+		return paths
+
+	def save_figure(self, figure_name, lim = .8, figsize = 10, pointsize = .1, nRed = None, elevAng=45, rotAng=0, IDs=None, backend = 'mplot3d', colors = None, cmap = 'viridis'):
 		"""
 		Generates a figure "[figure_name].png" for this Star object
 
+		backend = 'raster' uses save_image() instead, which is much faster for large numbers of stars
+		(pointsize is ignored).
+
 		@param[in]	figure_name		path where figure is to be saved
 		@param[in]	lim				limits the range of all axis in view (default: .8)
 		@param[in]	figsize			size of final image (.png)
@@ -297,23 +1156,39 @@ class Stars(object):
 		@param[in]	nRed			figure colors the first nRed particles red and the remaining blue (default: None)
 		@param[in]	elevAng			camera view elevation in degrees from x-y plane.
 		@param[in]	rotAng			camera view rotation in degrees about z-axis.
-		@param[in]	IDs				(int array) list of particle IDs to plot (assumes ascening order)
+		@param[in]	IDs				(int array) list of particle IDs to plot
+		@param[in]	backend			'mplot3d' (default) or 'raster'
+		@param[in]	colors			color stars by value with cmap instead of nRed: 'density' (log10 of local_density())
+									or an array with one value per star, e.g. np.log10(local_density()) (default: None)
+		@param[in]	cmap			matplotlib colormap name for colors (default: 'viridis')
 
 		@returns	path to file just saved (string)
 		"""
 
+		if backend == 'raster':
+			return self.save_image(figure_name, lim = lim, figsize = figsize, nRed = nRed, elevAng = elevAng, rotAng = rotAng, IDs = IDs,
+								   colors = colors, cmap = cmap)
+		elif backend != 'mplot3d':
+			raise Exception("Error: backend '%s' is not known." % backend)
+
+		start = time.time()
+		plt = pyplot()
+		from mpl_toolkits.mplot3d import axes3d #registers the '3d' projection
 		fig = plt.figure(figsize=(figsize,figsize))
 		ax = fig.gca(projection='3d')
 		ax.view_init(elev=elevAng, azim=rotAng)
-		if nRed is not None:
+		if colors is not None:
+			selected = self.indices_of(IDs) if IDs is not None else slice(None)
+			pos = self.pos[selected]
+			ax.scatter(pos[:,0],pos[:,1],pos[:,2],c=self.color_values(colors, selected),cmap=cmap,s=pointsize,edgecolors='none',depthshade=False)
+		elif nRed is not None:
 			redIdx = np.where(self.IDs < nRed)[0]
 			blueIdx = np.where(self.IDs >= nRed)[0]
 			ax.plot(self.pos[redIdx,0],self.pos[redIdx,1],self.pos[redIdx,2],'r.',markersize=pointsize)
 			ax.plot(self.pos[blueIdx,0],self.pos[blueIdx,1],self.pos[blueIdx,2],'b.',markersize=pointsize)
 		elif IDs is not None:	
 			#plot only IDs if passed
-			sorted_ids = np.argsort(self.IDs)
-			selected_ids_idx = sorted_ids[IDs]
+			selected_ids_idx = self.indices_of(IDs)
 			ax.plot(self.pos[selected_ids_idx,0],self.pos[selected_ids_idx,1],self.pos[selected_ids_idx,2],'k.',markersize=pointsize)
 		else:
 			ax.plot(self.pos[:,0],self.pos[:,1],self.pos[:,2],'k.',markersize=pointsize)
@@ -328,8 +1203,197 @@ class Stars(object):
 		plt.tight_layout()
 		fig_path_string = figure_name + '.png'
 		plt.savefig(fig_path_string)
+		plt.close(fig)
+		TIMER.add('render (mplot3d)', time.time() - start, self.nStars)
 		return fig_path_string
 
+def save_raster(image, figure_name, snap_time, dpi = 100):
+	"""
+	Saves an RGB image pixel for pixel as "[figure_name].png" with a time stamp title
+
+	@param[in]	image		(height x width x 3) uint8 array, e.g. from Stars.rasterize()
+	@param[in]	figure_name	path where figure is to be saved
+	@param[in]	snap_time	simulation time shown in the title
+	@param[in]	dpi			pixels per inch (default: 100)
+
+	@returns	path to file just saved (string)
+	"""
+	plt = pyplot()
+	height, width = image.shape[:2]
+	fig = plt.figure(figsize=(width/float(dpi),height/float(dpi)), dpi=dpi)
+	fig.figimage(image)
+	fig.text(0.5, 0.92, 'time: %f'%snap_time, ha='center', size='large')
+	fig_path_string = figure_name + '.png'
+	fig.savefig(fig_path_string, dpi=dpi)
+	plt.close(fig)
+	return fig_path_string
+
+class SnapshotSeries(object):
+	"""
+	A set of "[tipsy_prefix]{time}" snapshot files that are loaded only when accessed
+
+	The files are indexed once by the simulation time in their headers. Frames are loaded lazily with
+	series[i] (i-th snapshot in time order), series[t] for a float t (snapshot closest to time t) or
+	series[i:j] (a new series over those files), and the most recently used cache_size Stars objects are
+	kept in memory. Iterating over the series therefore runs in constant memory.
+
+	Optionally the next snapshot is read in a background thread while the current one is being used.
+	"""
+
+	## Snapshot file paths sorted by simulation time
+	files = None
+	## Array of snapshot simulation times (same order as files)
+	times = None
+	## Maximum number of Stars objects kept in memory
+	cache_size = 4
+	## Load the next snapshot in a background thread after each access
+	prefetch = False
+	## Memory-map the snapshots (see Stars)
+	mmap = False
+	## Decoded Stars objects by file index, least recently used first
+	cache = None
+	## Background loads by file index: (thread, result dictionary)
+	pending = None
+
+	def __init__(self, tipsy_prefix, cache_size = 4, prefetch = False, mmap = False):
+		"""
+		Indexes a set of snapshot files by simulation time (only the headers are read)
+
+		Files matching the prefix that are not tipsy files are skipped.
+
+		@param[in]	tipsy_prefix	prefix of tipsy files
+		@param[in]	cache_size		number of Stars objects kept in memory (default: 4)
+		@param[in]	prefetch		load the next snapshot in the background (default: False)
+		@param[in]	mmap			memory-map the snapshots instead of loading them (default: False)
+
+		@returns	an instance of the SnapshotSeries object
+		"""
+		self.cache_size = cache_size
+		self.prefetch = prefetch
+		self.mmap = mmap
+
+		index = []
+		for tipsy_file in glob.glob(tipsy_prefix+"*"):
+			try:
+				tfile = open(tipsy_file,'rb')
+				header, byteorder = read_header(tfile)
+				tfile.close()
+			except Exception:
+				print 'Skipping (%s): not a tipsy file' % tipsy_file
+				continue
+			index.append((float(header['time']),tipsy_file))
+		index.sort()
+
+		self.files = [tipsy_file for snap_time, tipsy_file in index]
+		self.times = np.array([snap_time for snap_time, tipsy_file in index])
+		self.reset()
+
+	def reset(self):
+		"""
+		Empties the cache (and forgets about snapshots being prefetched)
+
+		@returns	None
+		"""
+		self.cache = OrderedDict()
+		self.pending = {}
+		self.lock = threading.Lock()
+
+	def __len__(self):
+		return len(self.files)
+
+	def __iter__(self):
+		for index in range(len(self.files)):
+			yield self.load(index)
+
+	def __getitem__(self, key):
+		if isinstance(key, slice):
+			subset = SnapshotSeries.__new__(SnapshotSeries)
+			subset.cache_size = self.cache_size
+			subset.prefetch = self.prefetch
+			subset.mmap = self.mmap
+			subset.files = self.files[key]
+			subset.times = self.times[key]
+			subset.reset()
+			return subset
+		elif isinstance(key, numbers.Integral):
+			if key < 0:
+				key += len(self.files)
+			if not 0 <= key < len(self.files):
+				raise IndexError("snapshot index out of range")
+			return self.load(key)
+		elif isinstance(key, numbers.Real):
+			return self.load(self.index_of_time(key))
+		else:
+			raise TypeError("snapshots are selected by index, time or slice")
+
+	def index_of_time(self, time):
+		"""
+		Index of the snapshot closest to a simulation time
+
+		@param[in]	time	simulation time
+
+		@returns	index into files and times (int)
+		"""
+		if len(self.files) == 0:
+			raise IndexError("no snapshots in series")
+		return int(np.argmin(np.abs(self.times - time)))
+
+	def load(self, index):
+		"""
+		Returns the Stars object of one snapshot, from the cache if possible
+
+		@param[in]	index	index into files
+
+		@returns	a Stars object (shared with the cache, copy it before modifying if the series is reused)
+		"""
+		with self.lock:
+			stars = self.cache.pop(index, None)
+			pending = self.pending.pop(index, None)
+
+		if stars is None and pending is not None:
+			thread, result = pending
+			thread.join()
+			stars = result.get('stars')
+		if stars is None:
+			stars = Stars(self.files[index], mmap = self.mmap)
+
+		with self.lock:
+			self.cache[index] = stars
+			while len(self.cache) > self.cache_size:
+				self.cache.popitem(last = False)
+
+		if self.prefetch and index+1 < len(self.files):
+			self.start_prefetch(index+1)
+
+		return stars
+
+	def start_prefetch(self, index):
+		"""
+		Starts loading a snapshot in a background thread (other pending loads are dropped)
+
+		A failed background load is retried (and its error raised) by load().
+
+		@param[in]	index	index into files
+
+		@returns	None
+		"""
+		with self.lock:
+			if index in self.cache or index in self.pending:
+				return
+			self.pending.clear()
+
+			result = {}
+			def background_load():
+				try:
+					result['stars'] = Stars(self.files[index], mmap = self.mmap)
+				except Exception:
+					pass
+
+			thread = threading.Thread(target = background_load)
+			thread.daemon = True
+			self.pending[index] = (thread, result)
+			thread.start()
+
 def make_mp4(png_prefix, mp4_prefix, frame_rate = 20, bit_rate = '8000k', codec = 'libx264'):
 	"""
 	Makes an MP4 video from a set of PNG files.
@@ -353,17 +1417,218 @@ def make_mp4(png_prefix, mp4_prefix, frame_rate = 20, bit_rate = '8000k', codec
 		mp4_prefix + '.mp4'])
 	print "Saved: " + mp4_prefix + ".mp4"
 
+def stream_mp4(tipsy_prefix, mp4_prefix, frame_rate = 20, bit_rate = '8000k', codec = 'libx264', size = 1000, max_pending = 4,
+			   lim = .8, nRed = None, elevAng = 45, rotAng = 0, IDs = None, log = True, weights = None, cameras = None, columns = None, spin = 0.):
+	"""
+	Makes an MP4 video directly from a set of tipsy files, without writing PNG files.
+
+	Each "[tipsy_prefix]{number}" snapshot (in simulation time order) is rasterized with Stars.rasterize()
+	and piped to a single ffmpeg process as raw RGB frames. A writer thread feeds ffmpeg from a queue of at
+	most max_pending frames, so rendering the next frame overlaps with encoding, and rendering waits when
+	ffmpeg falls behind. The next snapshot is read in the background while the current one is rendered.
+	Frames carry no time stamp title (see Stars.save_image() for that).
+
+	With a list of cameras each frame is a panel of all views (Stars.rasterize_views() and compose_panels(),
+	each view size x size pixels) and spin turns the cameras by that many degrees per frame.
+
+	@param[in]	tipsy_prefix	prefix of tipsy files
+	@param[in]	mp4_prefix		name of .mp4 file
+	@param[in]	frame_rate		in frames per second (default: 20)
+	@param[in]	bit_rate		(string) in bits per second, higer rate = higer quality (default: '8000k')
+	@param[in]	codec			used to encode video, may require extra libraries on system (defaut: 'libx264')
+	@param[in]	size			frame width and height in pixels, must be even for libx264 (default: 1000)
+	@param[in]	max_pending		maximum number of rendered frames waiting for ffmpeg (default: 4)
+	@param[in]	lim, nRed, elevAng, rotAng, IDs, log, weights	passed to Stars.rasterize()
+	@param[in]	cameras			list of (elevAng, rotAng) pairs, replaces elevAng and rotAng (default: None)
+	@param[in]	columns			(cameras only) views per row (default: None, all in one row)
+	@param[in]	spin			(cameras only) degrees per frame added to every rotAng (default: 0)
+
+	@returns	None
+	"""
+	series = SnapshotSeries(tipsy_prefix, cache_size = 1, prefetch = True)
+	if cameras is None:
+		cameras = [(elevAng, rotAng)]
+		columns = 1
+	elif columns is None:
+		columns = len(cameras)
+	rows = (len(cameras) + columns - 1)//columns
+
+	ffmpeg = Popen(['ffmpeg','-y',
+		'-f','rawvideo','-pix_fmt','rgb24','-s','%ix%i' % (columns*size,rows*size),
+		'-r', str(frame_rate),
+		'-i', '-',
+		'-vcodec',codec,
+		'-b',bit_rate,
+		'-pix_fmt','yuv420p',
+		mp4_prefix + '.mp4'], stdin=PIPE)
+
+	frames = Queue(maxsize = max_pending)
+	errors = []
+	def feed_ffmpeg():
+		while True:
+			frame = frames.get()
+			if frame is None:
+				break
+			if errors:
+				continue #drain the queue so the renderer is not blocked
+			try:
+				with TIMER.stage('ffmpeg encode', 1):
+					ffmpeg.stdin.write(frame)
+			except (IOError, OSError) as e:
+				errors.append(e)
+
+	writer = threading.Thread(target = feed_ffmpeg)
+	writer.daemon = True
+	writer.start()
+
+	try:
+		for index, stars in enumerate(series):
+			if errors:
+				break
+			with TIMER.stage('rasterize', stars.nStars):
+				image = compose_panels(stars.rasterize_views(cameras, lim = lim, size = size, nRed = nRed, IDs = IDs, log = log, weights = weights,
+															 spin = spin*index), columns)
+			frames.put(image.tostring())
+	finally:
+		frames.put(None)
+		writer.join()
+		try:
+			ffmpeg.stdin.close()
+		except (IOError, OSError) as e:
+			errors.append(e)
+		returncode = ffmpeg.wait()
+
+	if errors or returncode:
+		raise Exception("Error: ffmpeg failed (return code %s) %s" % (returncode, errors[0] if errors else ''))
+
+	print "Saved: " + mp4_prefix + ".mp4"
+
+
+def bounded_imap(pool, func, tasks, max_pending):
+	"""
+	Like pool.imap() but submits at most max_pending tasks ahead of the results being consumed
+
+	Results are yielded in task order.
+
+	@param[in]	pool			multiprocessing.Pool
+	@param[in]	func			function applied to each task (must be picklable)
+	@param[in]	tasks			iterable of single arguments to func
+	@param[in]	max_pending		maximum number of submitted but unconsumed tasks
+
+	@returns	generator of func(task) results
+	"""
+	pending = deque()
+	for task in tasks:
+		if len(pending) >= max_pending:
+			yield pending.popleft().get()
+		pending.append(pool.apply_async(func,(task,)))
+	while pending:
+		yield pending.popleft().get()
+
+def render_frame(task):
+	"""
+	Loads one snapshot and saves its figure, or all its views when figure_kwargs has cameras (worker function of render_frames())
+
+	@param[in]	task	(index, tipsy_file, figure_name, figure_kwargs) tuple
+
+	@returns	(index, path to figure (or list of paths) or None, traceback string or None)
+	"""
+	index, tipsy_file, figure_name, figure_kwargs = task
+	try:
+		if 'cameras' in figure_kwargs:
+			return index, Stars(tipsy_file).save_views(figure_name, **figure_kwargs), None
+		return index, Stars(tipsy_file).save_figure(figure_name, **figure_kwargs), None
+	except Exception:
+		return index, None, traceback.format_exc()
+
+def render_frames(tipsy_prefix, figures_prefix, nProcs = None, max_pending = None, skip_existing = False, cameras = None, panels = True,
+				  spin = 0., **figure_kwargs):
+	"""
+	Renders "[figures_prefix]{index}.png" for each "[tipsy_prefix]{number}" file with a pool of processes
+
+	{index} is the position of the snapshot when sorted by simulation time, so frame numbers do not depend
+	on the order in which frames finish. A frame that fails does not stop the others; all failures are
+	reported together (with the worker tracebacks) once every frame has been tried.
+
+	With a list of cameras every snapshot is read once and rendered from all of them (Stars.save_views()):
+	as one panel figure per frame, or with panels = False as "[figures_prefix]view{k}_{index}.png", one
+	movie sequence per camera. spin turns all cameras by that many degrees per frame (a fly-around).
 
-def read_tipsy(tipsy_prefix, figures_prefix = None, lim = .8, pointsize = .1, nRed = None, elevAng = 45, IDs = None):
+	@param[in]	tipsy_prefix	prefix of tipsy files
+	@param[in]	figures_prefix	prefix of png files
+	@param[in]	nProcs			number of worker processes, 1 renders in this process (default: number of cores)
+	@param[in]	max_pending		maximum number of frames queued for the workers (default: 2*nProcs)
+	@param[in]	skip_existing	skip frames whose png is newer than its tipsy file (default: False)
+	@param[in]	cameras			list of (elevAng, rotAng) pairs in degrees (default: None, one save_figure() view)
+	@param[in]	panels			(cameras only) tile the views into one figure per frame (default: True)
+	@param[in]	spin			(cameras only) degrees per frame added to every rotAng (default: 0)
+	@param[in]	figure_kwargs	passed to Stars.save_figure() (lim, pointsize, nRed, elevAng, rotAng, IDs, backend, ...)
+							or with cameras to Stars.save_views() (lim, size, nRed, IDs, colors, columns, ...)
+
+	@returns	list of figure paths in frame order (lists of paths per frame with cameras and panels = False)
+	"""
+	series = SnapshotSeries(tipsy_prefix)
+
+	paths = [None]*len(series)
+	tasks = []
+	for index, tipsy_file in enumerate(series.files):
+		kwargs = figure_kwargs
+		if cameras is not None:
+			kwargs = dict(figure_kwargs, cameras = cameras, spin = spin*index)
+		if cameras is None or panels:
+			figure_name = figures_prefix+str(index)
+			fig_paths = [figure_name + '.png']
+		else:
+			figure_name = [figures_prefix + 'view%i_%i' % (k, index) for k in range(len(cameras))]
+			fig_paths = [name + '.png' for name in figure_name]
+		if skip_existing and all(os.path.exists(fig_path) and os.path.getmtime(fig_path) >= os.path.getmtime(tipsy_file) for fig_path in fig_paths):
+			paths[index] = fig_paths[0] if isinstance(figure_name, str) else fig_paths
+		else:
+			tasks.append((index, tipsy_file, figure_name, kwargs))
+
+	if nProcs is None:
+		nProcs = cpu_count()
+	nProcs = max(1, min(nProcs, len(tasks)))
+	if max_pending is None:
+		max_pending = 2*nProcs
+
+	print 'Rendering %i of %i frames with %i process(es)...' % (len(tasks), len(series), nProcs)
+
+	errors = []
+	pool = Pool(nProcs) if nProcs > 1 else None
+	try:
+		results = bounded_imap(pool, render_frame, tasks, max_pending) if pool else (render_frame(task) for task in tasks)
+		for index, fig_path, error in results:
+			if error is None:
+				paths[index] = fig_path
+			else:
+				print 'Error rendering frame %i (%s)' % (index, series.files[index])
+				errors.append('frame %i (%s):\n%s' % (index, series.files[index], error))
+		if pool:
+			pool.close()
+	finally:
+		if pool:
+			pool.terminate()
+			pool.join()
+
+	if errors:
+		raise Exception("Error: %i of %i frames failed\n%s" % (len(errors), len(tasks), '\n'.join(errors)))
+
+	return paths
+
+def read_tipsy(tipsy_prefix, figures_prefix = None, lim = .8, pointsize = .1, nRed = None, elevAng = 45, IDs = None, nProcs = None, skip_existing = False, backend = 'mplot3d',
+			   rotAng = 0, cameras = None, panels = True, spin = 0.):
 	'''
 	Reads a set of tipsy files and returns an array of Star objects or plots figures
 
 	Reads a set of "[tipsy_prefix]{number}" files, where {number} is a placeholder for consecutive
-	dicimal numbers, and returns an array of Star() objects.
+	dicimal numbers, and returns an array of Star() objects sorted by simulation time.
+	Use SnapshotSeries instead to load the files one at a time.
 
 	Optionally, if figures_prefix is not None, will generate a set of figures
-	"[figures_prefix]{index}.png", where {index} is found from sorting {number},
-	and returns nothing (saves RAM for large set of tipsy files).
+	"[figures_prefix]{index}.png", where {index} is found from sorting by simulation time,
+	and returns nothing (saves RAM for large set of tipsy files). Figures are rendered in parallel,
+	see render_frames().
 
 	@param[in]	tipsy_prefix	prefix of tipsy files
 	@param[in]	figures_prefix	generates figures only, no array returned (default: None)
@@ -371,59 +1636,29 @@ def read_tipsy(tipsy_prefix, figures_prefix = None, lim = .8, pointsize = .1, nR
 	@param[in]	pointsize		(figure only) size of points in figure
 	@param[in]	nRed			(figure only) colors the first nRed particles red and the remaining blue (default: None)
 	@param[in]	elevAng			(figure only) camera view elevation in degrees from x-y plane (default: 45).
-	@param[in]	IDs				(figure only) (int array) list of particle IDs to plot (assumes ascening order, default:None)
+	@param[in]	IDs				(figure only) (int array) list of particle IDs to plot (default:None)
+	@param[in]	nProcs			(figure only) number of rendering processes (default: number of cores)
+	@param[in]	skip_existing	(figure only) skip figures that are newer than their tipsy file (default: False)
+	@param[in]	backend			(figure only) 'mplot3d' (default) or 'raster' (see Stars.save_figure())
+	@param[in]	rotAng			(figure only) camera view rotation in degrees about z-axis (default: 0)
+	@param[in]	cameras			(figure only) list of (elevAng, rotAng) views rendered from one read of each
+								snapshot instead of elevAng, rotAng (default: None, see render_frames())
+	@param[in]	panels			(figure only, cameras) one panel figure per frame or one figure per view (default: True)
+	@param[in]	spin			(figure only, cameras) degrees per frame added to every rotAng (default: 0)
 
 	@returns	an array of Star objects (only if figures_prefix is None)
 	'''
 
-	#comparitor for file name sorting
-	def cmp(x,y):
-		x_num = float(x.lstrip(tipsy_prefix+'_'))
-		y_num = float(y.lstrip(tipsy_prefix+'_'))
-		if x_num > y_num:
-			return 1
-		elif x_num < y_num:
-			return -1
-		else:
-			return 0
-	
-	tipsy_list = glob.glob(tipsy_prefix+"*")
-	tipsy_list.sort(cmp)
-
-	if figures_prefix is not None:
-		#run parallel processes to plot figures
-
-		#parallel function definition
-		# def read_and_plot(tipsy_file,index,lim,nRed):
-		# 	temp_stars = Stars(tipsy_file)
-		# 	temp_stars.save_figure(figures_prefix+str(index),lim=lim,nRed=nRed)
-
-#		procs = [] #array of proceedures
-		index = 0
-		for tipsy_file in tipsy_list:
-			#read_and_plot(tipsy_file,index,lim,nRed)
-			temp_stars = Stars(tipsy_file)
-			temp_stars.save_figure(figures_prefix+str(index),lim=lim,pointsize=pointsize, nRed=nRed, elevAng = elevAng, IDs = IDs)
-#			procs.append(Process(target=read_and_plot,args=(tipsy_file,index,lim,nRed)))
-#			procs[-1].start()
-			index +=1
-			# if index % nThreads == 0:
-			# 	for i in range(nThreads):
-			# 		procs[i].join()
-			# 	#wait for nThreads to finish
-			# 	procs = []
-
-
-		# for i in range(int(self.dim.z)):
-		# 	procs[i].join()
-	
+	if figures_prefix is not None and cameras is not None:
+		render_frames(tipsy_prefix, figures_prefix, nProcs = nProcs, skip_existing = skip_existing, cameras = cameras, panels = panels,
+					  spin = spin, lim = lim, nRed = nRed, IDs = IDs)
+	elif figures_prefix is not None:
+		render_frames(tipsy_prefix, figures_prefix, nProcs = nProcs, skip_existing = skip_existing,
+					  lim = lim, pointsize = pointsize, nRed = nRed, elevAng = elevAng, rotAng = rotAng, IDs = IDs, backend = backend)
 	else:
-		stars_array = []
-		for tipsy_file in tipsy_list:
-			stars_array[-1] = Stars(tipsy_file)
-		return stars_array
+		return list(SnapshotSeries(tipsy_prefix, cache_size = 1))
 
-def txt2tipsy(nbody_file,tipsy_file):
+def txt2tipsy(nbody_file,tipsy_file, chunk_size = 100000):
 	"""
 	Converts a typical nbody or Aarseth text file to .tipsy format
 
@@ -431,10 +1666,14 @@ def txt2tipsy(nbody_file,tipsy_file):
 	@li [particle_count] [time_stamp] 
 	@li [particle_count] [eta] [dt] [tmax] [eps2] 
 
+	The text is parsed and written chunk_size rows at a time (columns: mass, x, y, z, vx, vy, vz),
+	so memory use does not depend on the size of the file.
+
 	@param[in]	nbody_file	path to the nbody text formated file
 	@param[in]	tipsy_file	path to the tipsy output file
+	@param[in]	chunk_size	number of rows converted at a time (default: 100000)
 
-	@returns 	None
+	@returns 	dictionary of header values: nStars, eta, dt, tmax, eps2
 	"""
 	# Header: # particles, eta=0.02, dt, tmax, epsilon**2=0.25
 	# eta is "accuracy parameter"
@@ -451,7 +1690,6 @@ def txt2tipsy(nbody_file,tipsy_file):
 
 	nbfile = open(nbody_file,'r')
 	header_line = nbfile.readline().rstrip()
-	nbfile.close()
 
 	if len(header_line.split()) == 5:
 		#aarseth format
@@ -459,28 +1697,201 @@ def txt2tipsy(nbody_file,tipsy_file):
 	elif len(header_line.split()) == 2:
 		nStars, tmax = map(float,header_line.split())
 	else:
+		nbfile.close()
 		raise Exception("Error: header format not recognized")
 
-	star_data = np.loadtxt(nbody_file,skiprows=1)
-
 	nStars = int(nStars)
 
-	if nStars != star_data.shape[0]:
-		print "Warning: number of stars in file (%i) does not match number in header (%i)..." % (star_data.shape[0],nStars)
-		nStars = star_data.shape[0]
-
 	print "Writing..."
-	tfile = open(tipsy_file,'wb')
+	writer = TipsyWriter(tipsy_file, 0.0)
+	nCols = None
+	lines = []
+	for line in nbfile:
+		if '#' in line:
+			line = line.split('#',1)[0]
+		if not line.strip():
+			continue
+		if nCols is None:
+			nCols = len(line.split())
+			if nCols < 7:
+				writer.close()
+				nbfile.close()
+				raise Exception("Error: expected 7 columns (mass, x, y, z, vx, vy, vz), found %i" % nCols)
+		lines.append(line)
+		if len(lines) == chunk_size:
+			write_text_rows(writer, lines, nCols)
+			lines = []
+	write_text_rows(writer, lines, nCols)
+	writer.close()
+	nbfile.close()
 
-	#time first
-	tfile.write(struct.pack('d',0.0)) #initial time
+	if nStars != writer.nStars:
+		print "Warning: number of stars in file (%i) does not match number in header (%i)..." % (writer.nStars,nStars)
+		nStars = writer.nStars
 
-	tfile.write(struct.pack('iiiiii',nStars,3,0,0,nStars,0)) # nTot,dim,nGas,nDark,self.nStars,temp
+	return {'nStars':nStars,'eta':eta, 'dt':dt, 'tmax':tmax, 'eps2':eps2}
 
-	for i in range(nStars):
-		 tfile.write(struct.pack('f3f3f3fi',star_data[i,0],star_data[i,1],star_data[i,2],star_data[i,3],star_data[i,4],star_data[i,5],star_data[i,6],0.0,0.0,0.0,i))
-		 #mass,x1,x2,x3,v1,v2,v3,metals,tform_IGNORED,eps_IGNORED,phi_IGNORED
-	
-	tfile.close()
+def write_text_rows(writer, lines, nCols):
+	"""
+	Parses a block of text rows and writes them to a TipsyWriter (used by txt2tipsy())
 
-	return {'nStars':nStars,'eta':eta, 'dt':dt, 'tmax':tmax, 'eps2':eps2}
\ No newline at end of file
+	@param[in]	writer	TipsyWriter
+	@param[in]	lines	list of text rows
+	@param[in]	nCols	number of columns in each row
+
+	@returns	None
+	"""
+	if not lines:
+		return
+	values = np.fromstring(' '.join(lines), sep=' ')
+	if len(values) != len(lines)*nCols:
+		raise Exception("Error: rows %i to %i do not all have %i columns" % (writer.nStars+1, writer.nStars+len(lines), nCols))
+	star_data = values.reshape(len(lines),nCols)
+	writer.write(star_data[:,0],star_data[:,1:4],star_data[:,4:7])
+
+def convert_shard(task):
+	"""
+	Converts one text file (worker function of txt2tipsy_shards())
+
+	@param[in]	task	(nbody_file, tipsy_file, chunk_size) tuple
+
+	@returns	dictionary returned by txt2tipsy()
+	"""
+	nbody_file, tipsy_file, chunk_size = task
+	return txt2tipsy(nbody_file, tipsy_file, chunk_size)
+
+def txt2tipsy_shards(nbody_files, tipsy_file, nProcs = None, chunk_size = 100000):
+	"""
+	Converts a set of nbody text files (each with its own header) into a single .tipsy file
+
+	The files are converted in parallel to temporary "[tipsy_file].part{i}" files, which are then
+	concatenated in the given order with particle IDs renumbered consecutively.
+
+	@param[in]	nbody_files		list of paths to nbody text formated files
+	@param[in]	tipsy_file		path to the tipsy output file
+	@param[in]	nProcs			number of worker processes (default: number of cores)
+	@param[in]	chunk_size		number of rows converted at a time by each process (default: 100000)
+
+	@returns	dictionary with the total nStars and the list of per-file header dictionaries ('shards')
+	"""
+	parts = [tipsy_file + '.part%i' % i for i in range(len(nbody_files))]
+	tasks = [(nbody_file, part, chunk_size) for nbody_file, part in zip(nbody_files, parts)]
+
+	if nProcs is None:
+		nProcs = cpu_count()
+	nProcs = max(1, min(nProcs, len(tasks)))
+
+	try:
+		if nProcs > 1:
+			pool = Pool(nProcs)
+			try:
+				shards = pool.map(convert_shard, tasks)
+				pool.close()
+			finally:
+				pool.terminate()
+				pool.join()
+		else:
+			shards = [convert_shard(task) for task in tasks]
+
+		nStars = concatenate_tipsy(parts, tipsy_file, renumber = True)
+	finally:
+		for part in parts:
+			if os.path.exists(part):
+				os.remove(part)
+
+	return {'nStars':nStars, 'shards':shards}
+
+def concatenate_tipsy(tipsy_files, tipsy_file, renumber = False, chunk_size = 1000000):
+	"""
+	Concatenates the stars of several tipsy files into one, chunk_size records at a time
+
+	The time of the first file is used for the output header.
+
+	@param[in]	tipsy_files		list of paths to tipsy files
+	@param[in]	tipsy_file		path to the tipsy output file
+	@param[in]	renumber		replace the particle IDs by 0..N-1 in file order (default: False, IDs preserved)
+	@param[in]	chunk_size		number of records copied at a time (default: 1000000)
+
+	@returns	number of stars written
+	"""
+	writer = None
+	for path in tipsy_files:
+		tfile = open(path,'rb')
+		header, byteorder = read_header(tfile)
+		if writer is None:
+			writer = TipsyWriter(tipsy_file, float(header['time']))
+
+		remaining = int(header['nStar'])
+		while remaining > 0:
+			records = np.fromfile(tfile,dtype=star_dtype(byteorder),count=min(chunk_size,remaining))
+			if len(records) == 0:
+				tfile.close()
+				writer.close()
+				raise Exception("Error: %s is truncated" % path)
+			if renumber:
+				records['phi'] = writer.nStars + np.arange(len(records))
+			writer.write_records(records)
+			remaining -= len(records)
+		tfile.close()
+
+	if writer is None:
+		raise Exception("Error: no tipsy files to concatenate")
+	writer.close()
+	return writer.nStars
+
+
+def sort_tipsy(tipsy_file, sorted_file, curve = 'hilbert'):
+	"""
+	Writes a copy of a tipsy file with the stars sorted along a space-filling curve (see Stars.sort_spatial())
+
+	@param[in]	tipsy_file		path to the input tipsy file
+	@param[in]	sorted_file		path to the output tipsy file
+	@param[in]	curve			'hilbert' or 'morton' (default: 'hilbert')
+
+	@returns	sorted_file
+	"""
+	header, records = read_stars(tipsy_file)
+	order = np.argsort(octree.curve_keys(records['pos'], curve), kind = 'mergesort')
+	writer = TipsyWriter(sorted_file, float(header['time']))
+	writer.write_records(records[order])
+	writer.close()
+	return sorted_file
+
+def write_shards(stars, tipsy_prefix, nShards, curve = 'hilbert', weights = None):
+	"""
+	Writes "[tipsy_prefix]{rank}.tipsy" files, one spatially compact, balanced piece of the stars per rank
+
+	Particle IDs are kept, so the pieces (or the ranks' outputs) can be put back together with merge_shards().
+
+	@param[in]	stars			Stars object
+	@param[in]	tipsy_prefix	path prefix of the shard files
+	@param[in]	nShards			number of shards (e.g. mpi_n)
+	@param[in]	curve			'hilbert' or 'morton' (default: 'hilbert')
+	@param[in]	weights			None, 'mass' or one weight per star (see Stars.shards())
+
+	@returns	list of shard paths in rank order
+	"""
+	paths = []
+	for rank, idx in enumerate(stars.shards(nShards, curve, weights)):
+		path = '%s%i.tipsy' % (tipsy_prefix, rank)
+		write_stars(path, stars.time, stars.mass[idx], stars.pos[idx], stars.vel[idx], stars.IDs[idx])
+		paths.append(path)
+	return paths
+
+def merge_shards(tipsy_files, tipsy_file, sort_ids = False):
+	"""
+	Merges per-rank tipsy files into one, keeping the particle IDs
+
+	@param[in]	tipsy_files		list of paths, e.g. from write_shards() or one snapshot of each rank
+	@param[in]	tipsy_file		path to the merged tipsy file
+	@param[in]	sort_ids		order the stars by particle ID (default: False, rank order)
+
+	@returns	number of stars written
+	"""
+	nStars = concatenate_tipsy(tipsy_files, tipsy_file)
+	if sort_ids:
+		header, records = read_stars(tipsy_file)
+		writer = TipsyWriter(tipsy_file, float(header['time']))
+		writer.write_records(records[np.argsort(records['phi'], kind = 'mergesort')])
+		writer.close()
+	return nStars
@@ -0,0 +1,337 @@
+## @namespace trajectory
+#  The trajectory module transposes a snapshot series into a particle-major store of per-star time series
+
+"""
+Trajectory.py module
+
+Snapshots are time-major (all stars at one time, in the order Bonsai left them), so following a set of
+stars through a run means decoding every snapshot. A trajectory store is the transpose: a directory with
+
+	index.json		format, number of stars, time capacity and the simulation time of every stored frame
+	IDs.npy			particle IDs of the stored stars (sorted)
+	mass.npy		their masses
+	data.bin		float32 array (nStars x capacity x 6) of x, y, z, vx, vy, vz, memory-mapped
+
+One star's whole trajectory is a contiguous stretch of data.bin, so fetching a few thousand stars out of a
+million reads a few thousand short runs of bytes, and a range of neighbouring IDs is a single read.
+
+The store is built by walking the series once (each snapshot is memory-mapped and looked up by ID with
+Stars.indices_of()). Frames are collected in a buffer of at most memory_MB and written as blocks of
+consecutive times, so every write to data.bin is a contiguous run per star. New snapshots of a running
+simulation are added with update() or append_file(); data.bin doubles its time capacity when it is full.
+
+Project: UC San Diego Physics 241, Winter 2014, Prof. J. Kuti
+"""
+
+import json, os
+import numpy as np
+import tipsy
+
+##\short	Version number written in index.json
+TRAJECTORY_VERSION = 1
+
+##\short	Values stored per star and frame (x, y, z, vx, vy, vz)
+FIELDS = 6
+
+class Trajectories(object):
+	"""
+	Particle-major, memory-mapped store of the positions and velocities of a fixed set of stars
+
+	Frames are stored in the order they are appended (normally time order). Frames in the write buffer are
+	not visible to readers until flush() (called by update(), close() and when the buffer is full).
+	"""
+
+	## Path of the store directory
+	path = None
+	## Contents of index.json
+	index = None
+	## Array of the simulation times of the stored frames
+	times = None
+	## Array of the stored particle IDs (sorted)
+	IDs = None
+	## Array of their masses
+	mass = None
+	## Memory-mapped data.bin (nStars x capacity x 6 float32 array)
+	data = None
+	## True if frames can be appended
+	writable = False
+	## Maximum size of the write buffer in MB
+	memory_MB = 256
+	## Frames waiting to be written: list of (time, nStars x 6 float32 array)
+	buffer = None
+
+	def __init__(self, path, mode = 'r', ids = None, capacity = 64, memory_MB = 256):
+		"""
+		Opens (mode 'r' or 'a') or creates (mode 'w') a trajectory store
+
+		A new store holds no stars until the first frame is appended: then either the given ids or all stars
+		of that frame are stored. capacity only sets the initial number of frames data.bin has room for.
+
+		@param[in]	path		store directory
+		@param[in]	mode		'r' read, 'a' read and append frames, 'w' create (an existing store is replaced) (default: 'r')
+		@param[in]	ids			particle IDs to store (default: None, all stars of the first frame)
+		@param[in]	capacity	initial number of frames (default: 64)
+		@param[in]	memory_MB	maximum size of the write buffer (default: 256)
+
+		@returns	an instance of the Trajectories object
+		"""
+		if mode not in ('r', 'a', 'w'):
+			raise Exception("Error: unknown trajectory store mode '%s'" % mode)
+		self.path = path
+		self.writable = mode != 'r'
+		self.memory_MB = memory_MB
+		self.buffer = []
+
+		if mode == 'w':
+			if not os.path.isdir(path):
+				os.makedirs(path)
+			for name in ('IDs.npy', 'mass.npy', 'data.bin'):
+				if os.path.exists(os.path.join(path, name)):
+					os.remove(os.path.join(path, name))
+			self.index = {'version':TRAJECTORY_VERSION, 'nStars':None, 'capacity':max(1, int(capacity)), 'times':[]}
+			if ids is not None:
+				self.set_ids(ids)
+			self.save_index()
+		else:
+			if not os.path.isfile(os.path.join(path, 'index.json')):
+				raise Exception("Error: '%s' is not a trajectory store (no index.json)" % path)
+			self.index = json.load(open(os.path.join(path, 'index.json')))
+			if self.index['version'] > TRAJECTORY_VERSION:
+				raise Exception("Error: trajectory store version %i is newer than this module (%i)" % (self.index['version'], TRAJECTORY_VERSION))
+			if self.index['nStars'] is not None:
+				self.IDs = np.load(os.path.join(path, 'IDs.npy'))
+				if os.path.exists(os.path.join(path, 'mass.npy')):
+					self.mass = np.load(os.path.join(path, 'mass.npy'))
+				if os.path.exists(os.path.join(path, 'data.bin')):
+					self.map_data()
+		self.times = np.array(self.index['times'], dtype = np.float64)
+
+	def set_ids(self, ids):
+		"""
+		Fixes the set of stored stars (new store only)
+
+		@param[in]	ids		particle IDs
+
+		@returns	None
+		"""
+		IDs = np.unique(np.asarray(ids, dtype = np.int64))
+		self.IDs = IDs
+		self.index['nStars'] = len(IDs)
+		np.save(os.path.join(self.path, 'IDs.npy'), IDs)
+
+	def map_data(self):
+		"""
+		Memory-maps data.bin with the current capacity
+
+		@returns	None
+		"""
+		shape = (self.index['nStars'], self.index['capacity'], FIELDS)
+		self.data = np.memmap(os.path.join(self.path, 'data.bin'), dtype = np.float32, mode = 'r+' if self.writable else 'r', shape = shape)
+
+	def save_index(self):
+		"""
+		Writes index.json (to a temporary file that is renamed, so a reader never sees a partial index)
+
+		@returns	None
+		"""
+		index_file = os.path.join(self.path, 'index.json')
+		json.dump(self.index, open(index_file + '.tmp', 'w'), indent = 1, sort_keys = True)
+		os.rename(index_file + '.tmp', index_file)
+
+	def __len__(self):
+		return len(self.index['times'])
+
+	def rows_of(self, ids):
+		"""
+		Rows of data.bin that hold the given particle IDs
+
+		@param[in]	ids		particle ID or array of particle IDs
+
+		@returns	index array (same shape as ids)
+		"""
+		ids = np.asarray(ids, dtype = np.int64)
+		if self.IDs is None or len(self.IDs) == 0:
+			raise Exception("Error: trajectory store '%s' holds no stars" % self.path)
+		rows = np.clip(np.searchsorted(self.IDs, ids), 0, len(self.IDs) - 1)
+		missing = self.IDs[rows] != ids
+		if np.any(missing):
+			raise Exception("Error: particle IDs not in trajectory store: %s" % ids[missing][:10])
+		return rows
+
+	def append(self, stars):
+		"""
+		Adds a frame to the write buffer (written to data.bin when the buffer is full or on flush())
+
+		The first frame fixes the stored stars unless ids were given. Every frame must hold all stored IDs.
+
+		@param[in]	stars	Stars object (any particle order, may be memory-mapped)
+
+		@returns	None
+		"""
+		if not self.writable:
+			raise Exception("Error: trajectory store '%s' is opened read-only" % self.path)
+		if self.IDs is None:
+			self.set_ids(stars.IDs)
+		if self.mass is None:
+			self.mass = np.asarray(stars.mass[stars.indices_of(self.IDs)], dtype = np.float32)
+			np.save(os.path.join(self.path, 'mass.npy'), self.mass)
+		if self.data is None:
+			self.data = np.memmap(os.path.join(self.path, 'data.bin'), dtype = np.float32, mode = 'w+',
+								  shape = (self.index['nStars'], self.index['capacity'], FIELDS))
+
+		idx = stars.indices_of(self.IDs)
+		frame = np.empty((len(idx), FIELDS), dtype = np.float32)
+		frame[:,:3] = stars.pos[idx]
+		frame[:,3:] = stars.vel[idx]
+		self.buffer.append((float(stars.time), frame))
+		if len(self.buffer)*frame.nbytes >= self.memory_MB*2**20:
+			self.flush()
+
+	def append_file(self, tipsy_file):
+		"""
+		Adds one snapshot file (memory-mapped, only the stored stars are copied) and writes it
+
+		Suitable as a bonsai.run_tipsy(..., wait = False, callback = ...) callback.
+
+		@param[in]	tipsy_file	path to a tipsy file
+
+		@returns	None
+		"""
+		self.append(tipsy.Stars(tipsy_file, mmap = True))
+		self.flush()
+
+	def update(self, tipsy_prefix):
+		"""
+		Adds the "[tipsy_prefix]{time}" snapshots that are later than the last stored frame (in time order)
+
+		@param[in]	tipsy_prefix	prefix of tipsy files
+
+		@returns	number of frames added
+		"""
+		series = tipsy.SnapshotSeries(tipsy_prefix, cache_size = 1, prefetch = True, mmap = True)
+		last = self.times[-1] if len(self.times) else None
+		if self.buffer:
+			last = self.buffer[-1][0]
+		first = 0 if last is None else int(np.searchsorted(series.times, last, 'right'))
+		for index in range(first, len(series)):
+			self.append(series[index])
+		self.flush()
+		return len(series) - first
+
+	def flush(self):
+		"""
+		Writes the buffered frames to data.bin (one contiguous block per star) and updates index.json
+
+		@returns	None
+		"""
+		if not self.buffer:
+			return
+		first = len(self.index['times'])
+		stop = first + len(self.buffer)
+		if stop > self.index['capacity']:
+			self.grow(max(stop, 2*self.index['capacity']))
+
+		block = np.empty((self.index['nStars'], len(self.buffer), FIELDS), dtype = np.float32)
+		for k, (snap_time, frame) in enumerate(self.buffer):
+			block[:,k] = frame
+		self.data[:,first:stop] = block
+		self.data.flush()
+
+		self.index['times'].extend(snap_time for snap_time, frame in self.buffer)
+		self.times = np.array(self.index['times'], dtype = np.float64)
+		self.buffer = []
+		self.save_index()
+
+	def grow(self, capacity):
+		"""
+		Rewrites data.bin with room for more frames (copied in blocks of stars, in bounded memory)
+
+		The new file replaces the old one by renaming, so readers that mapped the old file keep valid data.
+
+		@param[in]	capacity	new number of frames
+
+		@returns	None
+		"""
+		nStars, old_capacity = self.index['nStars'], self.index['capacity']
+		nTimes = len(self.index['times'])
+		data_file = os.path.join(self.path, 'data.bin')
+		grown = np.memmap(data_file + '.tmp', dtype = np.float32, mode = 'w+', shape = (nStars, capacity, FIELDS))
+		step = max(1, self.memory_MB*2**20//max(1, old_capacity*FIELDS*4))
+		for first in range(0, nStars, step):
+			grown[first:first + step,:nTimes] = self.data[first:first + step,:nTimes]
+		grown.flush()
+		del grown
+		self.data = None
+		os.rename(data_file + '.tmp', data_file)
+		self.index['capacity'] = capacity
+		self.save_index()
+		self.map_data()
+
+	def close(self):
+		"""
+		Writes the buffered frames and releases data.bin
+
+		@returns	None
+		"""
+		if self.writable:
+			self.flush()
+		self.data = None
+
+	def fetch(self, ids, start = 0, stop = None):
+		"""
+		Trajectories of a set of stars
+
+		The rows are read in ID order, as one contiguous read when the IDs are close together (e.g. a range
+		of IDs or a whole galaxy), otherwise one contiguous run per star.
+
+		@param[in]	ids			particle IDs
+		@param[in]	start, stop	range of frames (default: all stored frames)
+
+		@returns	(positions, velocities), float32 arrays of shape (len(ids) x frames x 3) in the order of ids
+		"""
+		ids = np.atleast_1d(ids)
+		stop = len(self) if stop is None else min(stop, len(self))
+		start = max(0, min(start, stop))
+		if self.data is None or len(ids) == 0:
+			empty = np.zeros((len(ids), stop - start, 3), dtype = np.float32)
+			return empty, empty.copy()
+
+		rows = self.rows_of(ids)
+		order = np.argsort(rows, kind = 'mergesort')
+		sorted_rows = rows[order]
+		lo, hi = int(sorted_rows[0]), int(sorted_rows[-1]) + 1
+		if hi - lo <= 2*len(rows):
+			block = np.array(self.data[lo:hi, start:stop])[sorted_rows - lo]
+		else:
+			block = self.data[sorted_rows, start:stop]
+		result = np.empty_like(block)
+		result[order] = block
+		return result[:,:,:3], result[:,:,3:]
+
+	def star(self, particle_id, start = 0, stop = None):
+		"""
+		Trajectory of one star
+
+		@param[in]	particle_id	particle ID
+		@param[in]	start, stop	range of frames (default: all stored frames)
+
+		@returns	(positions, velocities), float32 arrays of shape (frames x 3)
+		"""
+		pos, vel = self.fetch([particle_id], start, stop)
+		return pos[0], vel[0]
+
+def build(tipsy_prefix, path, ids = None, memory_MB = 256):
+	"""
+	Transposes every "[tipsy_prefix]{time}" snapshot into a new trajectory store (in time order)
+
+	@param[in]	tipsy_prefix	prefix of tipsy files
+	@param[in]	path			store directory
+	@param[in]	ids				particle IDs to store (default: None, all stars)
+	@param[in]	memory_MB		maximum size of the write buffer (default: 256)
+
+	@returns	the Trajectories object (opened for appending, see update())
+	"""
+	nFrames = len(tipsy.SnapshotSeries(tipsy_prefix, cache_size = 0))
+	store = Trajectories(path, 'w', ids, max(1, nFrames), memory_MB)
+	store.update(tipsy_prefix)
+	return store